@@ -0,0 +1,134 @@
+"""
+Local receivers for the alert sinks, to try alerts without a real webhook or mail server.
+
+    python alert_standins.py --webhook-port 8090 --smtp-port 8025
+
+Webhook rules then use http://localhost:8090/ as target, mails are sent with
+PRICETRACKER_SMTP_HOST=localhost PRICETRACKER_SMTP_PORT=8025. Everything received is printed and kept in `received`.
+"""
+import argparse
+import json
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+
+class WebhookReceiver:
+    # answers every POST with 204 and keeps the JSON body
+    def __init__(self, host='127.0.0.1', port=0, status=204):
+        self.received = []
+        self.status = status
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    payload = body.decode('utf-8', 'replace')
+                receiver.received.append(payload)
+                print(f"Webhook: {payload.get('text') if isinstance(payload, dict) else payload}")
+                self.send_response(receiver.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = HTTPServer((host, port), Handler)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='webhook-receiver', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class SmtpReceiver:
+    # minimal SMTP server, enough for smtplib.send_message without authentication or TLS
+    def __init__(self, host='127.0.0.1', port=0):
+        self.received = []
+        receiver = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def reply(self, line):
+                self.wfile.write(line.encode('ascii') + b'\r\n')
+
+            def handle(self):
+                self.reply('220 localhost stand-in')
+                sender, recipients = None, []
+                while True:
+                    line = self.rfile.readline().decode('utf-8', 'replace').rstrip('\r\n')
+                    if not line:
+                        return
+                    command = line[:4].upper()
+                    if command in ('HELO', 'EHLO'):
+                        self.reply('250 localhost')
+                    elif command == 'MAIL':
+                        sender, recipients = line.split(':', 1)[1].strip(), []
+                        self.reply('250 OK')
+                    elif command == 'RCPT':
+                        recipients.append(line.split(':', 1)[1].strip())
+                        self.reply('250 OK')
+                    elif command == 'DATA':
+                        self.reply('354 End data with <CR><LF>.<CR><LF>')
+                        lines = []
+                        while True:
+                            data = self.rfile.readline().decode('utf-8', 'replace').rstrip('\r\n')
+                            if data == '.':
+                                break
+                            lines.append(data[1:] if data.startswith('..') else data)
+                        message = {'sender': sender, 'recipients': recipients, 'data': '\n'.join(lines)}
+                        receiver.received.append(message)
+                        print(f"Mail to {', '.join(recipients)}:\n{message['data']}")
+                        self.reply('250 OK')
+                    elif command == 'QUIT':
+                        self.reply('221 Bye')
+                        return
+                    else:
+                        self.reply('250 OK')
+
+        self._server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self._server.daemon_threads = True
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name='smtp-receiver', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Receive alerts locally")
+    parser.add_argument('--webhook-port', type=int, default=8090)
+    parser.add_argument('--smtp-port', type=int, default=8025)
+    args = parser.parse_args()
+
+    webhook = WebhookReceiver(port=args.webhook_port).start()
+    smtp = SmtpReceiver(port=args.smtp_port).start()
+    print(f"Webhook target: {webhook.url}, SMTP: localhost:{smtp.port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        webhook.stop()
+        smtp.stop()
+
+
+if __name__ == '__main__':
+    main()
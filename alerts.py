@@ -0,0 +1,202 @@
+import json
+import os
+import smtplib
+import threading
+import time
+import traceback
+from collections import deque
+from email.message import EmailMessage
+
+import requests
+
+from db_handler import ALERT_ALL_TIME_LOW, ALERT_BACK_IN_STOCK, ALERT_BELOW, ALERT_DROP, DB_PATH, DbHandler
+
+SINK_FILE = 'file'
+SINK_WEBHOOK = 'webhook'
+SINK_SMTP = 'smtp'
+SINKS = [SINK_FILE, SINK_WEBHOOK, SINK_SMTP]
+
+DEFAULT_ALERT_FILE = 'alerts.log'
+POLL_INTERVAL = 2.0  # seconds between two looks at the outbox
+DEDUP_WINDOW = 24 * 3600  # seconds in which the same alert is only delivered once
+MAX_ATTEMPTS = 10
+RETRY_BASE_DELAY = 30  # seconds until a failed delivery is retried, doubled with every attempt
+RETRY_MAX_DELAY = 3600  # with MAX_ATTEMPTS, a sink may be down for about 3 hours without losing the alert
+RATE_LIMITS = {SINK_FILE: 600, SINK_WEBHOOK: 30, SINK_SMTP: 10}  # deliveries per minute
+WEBHOOK_TIMEOUT = 10  # seconds
+
+# the mail server is configured through the environment, e.g. the local stand-in of alert_standins.py:
+# PRICETRACKER_SMTP_HOST=localhost PRICETRACKER_SMTP_PORT=8025
+SMTP_HOST = os.environ.get('PRICETRACKER_SMTP_HOST', 'localhost')
+SMTP_PORT = int(os.environ.get('PRICETRACKER_SMTP_PORT', 25))
+SMTP_USER = os.environ.get('PRICETRACKER_SMTP_USER')
+SMTP_PASSWORD = os.environ.get('PRICETRACKER_SMTP_PASSWORD')
+SMTP_SENDER = os.environ.get('PRICETRACKER_SMTP_SENDER', 'pricetracker@localhost')
+SMTP_STARTTLS = os.environ.get('PRICETRACKER_SMTP_STARTTLS', '') == '1'
+SMTP_TIMEOUT = float(os.environ.get('PRICETRACKER_SMTP_TIMEOUT', 30))  # seconds, per connect / command
+
+
+def format_alert(alert):
+    # one line summary of an event of DbHandler.retrieve_pending_alerts
+    kind = alert['kind']
+    if kind == ALERT_BELOW:
+        text = f"is now {alert['price']}, below {alert['reference']}"
+    elif kind == ALERT_DROP:
+        text = f"dropped from {alert['reference']} to {alert['price']} (-{alert['threshold']:g} % or more)"
+    elif kind == ALERT_ALL_TIME_LOW:
+        text = f"is at a new all-time low of {alert['price']} (previous low {alert['reference']})"
+    elif kind == ALERT_BACK_IN_STOCK:
+        text = f"is available again for {alert['price']}"
+    else:
+        text = f"{kind}: {alert['price']}"
+    return f"{alert['name']} {text}"
+
+
+class FileSink:
+    # appends one JSON line per alert, the target is the file path
+    def send(self, alert):
+        line = json.dumps({'message': format_alert(alert), **alert})
+        with open(alert['target'] or DEFAULT_ALERT_FILE, 'a', encoding='utf-8') as file:
+            file.write(line + '\n')
+
+
+class WebhookSink:
+    # posts the alert as JSON to the target url
+    def send(self, alert):
+        response = requests.post(alert['target'], json={'text': format_alert(alert), **alert},
+                                 timeout=WEBHOOK_TIMEOUT)
+        response.raise_for_status()
+
+
+class SmtpSink:
+    # sends a mail to the target, several addresses are separated by commas
+    def send(self, alert):
+        message = EmailMessage()
+        message['Subject'] = f"Price alert: {alert['name']}"
+        message['From'] = SMTP_SENDER
+        message['To'] = alert['target']
+        message.set_content(f"{format_alert(alert)}\n\n{alert['url']}\n")
+
+        with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT) as smtp:
+            if SMTP_STARTTLS:
+                smtp.starttls()
+            if SMTP_USER:
+                smtp.login(SMTP_USER, SMTP_PASSWORD)
+            smtp.send_message(message)
+
+
+class RateLimiter:
+    # sliding window of the last minute
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self._sent = deque()
+
+    def acquire(self, now=None):
+        now = time.monotonic() if now is None else now
+        while self._sent and now - self._sent[0] >= 60:
+            self._sent.popleft()
+        if len(self._sent) >= self.per_minute:
+            return False
+        self._sent.append(now)
+        return True
+
+    def retry_after(self, now=None):
+        # seconds until the next delivery is allowed
+        now = time.monotonic() if now is None else now
+        if len(self._sent) < self.per_minute:
+            return 0.0
+        return max(0.0, 60 - (now - self._sent[0]))
+
+
+def retry_delay(attempts):
+    # seconds until the next attempt after `attempts` failed ones
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+class AlertDispatcher:
+    """
+    Delivers the alerts the price inserts put into alert_events.
+
+    A single thread polls the pending events, suppresses alerts that were already delivered within the dedup window
+    and hands the rest to the sink of their rule. Events over the rate limit of a sink are postponed until the sink
+    has capacity again, failed deliveries are retried with exponential backoff up to `max_attempts` times. Only due
+    events are read, so events waiting for a sink don't hold up the events of the other sinks.
+    """
+
+    def __init__(self, db_path=DB_PATH, sinks=None, rate_limits=None, poll_interval=POLL_INTERVAL,
+                 dedup_window=DEDUP_WINDOW, max_attempts=MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.sinks = sinks or {SINK_FILE: FileSink(), SINK_WEBHOOK: WebhookSink(), SINK_SMTP: SmtpSink()}
+        self.limiters = {sink: RateLimiter(per_minute)
+                         for sink, per_minute in {**RATE_LIMITS, **(rate_limits or {})}.items()}
+        self.poll_interval = poll_interval
+        self.dedup_window = dedup_window
+        self.max_attempts = max_attempts
+        self._thread = None
+
+    def run(self):
+        self._thread = threading.Thread(target=self._run, name='alert-dispatcher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # the connection is created on the dispatcher thread, sqlite connections must stay on their thread
+        db_handler = DbHandler(self.db_path)
+        db_handler.connect()
+        while True:
+            try:
+                self.dispatch(db_handler)
+            except Exception:
+                print(traceback.format_exc())
+            time.sleep(self.poll_interval)
+
+    def dispatch(self, db_handler):
+        # one round over the outbox, returns the number of delivered alerts
+        delivered = 0
+        postponed = {}  # next attempt -> ids of events over the rate limit
+        for alert in db_handler.retrieve_pending_alerts():
+            if db_handler.is_alert_delivered_since(alert['dedup_key'], int(time.time()) - self.dedup_window):
+                db_handler.update_alert_status(alert['id'], 'suppressed')
+                continue
+
+            sink = self.sinks.get(alert['sink'])
+            if sink is None:
+                db_handler.update_alert_status(alert['id'], 'failed', f"unknown sink {alert['sink']}")
+                continue
+            limiter = self.limiters.get(alert['sink'])
+            if limiter and not limiter.acquire():
+                next_attempt = int(time.time() + limiter.retry_after()) + 1
+                postponed.setdefault(next_attempt, []).append(alert['id'])
+                continue
+
+            attempts = alert['attempts'] + 1
+            try:
+                sink.send(alert)
+            except Exception as e:
+                if attempts >= self.max_attempts:
+                    db_handler.update_alert_status(alert['id'], 'failed', repr(e), attempts)
+                    print(f"Alert {alert['id']} could not be delivered, giving up after {attempts} attempts: {e!r}")
+                else:
+                    delay = retry_delay(attempts)
+                    db_handler.update_alert_status(alert['id'], 'pending', repr(e), attempts,
+                                                   int(time.time() + delay))
+                    print(f"Alert {alert['id']} could not be delivered, retry in {delay} s: {e!r}")
+                continue
+            db_handler.update_alert_status(alert['id'], 'delivered', None, attempts)
+            print(f"Alert delivered via {alert['sink']}: {format_alert(alert)}")
+            delivered += 1
+
+        for next_attempt, event_ids in postponed.items():
+            db_handler.postpone_alerts(event_ids, next_attempt)
+        return delivered
+
+
+# started once per process, by the crawler
+alert_dispatcher = None
+
+
+def start_alert_dispatcher(db_path=DB_PATH):
+    global alert_dispatcher
+    if alert_dispatcher is None:
+        alert_dispatcher = AlertDispatcher(db_path)
+        alert_dispatcher.run()
+    return alert_dispatcher
@@ -0,0 +1,366 @@
+import asyncio
+import atexit
+import contextvars
+import threading
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import aiohttp
+
+from crawl_executor import DEFAULT_MAX_PER_HOST, host_of
+from crawl_metrics import STAGE_DB_WRITE, STAGE_NAVIGATION, metrics
+from crawl_scheduler import CrawlScheduler, ELEMENT_REFRESH_INTERVAL, group_by_page
+from crawl_options import ENGINE_ASYNC
+from crawly import (CrawlEngine, driver_pool, element_outcome, extract_text_price, fetch_args, host_health,
+                    known_price, next_fetch_state, record_page_health, save_snapshots)
+from db_handler import DbHandler
+import fetcher
+from fetcher import (FETCH_MODE_AUTO, FETCH_MODE_HTTP, HTTP_HEADERS, HTTP_TIMEOUT, conditional_headers,
+                     fetch_browser_texts, fetch_steps, page_validators, parse_html)
+import page_snapshots
+from price_writer import MAX_ATTEMPTS, insert_batch, is_transient, retry_delay
+
+DEFAULT_MAX_IN_FLIGHT = 500
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 1.0  # seconds
+FETCH_ERRORS = fetcher.FETCH_ERRORS + (aiohttp.ClientError, asyncio.TimeoutError)
+STOP_TIMEOUT = 10  # seconds the queued prices may take to be written on exit
+
+
+class AsyncCrawly(CrawlEngine):
+    """
+    Event loop based alternative to `Crawly`.
+
+    Static pages are fetched with aiohttp, pages that need the browser are dispatched to the driver pool in a
+    thread pool. Prices are handed to a single writer coroutine that batches the inserts into price_history.
+    All database access runs on one dedicated thread, so the loop never blocks on SQLite.
+
+    The loop runs in a daemon thread, `stop` (registered with atexit, so also on SIGTERM) ends it: the pages in flight
+    are given up, the prices that were already extracted are still written.
+    """
+    name = ENGINE_ASYNC
+
+    def __init__(self, _db_handler: DbHandler, max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_per_host=DEFAULT_MAX_PER_HOST,
+                 batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.db_handler = _db_handler
+        if self.db_handler.conn is None:
+            self.db_handler.init_db()
+
+        self.max_in_flight = max_in_flight
+        self.max_per_host = max_per_host
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.scheduler = CrawlScheduler()
+        self._refresh = threading.Event()  # set by the control api, reloads the elements on the next iteration
+        self._db = None
+        self._db_executor = None
+        self._browser_executor = None
+        self._tasks = set()  # the event loop only keeps weak references to tasks
+        self._loop = None
+        self._stop = None
+        self._stopped = threading.Event()
+
+    def run(self):
+        self.started = time.time()
+        crawler_thread = threading.Thread(target=asyncio.run, args=[self.main()], name='async-crawly')
+        crawler_thread.daemon = True  # Daemonize the thread to exit when the main thread exits
+        crawler_thread.start()
+        atexit.register(self.stop, STOP_TIMEOUT)
+
+    def stop(self, timeout=None):
+        # ends the loop from another thread and waits until the queued prices are written
+        if self._loop is None or self._stopped.is_set():
+            return True
+        try:
+            self._loop.call_soon_threadsafe(self._stop.set)
+        except RuntimeError:
+            # the loop is already closed
+            return True
+        return self._stopped.wait(timeout)
+
+    async def main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='async-crawly-db')
+        self._browser_executor = ThreadPoolExecutor(max_workers=driver_pool.size,
+                                                    thread_name_prefix='async-crawly-browser')
+        self._db = await self._db_call(self._open_db)
+
+        results = asyncio.Queue(maxsize=self.batch_size * 10)
+        writer = asyncio.create_task(self._writer(results))
+
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        host_limits = defaultdict(lambda: asyncio.Semaphore(self.max_per_host))
+        running = set()
+        scheduler = self.scheduler
+        elements = {}
+        last_refresh = None
+
+        # queue depths, evaluated on every scrape of the metrics endpoint
+        metrics.register_gauge('crawl_scheduled_elements', "Elements in the schedule", lambda: len(scheduler))
+        metrics.register_gauge('crawl_overdue_elements',
+                               "Elements whose due time has passed, but weren't dispatched yet", scheduler.overdue)
+        metrics.register_gauge('crawl_running_elements', "Elements of the pages that are being crawled",
+                               lambda: len(running))
+        metrics.register_gauge('crawl_price_writer_queued', "Prices waiting for the price writer", results.qsize)
+        metrics.register_gauge('crawl_driver_pool_sessions', "Browser sessions of the driver pool",
+                               lambda: {state: count for state, count in driver_pool.stats().items()
+                                        if state in ('idle', 'alive')}, label='state')
+        metrics.register_gauge('crawl_hosts_failing', "Hosts whose circuit is open or being probed",
+                               host_health.open_hosts)
+
+        connector = aiohttp.TCPConnector(limit=self.max_in_flight, limit_per_host=self.max_per_host)
+        timeout = aiohttp.ClientTimeout(total=HTTP_TIMEOUT)
+        async with aiohttp.ClientSession(connector=connector, headers=HTTP_HEADERS, timeout=timeout) as session:
+            try:
+                while not self._stop.is_set():
+                    now = time.monotonic()
+                    if last_refresh is None or now - last_refresh >= ELEMENT_REFRESH_INTERVAL or self._refresh.is_set():
+                        self._refresh.clear()
+                        elements = await self._db_call(self._load_active_elements)
+                        host_health.load(await self._db_call(self._db.retrieve_host_health))
+                        if last_refresh is None:
+                            # due times are restored from the database, overdue jobs are caught up gradually
+                            scheduler.load(elements.values())
+                        else:
+                            scheduler.sync(elements.values())
+                        last_refresh = now
+
+                    # due elements on the same page are crawled together, pages of failing hosts wait for their probe
+                    for url, element_ids in group_by_page(scheduler.pop_due()):
+                        postpone_until = host_health.admit(host_of(url))
+                        if postpone_until is not None:
+                            scheduler.postpone(element_ids, postpone_until)
+                            continue
+                        page_elements = [elements[element_id] for element_id in element_ids
+                                         if element_id in elements and element_id not in running]
+                        if not page_elements:
+                            continue
+
+                        page_ids = {int(element['id']) for element in page_elements}
+                        running.update(page_ids)
+                        task = asyncio.create_task(
+                            self._crawl_page(session, url, page_elements, results, in_flight,
+                                             host_limits[host_of(url)], scheduler))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                        task.add_done_callback(lambda _, ids=page_ids: running.difference_update(ids))
+
+                    dirty = scheduler.take_dirty()
+                    if dirty:
+                        await self._db_call(self._db.update_next_due, dirty)
+                    host_states = host_health.take_dirty()
+                    if host_states:
+                        await self._db_call(self._db.update_host_health, host_states)
+
+                    try:
+                        await asyncio.wait_for(self._stop.wait(), 1)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                # the pages in flight stay due, the prices that were already queued are written before the writer ends
+                for task in list(self._tasks):
+                    task.cancel()
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+                await results.put(None)
+                await writer
+                self._db_executor.shutdown(wait=False)
+                self._browser_executor.shutdown(wait=False)
+                self._stopped.set()
+
+    def refresh(self):
+        self._refresh.set()
+
+    async def _crawl_page(self, session, url, page_elements, results, in_flight, host_limit, scheduler):
+        host = host_of(url)
+        element_ids = [int(element['id']) for element in page_elements]
+        reported = 0
+        outcomes = []
+        # the token is taken before the trace, the wait counts as scheduler lag
+        wait = host_health.reserve(host)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        with metrics.trace(host, url, element_ids):
+            try:
+                states = await self._db_call(self._db.retrieve_fetch_state, element_ids)
+                validators = page_validators([states.get(element_id) for element_id in element_ids])
+                async with in_flight, host_limit:
+                    extracted = [{} for _ in page_elements]
+                    elements = [fetch_args(element, states.get(element_id), extracted[i])
+                                for i, (element_id, element) in enumerate(zip(element_ids, page_elements))]
+                    texts, page = await self._fetch_elements_text(session, url, elements, validators)
+
+                fetch_states = []
+                missing = []
+                for i, (element_id, element, (text_content, used_fetch_mode)) in enumerate(
+                        zip(element_ids, page_elements, texts)):
+                    state = states.get(element_id)
+                    confirmed_price = known_price(state, page, text_content, used_fetch_mode)
+                    price = await self._save_price(element, text_content, used_fetch_mode, results, confirmed_price,
+                                                   extracted[i])
+                    outcomes.append(element_outcome(text_content, confirmed_price, price))
+                    metrics.element_result(element_id, host, outcomes[-1], mode=used_fetch_mode, price=price)
+                    reported += 1
+                    if price == -1:
+                        missing.append(element_id)
+
+                    fetch_state = next_fetch_state(element_id, state, page, text_content, used_fetch_mode, price)
+                    if fetch_state:
+                        fetch_states.append(fetch_state)
+
+                if fetch_states:
+                    await self._db_call(self._db.update_fetch_state, fetch_states)
+                if page['snapshots'] and (fetch_states or missing):
+                    # compressed on the db thread
+                    await self._db_call(save_snapshots, self._db, url, page)
+                if missing:
+                    await self._db_call(self._db.record_missing_prices, missing)
+                retry = record_page_health(host, element_ids, outcomes, page)
+                if retry is not None:
+                    scheduler.retry(element_ids, retry)
+            except Exception:
+                print(traceback.format_exc())
+            finally:
+                for element_id in element_ids[reported:]:
+                    metrics.element_result(element_id, host, 'error')
+
+    async def _save_price(self, element, text_content, used_fetch_mode, results, price=None, extracted=None):
+        # returns the saved price, -1 if none was found. a given price (confirmed previous price) is saved as it is,
+        # see crawly.save_price for `extracted`
+        element_id = int(element['id'])
+        try:
+            price_str = price
+            if price is None and text_content is not None:
+                if extracted and text_content in extracted:
+                    price_str = extracted[text_content]
+                else:
+                    price_str = extract_text_price(text_content, element, used_fetch_mode)
+            if not price_str:
+                print(f"Could not extract price for element {element_id}")
+                return -1
+
+            extracted_price = float(price_str)
+            current_timestamp = int(time.time())
+            await results.put((element_id, extracted_price, current_timestamp))
+            print(f"Extracted Price: {extracted_price}")
+
+            # remember the mode that worked, so the next run goes straight to it
+            fetch_mode = element.get('fetch_mode') or FETCH_MODE_AUTO
+            if fetch_mode == FETCH_MODE_AUTO and used_fetch_mode and used_fetch_mode != element.get('detected_fetch_mode'):
+                element['detected_fetch_mode'] = used_fetch_mode
+                await self._db_call(self._db.update_detected_fetch_mode, element_id, used_fetch_mode)
+            return extracted_price
+        except ValueError:
+            print(f"Could not convert extracted price to float for element {element_id}")
+            return -1
+
+    async def _fetch_elements_text(self, session, url, elements, validators=None):
+        # the fetch loop of fetcher.fetch_elements_text (`elements` are crawly.fetch_args), with the HTTP requests sent
+        # by aiohttp and the browser run in the thread pool
+        async def load(mode, browser_profile, selectors, page):
+            if mode == FETCH_MODE_HTTP:
+                return await self._fetch_http_page(session, url, validators)
+            # the context is copied, so the browser stages are added to the trace of this page
+            return await asyncio.get_running_loop().run_in_executor(
+                self._browser_executor, contextvars.copy_context().run, fetch_browser_texts, driver_pool, url,
+                selectors, browser_profile, page)
+
+        steps = fetch_steps(url, elements, validators, page_snapshots.snapshot_scheduled_crawls, FETCH_ERRORS)
+        try:
+            step = next(steps)
+            while True:
+                try:
+                    loaded = await load(*step)
+                except Exception as e:
+                    step = steps.throw(e)
+                else:
+                    step = steps.send(loaded)
+        except StopIteration as stop:
+            return stop.value
+
+    @staticmethod
+    async def _fetch_http_page(session, url, validators=None):
+        # see fetcher.fetch_http_page
+        headers = conditional_headers(validators)
+        with metrics.stage(STAGE_NAVIGATION, host_of(url), FETCH_MODE_HTTP) as result:
+            async with session.get(url, headers=headers) as response:
+                if response.status == 304 and headers:
+                    result['outcome'] = 'not_modified'
+                    return None, validators
+                response.raise_for_status()
+                content = await response.read()
+                response_validators = (response.headers.get('ETag'), response.headers.get('Last-Modified'))
+        return parse_html(content, url, response.charset), response_validators
+
+    async def _writer(self, results):
+        # writes until it gets None, the rows collected up to then are still written
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            row = await results.get()
+            if row is None:
+                break
+            rows = [row]
+
+            # collect until the batch is full or the flush interval is over
+            deadline = loop.time() + self.flush_interval
+            while len(rows) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(results.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                rows.append(row)
+
+            await self._write(rows)
+
+    async def _write(self, rows, attempts=MAX_ATTEMPTS):
+        # like price_writer.PriceWriter: a batch is retried with backoff while the database is locked, on other errors
+        # MAX_ATTEMPTS times, then it is split until the rows that can't be written are found and dropped
+        attempt = 0
+        while True:
+            with metrics.stage(STAGE_DB_WRITE) as result:
+                error = await self._db_call(insert_batch, self._db, rows)
+                result['outcome'] = 'ok' if error is None else 'error'
+            if error is None:
+                metrics.inc('crawl_prices_written_total', "Prices written to price_history", len(rows))
+                print(f"{len(rows)} prices inserted into DB")
+                return
+            attempt += 1
+            if not is_transient(error) and attempt >= attempts:
+                break
+            delay = retry_delay(attempt - 1)
+            print(f"Writing {len(rows)} prices failed, retry {attempt} in {delay:.1f} s")
+            await asyncio.sleep(delay)
+
+        if len(rows) > 1:
+            middle = len(rows) // 2
+            await self._write(rows[:middle], 1)
+            await self._write(rows[middle:], 1)
+        else:
+            print(f"Dropping price {rows[0]}: {error}")
+            metrics.inc('crawl_prices_dropped_total', "Prices that couldn't be written to price_history")
+
+    async def _db_call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, func, *args)
+
+    @staticmethod
+    def _open_db():
+        # opened on the db thread, sqlite connections must stay on the thread that created them
+        _db_handler = DbHandler()
+        _db_handler.init_db()
+        return _db_handler
+
+    def _load_active_elements(self):
+        df_tracked_elements = self._db.retrieve_tracked_elements(with_stats=True)
+        if df_tracked_elements.empty:
+            return {}
+        return {int(row['id']): row.to_dict() for _, row in df_tracked_elements.iterrows() if row['is_active']}
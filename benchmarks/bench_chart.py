@@ -0,0 +1,70 @@
+"""
+Labeling and summary of the chart data, compared with the former row by row loop.
+
+    python -m benchmarks.bench_chart --sizes 10000 100000 1000000 --legacy-max 100000
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from chart_data import prepare_chart_data
+
+
+def generate_history(rows, elements=20):
+    rng = np.random.default_rng(42)
+    # prices change in roughly every 10th crawl
+    changes = rng.random(rows) < 0.1
+    prices = np.round(100 + np.cumsum(np.where(changes, rng.normal(0, 2, rows), 0)), 2)
+    return pd.DataFrame({
+        'name': [f'Element {i % elements}' for i in range(rows)],
+        'current_price': prices[rng.permutation(rows)],
+        'timestamp': pd.date_range('2024-01-01', periods=rows, freq='min'),
+    })
+
+
+def legacy_labels(df):
+    # the loop display_line_plot used before
+    df = df.sort_values(by='timestamp')
+    text_values = []
+    for name in df['name'].unique():
+        subset_df = df[df['name'] == name]
+        last_price = None
+        trace_text = []
+        for index, row in subset_df.iterrows():
+            if row['current_price'] != last_price:
+                trace_text.append(row['current_price'])
+                last_price = row['current_price']
+            else:
+                trace_text.append("")
+        text_values.extend(trace_text)
+    df['text'] = text_values
+    return df
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--legacy-max', type=int, default=100_000, help="largest size the old loop is run for")
+    args = parser.parse_args()
+
+    print(f"{'rows':>10} {'vectorized ms':>14} {'us/row':>8} {'legacy ms':>12} {'us/row':>8}")
+    for rows in args.sizes:
+        df = generate_history(rows)
+        vectorized_ms = timed(prepare_chart_data, df)
+        line = f"{rows:>10} {vectorized_ms:>14.1f} {vectorized_ms * 1000 / rows:>8.2f}"
+        if rows <= args.legacy_max:
+            legacy_ms = timed(legacy_labels, df)
+            line += f" {legacy_ms:>12.1f} {legacy_ms * 1000 / rows:>8.2f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
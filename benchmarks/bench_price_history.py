@@ -0,0 +1,98 @@
+"""
+Query times of price_history before and after the schema migrations.
+
+    python -m benchmarks.bench_price_history --rows 10000000 --elements 500
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from db_handler import DbHandler
+
+START_EPOCH = 1704067200  # 2024-01-01
+INTERVAL = 300  # one price every 5 minutes
+
+
+def create_legacy_db(path, rows, elements):
+    # schema and text timestamps as written before the migrations existed
+    conn = sqlite3.connect(path)
+    conn.execute('''CREATE TABLE tracked_elements (
+                        id INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, url VARCHAR(2048) NOT NULL,
+                        xpath TEXT NOT NULL, update_interval INTEGER NOT NULL,
+                        is_active BOOLEAN NOT NULL DEFAULT TRUE, regex TEXT NOT NULL)''')
+    conn.execute('''CREATE TABLE price_history (
+                        id INTEGER PRIMARY KEY, tracked_elements_id INTEGER NOT NULL,
+                        current_price DOUBLE NOT NULL, timestamp TIMESTAMP NOT NULL)''')
+    conn.executemany('''INSERT INTO tracked_elements (id, name, url, xpath, update_interval, is_active, regex)
+                        VALUES (?, ?, ?, '//span', 5, 1, '\\d+')''',
+                     [(i, f'Element {i}', f'https://shop{i % 20}.example/p/{i}') for i in range(1, elements + 1)])
+
+    def generate():
+        # crawls of all elements interleave, like in a real database
+        for i in range(rows):
+            element_id = i % elements + 1
+            epoch = START_EPOCH + (i // elements) * INTERVAL
+            yield element_id, round(random.uniform(1, 500), 2), time.strftime('%Y-%m-%d %H:%M:%S',
+                                                                                time.localtime(epoch))
+
+    conn.executemany('''INSERT INTO price_history (tracked_elements_id, current_price, timestamp) 
+                        VALUES (?, ?, ?)''', generate())
+    conn.commit()
+    conn.close()
+
+
+def timed(func, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run_queries(db_handler, label, rows, elements, element_id):
+    last_day = time.strftime('%Y-%m-%d %H:%M:%S',
+                             time.localtime(START_EPOCH + (rows // elements) * INTERVAL - 24 * 3600))
+    print(f"{label:<12} one element: {timed(lambda: db_handler.retrieve_price_history([element_id])):9.1f} ms"
+          f"   last day: {timed(lambda: db_handler.retrieve_price_history([element_id], start=last_day)):9.1f} ms"
+          f"   delete: {timed(lambda: db_handler.delete_tracked_element_by_id([element_id]), repeat=1):9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10_000_000)
+    parser.add_argument('--elements', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+
+        start = time.perf_counter()
+        create_legacy_db(path, args.rows, args.elements)
+        print(f"Generated {args.rows} rows for {args.elements} elements in {time.perf_counter() - start:.1f} s")
+
+        db_handler = DbHandler(path)
+        db_handler.connect()
+        # the legacy layout has text timestamps, only the plain element query is comparable
+        legacy_query = '''SELECT * FROM price_history WHERE tracked_elements_id = ?'''
+        legacy_ms = timed(lambda: db_handler.conn.execute(legacy_query, (1,)).fetchall())
+        print(f"{'legacy':<12} one element: {legacy_ms:9.1f} ms")
+
+        start = time.perf_counter()
+        db_handler.migrate()
+        print(f"Migrated in {time.perf_counter() - start:.1f} s")
+        run_queries(db_handler, 'indexed', args.rows, args.elements, element_id=1)
+
+        start = time.perf_counter()
+        db_handler.set_price_history_layout(clustered=True)
+        print(f"Clustered in {time.perf_counter() - start:.1f} s")
+        run_queries(db_handler, 'clustered', args.rows, args.elements, element_id=2)
+
+        db_handler.close_db()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Fills a database with synthetic tracked elements and price history.
+
+    python -m benchmarks.generate_db --elements 500 --rows 1000000 --db pricetracker.db
+
+Prices are written through DbHandler.insert_price_rows, so runs, rollups and crawl statistics are maintained as by
+the crawler. The history ends now and goes back `rows / elements` crawls of `interval` seconds per element.
+An existing database with tracked elements is only extended with --force.
+"""
+import argparse
+import os
+import random
+import time
+
+import pandas as pd
+
+from db_handler import DB_PATH, DbHandler
+
+DEFAULT_ELEMENTS = 100
+DEFAULT_ROWS = 100_000
+DEFAULT_INTERVAL = 300  # seconds between two crawls of an element
+DEFAULT_CHANGE_PROBABILITY = 0.05  # share of the crawls that see a new price
+CHUNK_SIZE = 10_000
+
+
+def generate_elements(count, base_url='https://shop{shop}.example', seed=42, shops=20, js=False, first=0):
+    # elements of the same product share a page, like price and shipping costs. with `js` the pages are the ones
+    # rendered by javascript and the elements are crawled with the browser. the products are numbered from `first` on
+    rng = random.Random(seed)
+    rows = []
+    for i in range(first, first + count):
+        product_id = i // 2
+        rows.append({
+            'name': f'Product {product_id} {"price" if i % 2 == 0 else "shipping"}',
+            'url': f"{base_url.format(shop=product_id % shops)}/{'js' if js else 'static'}/{product_id}",
+            'xpath': '//span[@class="price"]' if i % 2 == 0 else 'p.shipping',
+            'regex': r'[-+]?\d{1,3}(?:[.,]\d{3})*(?:[.,]\d+)',
+            'update_interval': rng.choice([5, 15, 60, 240]),
+            'is_active': 1,
+            'fetch_mode': 'browser' if js else 'http',
+        })
+    return pd.DataFrame(rows)
+
+
+def generate_price_rows(element_ids, rows, interval=DEFAULT_INTERVAL, change_probability=DEFAULT_CHANGE_PROBABILITY,
+                        seed=42, end=None):
+    # yields (element_id, price, timestamp) in time order, the crawls of all elements interleave
+    rng = random.Random(seed)
+    end = int(time.time() if end is None else end)
+    crawls = -(-rows // len(element_ids))
+    prices = {element_id: round(rng.uniform(5, 2500), 2) for element_id in element_ids}
+    for i in range(rows):
+        crawl, position = divmod(i, len(element_ids))
+        element_id = element_ids[position]
+        if rng.random() < change_probability:
+            prices[element_id] = round(max(0.5, prices[element_id] * rng.uniform(0.85, 1.15)), 2)
+        # the elements are spread over the interval
+        timestamp = end - (crawls - crawl) * interval + position * interval // len(element_ids)
+        yield element_id, prices[element_id], timestamp
+
+
+def generate_db(db_path=DB_PATH, elements=DEFAULT_ELEMENTS, rows=DEFAULT_ROWS, interval=DEFAULT_INTERVAL,
+                change_probability=DEFAULT_CHANGE_PROBABILITY, base_url='https://shop{shop}.example', seed=42,
+                force=False, js=False):
+    """
+    Creates `elements` tracked elements and `rows` prices for them, returns the element ids. `base_url` may contain
+    {shop}, e.g. the url of a local ShopServer.
+    """
+    db_handler = DbHandler(db_path)
+    db_handler.init_db()
+    try:
+        existing = db_handler.conn.execute('SELECT COUNT(*) FROM tracked_elements').fetchone()[0]
+        if existing and not force:
+            raise ValueError(f"{db_path} already contains {existing} tracked elements, use force to extend it")
+
+        # the numbering continues after the existing elements, names are unique
+        first = db_handler.conn.execute('SELECT COALESCE(MAX(id), 0) FROM tracked_elements').fetchone()[0]
+        element_ids = [db_handler.insert_tracked_element(pd.DataFrame([row]))
+                       for row in generate_elements(elements, base_url, seed, js=js, first=first).to_dict('records')]
+
+        chunk = []
+        for row in generate_price_rows(element_ids, rows, interval, change_probability, seed):
+            chunk.append(row)
+            if len(chunk) >= CHUNK_SIZE:
+                db_handler.insert_price_rows(chunk)
+                chunk = []
+        if chunk:
+            db_handler.insert_price_rows(chunk)
+        return element_ids
+    finally:
+        db_handler.close_db()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a database with synthetic elements and price history")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--elements', type=int, default=DEFAULT_ELEMENTS)
+    parser.add_argument('--rows', type=int, default=DEFAULT_ROWS)
+    parser.add_argument('--interval', type=int, default=DEFAULT_INTERVAL, help="seconds between two crawls")
+    parser.add_argument('--change-probability', type=float, default=DEFAULT_CHANGE_PROBABILITY)
+    parser.add_argument('--base-url', default='https://shop{shop}.example',
+                        help="e.g. the url of benchmarks.shop_server, {shop} is replaced by a shop number")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--force', action='store_true', help="add to a database that already has tracked elements")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    try:
+        generate_db(os.path.abspath(args.db), args.elements, args.rows, args.interval, args.change_probability,
+                    args.base_url, args.seed, args.force)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Generated {args.elements} elements and {args.rows} prices in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
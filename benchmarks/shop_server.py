@@ -0,0 +1,177 @@
+"""
+Local shop with synthetic product pages, so crawl benchmarks run offline.
+
+    python -m benchmarks.shop_server --port 8800 --latency-ms 50 --page-kb 100
+
+    /static/<id>  price and shipping costs in the initial HTML
+    /js/<id>      both are rendered by javascript after the DOM is loaded (needs the browser)
+
+Latency, page size and render delay can be set per server or per request (?latency_ms=&page_kb=&render_ms=).
+Prices are derived from the seed, the product id and the current time, they change every `change_interval` seconds.
+Responses carry an ETag and conditional requests are answered with 304.
+"""
+import argparse
+import hashlib
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PRICE_SELECTOR = '//span[@class="price"]'
+SHIPPING_SELECTOR = 'p.shipping'
+PRICE_REGEX = r'[-+]?\d{1,3}(?:[.,]\d{3})*(?:[.,]\d+)'
+
+STATIC_TEMPLATE = '''<!DOCTYPE html>
+<html><head><title>Product {product_id}</title></head>
+<body>
+<h1>Product {product_id}</h1>
+<div class="product"><span class="price">{price} €</span><p class="shipping">Versand {shipping} €</p></div>
+<div class="description">{padding}</div>
+</body></html>'''
+
+JS_TEMPLATE = '''<!DOCTYPE html>
+<html><head><title>Product {product_id}</title></head>
+<body>
+<h1>Product {product_id}</h1>
+<div class="product" id="product"></div>
+<div class="description">{padding}</div>
+<script>
+document.addEventListener('DOMContentLoaded', function () {{
+    setTimeout(function () {{
+        document.getElementById('product').innerHTML =
+            '<span class="price">{price} €</span><p class="shipping">Versand {shipping} €</p>';
+    }}, {render_ms});
+}});
+</script>
+</body></html>'''
+
+
+def format_price(value):
+    # german notation, like most of the tracked shops
+    return f'{value:,.2f}'.replace(',', ' ').replace('.', ',').replace(' ', '.')
+
+
+class ShopServer:
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, page_kb=20, render_ms=0, change_interval=3600,
+                 seed=42):
+        self.latency_ms = latency_ms
+        self.page_kb = page_kb
+        self.render_ms = render_ms
+        self.change_interval = change_interval
+        self.seed = seed
+        self.requests = 0
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+        shop = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, like a real shop
+
+            def do_GET(self):
+                shop.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def url(self, product_id, js=False):
+        return f"{self.base_url}/{'js' if js else 'static'}/{product_id}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='shop-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def price(self, product_id, now=None):
+        # stable within a change interval, reproducible for the same seed
+        now = time.time() if now is None else now
+        rng = random.Random(f'{self.seed}-{product_id}-{int(now // self.change_interval)}')
+        return round(rng.uniform(5, 2500), 2), round(rng.choice([0, 3.9, 4.9, 5.9]), 2)
+
+    def render(self, kind, product_id, page_kb, render_ms):
+        price, shipping = self.price(product_id)
+        # deterministic filler text, so the page has the requested size and its ETag only changes with the price
+        padding = ('Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * (page_kb * 1024 // 57 + 1))
+        padding = padding[:page_kb * 1024]
+        template = JS_TEMPLATE if kind == 'js' else STATIC_TEMPLATE
+        return template.format(product_id=product_id, price=format_price(price), shipping=format_price(shipping),
+                               padding=padding, render_ms=render_ms).encode('utf-8')
+
+    def handle(self, request):
+        parts = urlsplit(request.path)
+        params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        segments = parts.path.strip('/').split('/')
+        if len(segments) != 2 or segments[0] not in ('static', 'js') or not segments[1].isdigit():
+            request.send_error(404)
+            return
+
+        latency_ms = float(params.get('latency_ms', self.latency_ms))
+        if latency_ms:
+            time.sleep(latency_ms / 1000)
+
+        body = self.render(segments[0], int(segments[1]), int(params.get('page_kb', self.page_kb)),
+                           int(params.get('render_ms', self.render_ms)))
+        etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+        with self._lock:
+            self.requests += 1
+            if request.headers.get('If-None-Match') == etag:
+                self.not_modified += 1
+
+        if request.headers.get('If-None-Match') == etag:
+            request.send_response(304)
+            request.send_header('ETag', etag)
+            request.send_header('Content-Length', '0')
+            request.end_headers()
+            return
+
+        request.send_response(200)
+        request.send_header('Content-Type', 'text/html; charset=utf-8')
+        request.send_header('Content-Length', str(len(body)))
+        request.send_header('ETag', etag)
+        request.end_headers()
+        request.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic product pages")
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--page-kb', type=int, default=20)
+    parser.add_argument('--render-ms', type=int, default=0, help="delay of the javascript rendering")
+    parser.add_argument('--change-interval', type=int, default=3600, help="seconds until the prices change")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    shop = ShopServer(port=args.port, latency_ms=args.latency_ms, page_kb=args.page_kb, render_ms=args.render_ms,
+                      change_interval=args.change_interval, seed=args.seed).start()
+    print(f"Serving {shop.url(1)} and {shop.url(1, js=True)}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        shop.stop()
+
+
+if __name__ == '__main__':
+    main()
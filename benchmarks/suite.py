@@ -0,0 +1,316 @@
+"""
+Benchmark scenarios that run offline against a local shop and generated databases.
+
+    python -m benchmarks.suite --output results.json
+    python -m benchmarks.suite --scenarios crawl history --output new.json --compare results.json
+
+Scenarios:
+    crawl          scheduled crawls of static pages from benchmarks.shop_server, a cold run and a second run that is
+                   answered with 304
+    crawl_browser  the same for javascript rendered pages with the browser (skipped if Firefox can't be started)
+    history        DbHandler.retrieve_price_history / retrieve_price_rollup on a generated history
+    chart          load_chart_data and display_line_plot of the dashboard
+    extract        extract_price on typical price texts
+
+Everything runs in a temporary directory. The results are written as JSON (metrics ending in _ms / _us: lower is
+better, _per_s: higher is better), --compare prints the change against a previous result file.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.generate_db import generate_db
+from benchmarks.shop_server import ShopServer
+from db_handler import DbHandler
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EXTRACT_SAMPLES = [
+    ('19,99 €', r'[-+]?\d{1,3}(?:[.,]\d{3})*(?:[.,]\d+)'),
+    ('EUR 1.299,00 inkl. MwSt.', r'[-+]?\d{1,3}(?:[.,]\d{3})*(?:[.,]\d+)'),
+    ('$1,049.95', r'[-+]?\d{1,3}(?:[.,]\d{3})*(?:[.,]\d+)'),
+    ('Jetzt nur 4,90 € statt 6,90 €', r'[-+]?\d{1,3}(?:[.,]\d{3})*(?:[.,]\d+)'),
+    ('   Preis:\n 249.- ', r'\d+'),
+    ('ausverkauft', r'[-+]?\d{1,3}(?:[.,]\d{3})*(?:[.,]\d+)'),
+]
+
+
+def timed(func, repeat=5):
+    # best of `repeat` runs in ms
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def percentiles_ms(durations):
+    if not durations:
+        return {}
+    p50, p95 = np.percentile(durations, [50, 95]) * 1000
+    return {'p50_ms': round(float(p50), 3), 'p95_ms': round(float(p95), 3)}
+
+
+def crawl_pages(urls_and_ids, workers):
+    # runs all pages through the crawl executor like the scheduler does, returns the wall time and page durations
+    import crawly
+    from crawl_executor import CrawlExecutor
+
+    durations = []
+
+    def task(element_ids):
+        start = time.perf_counter()
+        try:
+            crawly.execute_page(element_ids)
+        finally:
+            durations.append(time.perf_counter() - start)
+
+    executor = CrawlExecutor(task, max_workers=workers, max_per_host=workers, queue_size=len(urls_and_ids) + 1)
+    start = time.perf_counter()
+    for url, element_ids in urls_and_ids:
+        executor.submit(element_ids, url)
+    while len(durations) < len(urls_and_ids):
+        time.sleep(0.005)
+    crawly.get_price_writer().flush()
+    return time.perf_counter() - start, durations
+
+
+def run_crawl(args, js=False):
+    from crawl_scheduler import group_by_page
+
+    elements = args.browser_elements if js else args.crawl_elements
+    with ShopServer(latency_ms=args.latency_ms, page_kb=args.page_kb, render_ms=args.render_ms) as shop:
+        # both crawl scenarios add their elements to the same database, the crawler keeps its connections open
+        db_path = os.path.abspath('pricetracker.db')
+        element_ids = generate_db(db_path, elements=elements, rows=0, base_url=shop.base_url, force=True, js=js)
+
+        db_handler = DbHandler(db_path)
+        db_handler.connect()
+        tracked_elements = db_handler.retrieve_tracked_elements().set_index('id')
+        prices_before = db_handler.conn.execute('SELECT COUNT(*) FROM price_history').fetchone()[0]
+        db_handler.close_db()
+        pages = group_by_page((element_id, tracked_elements.at[element_id, 'url']) for element_id in element_ids)
+
+        result = {'elements': elements, 'pages': len(pages), 'workers': args.workers}
+        # the crawler prints every step, which would dominate the timings
+        with contextlib.redirect_stdout(io.StringIO()):
+            for run in ('cold', 'unchanged'):
+                requests_before = shop.requests
+                seconds, durations = crawl_pages(pages, args.workers)
+                result[run] = {
+                    'pages_per_s': round(len(pages) / seconds, 2),
+                    'elements_per_s': round(elements / seconds, 2),
+                    **percentiles_ms(durations),
+                    'requests': shop.requests - requests_before,
+                }
+            result['not_modified'] = shop.not_modified
+
+        db_handler.connect()
+        result['prices'] = db_handler.conn.execute('SELECT COUNT(*) FROM price_history').fetchone()[0] - prices_before
+        db_handler.close_db()
+    return result
+
+
+def run_crawl_browser(args):
+    from crawly import driver_pool
+    try:
+        with driver_pool.driver():
+            pass
+    except Exception as e:
+        return {'skipped': f"browser not available: {type(e).__name__}"}
+    return run_crawl(args, js=True)
+
+
+def history_db(args):
+    # shared by the history and chart scenarios
+    db_path = os.path.abspath('history.db')
+    if not os.path.exists(db_path):
+        generate_db(db_path, elements=args.history_elements, rows=args.history_rows)
+    db_handler = DbHandler(db_path)
+    db_handler.connect()
+    return db_handler
+
+
+def run_history(args):
+    db_handler = history_db(args)
+    try:
+        end = int(time.time())
+        element_ids = db_handler.retrieve_tracked_elements()['id'].tolist()[:10]
+        return {
+            'elements': args.history_elements,
+            'rows': args.history_rows,
+            'one_element_ms': round(timed(lambda: db_handler.retrieve_price_history(element_ids[:1])), 3),
+            'one_element_last_day_ms': round(timed(
+                lambda: db_handler.retrieve_price_history(element_ids[:1], start=end - 24 * 3600)), 3),
+            'one_element_expanded_ms': round(timed(
+                lambda: db_handler.retrieve_price_history(element_ids[:1], expand=True)), 3),
+            'ten_elements_ms': round(timed(lambda: db_handler.retrieve_price_history(element_ids)), 3),
+            'ten_elements_hourly_ms': round(timed(lambda: db_handler.retrieve_price_rollup(element_ids, 'hour')), 3),
+            'tracked_elements_with_stats_ms': round(timed(
+                lambda: db_handler.retrieve_tracked_elements(with_stats=True)), 3),
+        }
+    finally:
+        db_handler.close_db()
+
+
+def run_chart(args):
+    # the dashboard module needs streamlit, outside of `streamlit run` its calls only log a warning
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    from price_tracker import display_line_plot, load_chart_data
+
+    def render(df):
+        # plotly's deprecation warnings of the installed pandas version
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', FutureWarning)
+            display_line_plot(df)
+
+    db_handler = history_db(args)
+    try:
+        selection = db_handler.retrieve_tracked_elements().head(args.chart_elements)[['id', 'name']]
+        element_ids = selection['id'].tolist()
+        end = datetime.now().date()
+        result = {'elements': len(element_ids)}
+        for label, date_range in (('all', ()), ('last_2_days', (end - timedelta(days=1), end))):
+            df, resolution = load_chart_data(db_handler, element_ids, date_range)
+            merged_df = pd.merge(df, selection, left_on='tracked_elements_id', right_on='id', how='left',
+                                 suffixes=('_price_history', '_selection'))
+            result[label] = {
+                'resolution': resolution or 'all',
+                'points': len(merged_df),
+                'load_ms': round(timed(lambda: load_chart_data(db_handler, element_ids, date_range)), 3),
+                'render_ms': round(timed(lambda: render(merged_df.copy()), repeat=3), 3),
+            }
+        return result
+    finally:
+        db_handler.close_db()
+
+
+def run_extract(args):
+    from crawly import extract_price
+
+    iterations = args.extract_iterations
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text, pattern in EXTRACT_SAMPLES:
+            extract_price(text, pattern)
+    seconds = time.perf_counter() - start
+    calls = iterations * len(EXTRACT_SAMPLES)
+    return {'calls': calls, 'calls_per_s': round(calls / seconds, 1), 'call_us': round(seconds * 1e6 / calls, 3)}
+
+
+SCENARIOS = {
+    'crawl': run_crawl,
+    'crawl_browser': run_crawl_browser,
+    'history': run_history,
+    'chart': run_chart,
+    'extract': run_extract,
+}
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def flatten(results, prefix=''):
+    # {'crawl': {'cold': {'pages_per_s': 1}}} -> {'crawl.cold.pages_per_s': 1}, numbers only
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(previous, current):
+    # prints every metric of both runs that has a direction, with its change in percent (+ is better)
+    old, new = flatten(previous['results']), flatten(current['results'])
+    print(f"\nCompared with {previous['meta'].get('commit')} ({previous['meta'].get('created')})")
+    print(f"{'metric':<48} {'before':>12} {'after':>12} {'change':>9}")
+    for name in sorted(old.keys() & new.keys()):
+        if name.endswith('_per_s'):
+            better = 1
+        elif name.endswith(('_ms', '_us')):
+            better = -1
+        else:
+            continue
+        change = (new[name] - old[name]) / old[name] * 100 * better if old[name] else 0.0
+        print(f"{name:<48} {old[name]:>12.3f} {new[name]:>12.3f} {change:>+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline benchmark scenarios")
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="results of a previous run")
+    parser.add_argument('--crawl-elements', type=int, default=200)
+    parser.add_argument('--browser-elements', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=20, help="response delay of the shop")
+    parser.add_argument('--page-kb', type=int, default=50)
+    parser.add_argument('--render-ms', type=int, default=100, help="javascript rendering delay of the js pages")
+    parser.add_argument('--history-elements', type=int, default=100)
+    parser.add_argument('--history-rows', type=int, default=200_000)
+    parser.add_argument('--chart-elements', type=int, default=5)
+    parser.add_argument('--extract-iterations', type=int, default=20_000)
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    previous = None
+    if args.compare:
+        with open(args.compare) as file:
+            previous = json.load(file)
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        },
+        'results': {},
+    }
+
+    # the crawler uses the default database path, which is relative to the working directory
+    working_directory = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            for name in args.scenarios:
+                print(f"Running {name}...", flush=True)
+                start = time.perf_counter()
+                report['results'][name] = SCENARIOS[name](args)
+                print(f"{name} ({time.perf_counter() - start:.1f} s): {json.dumps(report['results'][name])}")
+        finally:
+            os.chdir(working_directory)
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f"Results written to {output}")
+    if previous:
+        compare(previous, report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""
+Bulk import of tracked elements and streaming export of the price history.
+
+    python bulk_io.py import elements.csv [--dry-run] [--batch-size 500]
+    python bulk_io.py export-elements elements.json
+    python bulk_io.py export-history history.parquet [--elements 1 2 3] [--start 2024-01-01] [--end 2024-06-30]
+
+Elements are read from CSV, JSON (an array of objects) or JSON Lines (.jsonl), with the columns of the dashboard form:
+name, url, xpath and optionally regex, update_interval, is_active, fetch_mode, browser_profile, adaptive,
+min_interval, max_interval. Rows are validated and inserted in batches, invalid rows are reported with their line and
+skipped. Imported elements aren't crawled right away like from the form, the scheduler spreads their first crawl over
+their update interval.
+
+The history is exported as CSV or Parquet (needs pyarrow) in chunks, so the table is never loaded into memory at once.
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import time
+
+import pandas as pd
+
+from db_handler import DB_PATH, DbHandler
+from crawl_options import BROWSER_PROFILES, DEFAULT_BROWSER_PROFILE, FETCH_MODE_AUTO, FETCH_MODES
+
+# https://stackoverflow.com/questions/3809401/what-is-a-good-regular-expression-to-match-a-url
+URL_PATTERN = r"https?:\/\/(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)"
+REGEX_DEFAULT_PATTERN = r"[-+]?\d{1,3}(?:[.,]\d{3})*(?:[.,]\d+)"
+DEFAULT_UPDATE_INTERVAL = 60
+MAX_UPDATE_INTERVAL = 60 * 24 * 7  # minutes, same limits as the form
+MAX_MAX_INTERVAL = 60 * 24 * 7 * 4
+
+DEFAULT_IMPORT_BATCH_SIZE = 500
+DEFAULT_EXPORT_CHUNK_SIZE = 50_000
+ELEMENT_EXPORT_COLUMNS = ['name', 'url', 'xpath', 'regex', 'update_interval', 'is_active', 'fetch_mode',
+                          'browser_profile', 'adaptive', 'min_interval', 'max_interval']
+
+
+def file_format(path, fmt=None):
+    # explicit format or the file extension
+    fmt = fmt or os.path.splitext(path)[1].lstrip('.').lower()
+    return {'jsonl': 'jsonl', 'ndjson': 'jsonl', 'json': 'json', 'csv': 'csv', 'parquet': 'parquet',
+            'pq': 'parquet'}.get(fmt, fmt)
+
+
+def read_records(path, fmt=None):
+    # yields (line, record). CSV and JSON Lines are streamed, a JSON array is read at once
+    fmt = file_format(path, fmt)
+    if fmt == 'csv':
+        with open(path, newline='', encoding='utf-8-sig') as file:
+            reader = csv.DictReader(file)
+            for record in reader:
+                yield reader.line_num, record
+    elif fmt == 'jsonl':
+        with open(path, encoding='utf-8') as file:
+            for line, text in enumerate(file, start=1):
+                if text.strip():
+                    yield line, json.loads(text)
+    elif fmt == 'json':
+        with open(path, encoding='utf-8') as file:
+            records = json.load(file)
+        if not isinstance(records, list):
+            raise ValueError("a JSON import must be an array of objects")
+        yield from enumerate(records, start=1)
+    else:
+        raise ValueError(f"unsupported import format '{fmt}', use csv, json or jsonl")
+
+
+def _value(record, key):
+    # empty strings of CSV cells count as missing
+    value = record.get(key)
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return None if value is None or (isinstance(value, float) and pd.isna(value)) else value
+
+
+def _bool(value, default):
+    if value is None:
+        return default
+    if isinstance(value, str):
+        if value.lower() in ('1', 'true', 'yes', 'y', 'on'):
+            return True
+        if value.lower() in ('0', 'false', 'no', 'n', 'off'):
+            return False
+        raise ValueError(f"'{value}' is not a boolean")
+    return bool(value)
+
+
+def _int(value, name, minimum, maximum):
+    if value is None:
+        return None
+    number = float(value)
+    if not number.is_integer() or not minimum <= number <= maximum:
+        raise ValueError(f"{name} must be a whole number between {minimum} and {maximum}")
+    return int(number)
+
+
+def validate_element(record, names):
+    """
+    Returns the row for DbHandler.insert_tracked_elements, raises ValueError for invalid records. `names` are the
+    names already taken, names have to be unique for the chart.
+    """
+    name, url, xpath = _value(record, 'name'), _value(record, 'url'), _value(record, 'xpath')
+    if not name:
+        raise ValueError("name is missing")
+    name = str(name)
+    if len(name) > 255:
+        raise ValueError("name is longer than 255 characters")
+    if name in names:
+        raise ValueError(f"name '{name}' already exists")
+    if not url or len(str(url)) > 2048 or not re.match(URL_PATTERN, str(url)):
+        raise ValueError(f"'{url}' is not a valid URL")
+    if not xpath:
+        raise ValueError("xpath is missing")
+
+    regex = _value(record, 'regex') or REGEX_DEFAULT_PATTERN
+    try:
+        re.compile(regex)
+    except re.error as e:
+        raise ValueError(f"invalid regex: {e}")
+
+    fetch_mode = _value(record, 'fetch_mode') or FETCH_MODE_AUTO
+    if fetch_mode not in FETCH_MODES:
+        raise ValueError(f"fetch_mode must be one of {', '.join(FETCH_MODES)}")
+    browser_profile = _value(record, 'browser_profile') or DEFAULT_BROWSER_PROFILE
+    if browser_profile not in BROWSER_PROFILES:
+        raise ValueError(f"browser_profile must be one of {', '.join(BROWSER_PROFILES)}")
+
+    update_interval = _int(_value(record, 'update_interval'), 'update_interval', 1, MAX_UPDATE_INTERVAL)
+    min_interval = _int(_value(record, 'min_interval'), 'min_interval', 1, MAX_UPDATE_INTERVAL)
+    max_interval = _int(_value(record, 'max_interval'), 'max_interval', 1, MAX_MAX_INTERVAL)
+    if min_interval is not None and max_interval is not None and min_interval > max_interval:
+        raise ValueError("min_interval can't be greater than max_interval")
+
+    return {
+        'name': name,
+        'url': str(url),
+        'xpath': str(xpath),
+        'regex': regex,
+        'update_interval': DEFAULT_UPDATE_INTERVAL if update_interval is None else update_interval,
+        'is_active': _bool(_value(record, 'is_active'), True),
+        'fetch_mode': fetch_mode,
+        'browser_profile': browser_profile,
+        'adaptive': _bool(_value(record, 'adaptive'), False),
+        'min_interval': min_interval,
+        'max_interval': max_interval,
+    }
+
+
+def import_tracked_elements(db_handler, path, fmt=None, batch_size=DEFAULT_IMPORT_BATCH_SIZE, dry_run=False):
+    """
+    Validates and inserts the elements of a CSV / JSON / JSON Lines file, one transaction per batch.
+    Returns {'inserted': count, 'ids': [...], 'errors': [(line, message), ...]}.
+    """
+    names = {row[0] for row in db_handler.conn.execute('''SELECT name FROM tracked_elements''')}
+    result = {'inserted': 0, 'ids': [], 'errors': []}
+    batch = []
+
+    def flush():
+        if dry_run:
+            result['inserted'] += len(batch)
+        else:
+            ids = db_handler.insert_tracked_elements(batch)
+            if ids is None:
+                raise RuntimeError(f"import stopped after {result['inserted']} elements, see the error above")
+            result['inserted'] += len(ids)
+            result['ids'] += ids
+        batch.clear()
+
+    for line, record in read_records(path, fmt):
+        try:
+            if not isinstance(record, dict):
+                raise ValueError("not an object")
+            row = validate_element(record, names)
+        except (ValueError, TypeError) as e:
+            result['errors'].append((line, str(e)))
+            continue
+        names.add(row['name'])
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return result
+
+
+def export_tracked_elements(db_handler, path, fmt=None):
+    # in the import format, so the file can be imported into another database
+    fmt = file_format(path, fmt)
+    df = db_handler.retrieve_tracked_elements()
+    df = df.reindex(columns=['id'] + ELEMENT_EXPORT_COLUMNS)
+    if fmt == 'csv':
+        df.to_csv(path, index=False)
+    elif fmt == 'json':
+        df.to_json(path, orient='records', indent=2)
+    elif fmt == 'jsonl':
+        df.to_json(path, orient='records', lines=True)
+    else:
+        raise ValueError(f"unsupported export format '{fmt}', use csv, json or jsonl")
+    return len(df)
+
+
+def export_price_history(db_handler, path, fmt=None, element_ids=None, start=None, end=None,
+                         chunk_size=DEFAULT_EXPORT_CHUNK_SIZE):
+    """
+    Streams price_history to a CSV or Parquet file, chunk by chunk. Every row is a run of a price from `timestamp` to
+    `last_seen` (UTC), see DbHandler.set_history_mode. Returns the number of exported rows.
+    """
+    fmt = file_format(path, fmt)
+    if fmt == 'parquet':
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("the Parquet export needs pyarrow: pip install pyarrow")
+    elif fmt != 'csv':
+        raise ValueError(f"unsupported export format '{fmt}', use csv or parquet")
+
+    names = {row[0]: row[1] for row in db_handler.conn.execute('''SELECT id, name FROM tracked_elements''')}
+    rows = 0
+    writer = None
+    if fmt == 'parquet':
+        # fixed schema, a chunk of deleted elements without names must not change it
+        writer = pq.ParquetWriter(path, pa.schema([
+            ('tracked_elements_id', pa.int64()), ('name', pa.string()), ('current_price', pa.float64()),
+            ('timestamp', pa.timestamp('us', tz='UTC')), ('last_seen', pa.timestamp('us', tz='UTC'))]))
+    try:
+        for chunk in db_handler.iter_price_history(element_ids, start, end, chunk_size):
+            chunk.insert(1, 'name', chunk['tracked_elements_id'].map(names))
+            chunk['timestamp'] = pd.to_datetime(chunk['timestamp'], unit='s', utc=True)
+            chunk['last_seen'] = pd.to_datetime(chunk['last_seen'], unit='s', utc=True)
+            if fmt == 'csv':
+                chunk.to_csv(path, mode='w' if rows == 0 else 'a', header=rows == 0, index=False)
+            else:
+                writer.write_table(pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if rows == 0 and fmt == 'csv':
+        # header only, so the result always exists
+        pd.DataFrame(columns=['tracked_elements_id', 'name', 'current_price', 'timestamp', 'last_seen']).to_csv(
+            path, index=False)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import / export of tracked elements and price history")
+    parser.add_argument('--db', default=DB_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = commands.add_parser('import', help="import tracked elements from CSV / JSON / JSON Lines")
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=['csv', 'json', 'jsonl'])
+    import_parser.add_argument('--batch-size', type=int, default=DEFAULT_IMPORT_BATCH_SIZE)
+    import_parser.add_argument('--dry-run', action='store_true', help="only validate the file")
+
+    elements_parser = commands.add_parser('export-elements', help="export the tracked elements")
+    elements_parser.add_argument('path')
+    elements_parser.add_argument('--format', choices=['csv', 'json', 'jsonl'])
+
+    history_parser = commands.add_parser('export-history', help="export the price history to CSV / Parquet")
+    history_parser.add_argument('path')
+    history_parser.add_argument('--format', choices=['csv', 'parquet'])
+    history_parser.add_argument('--elements', type=int, nargs='+', help="element ids, all by default")
+    history_parser.add_argument('--start', help="e.g. 2024-01-01")
+    history_parser.add_argument('--end', help="e.g. 2024-06-30T23:59:59")
+    history_parser.add_argument('--chunk-size', type=int, default=DEFAULT_EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    db_handler = DbHandler(args.db)
+    db_handler.init_db()
+    start = time.perf_counter()
+    try:
+        if args.command == 'import':
+            result = import_tracked_elements(db_handler, args.path, args.format, args.batch_size, args.dry_run)
+            for line, error in result['errors']:
+                print(f"Line {line}: {error}")
+            print(f"{'Validated' if args.dry_run else 'Imported'} {result['inserted']} elements, "
+                  f"{len(result['errors'])} invalid, in {time.perf_counter() - start:.1f} s")
+        elif args.command == 'export-elements':
+            count = export_tracked_elements(db_handler, args.path, args.format)
+            print(f"Exported {count} elements to {args.path}")
+        else:
+            count = export_price_history(db_handler, args.path, args.format, args.elements, args.start, args.end,
+                                         args.chunk_size)
+            print(f"Exported {count} prices to {args.path} in {time.perf_counter() - start:.1f} s")
+    except (OSError, ValueError, RuntimeError) as e:
+        parser.error(str(e))
+    finally:
+        db_handler.close_db()
+
+
+if __name__ == '__main__':
+    main()
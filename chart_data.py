@@ -0,0 +1,43 @@
+import pandas as pd
+
+SUMMARY_COLUMNS = ['name', 'min', 'max', 'last', 'last_change', 'change_pct']
+
+
+def mark_price_changes(df):
+    # compares every price with the previous price of the same element, the first price of an element counts as change
+    previous_price = df.groupby('name', sort=False)['current_price'].shift()
+    return df['current_price'].ne(previous_price)
+
+
+def summarize_price_history(df):
+    """
+    Per element: lowest and highest price, last price, time of the last price change and the change in % between the
+    first and the last price of the given data. `df` has to be sorted by timestamp and contain `price_changed`.
+    """
+    if df.empty:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+
+    # rollups carry the min / max of every bucket, raw prices don't
+    min_column = 'min_price' if 'min_price' in df.columns else 'current_price'
+    max_column = 'max_price' if 'max_price' in df.columns else 'current_price'
+
+    grouped = df.groupby('name', sort=False)
+    summary = pd.DataFrame({
+        'min': grouped[min_column].min(),
+        'max': grouped[max_column].max(),
+        'first': grouped['current_price'].first(),
+        'last': grouped['current_price'].last(),
+    })
+    summary['last_change'] = df[df['price_changed']].groupby('name', sort=False)['timestamp'].max()
+    summary['change_pct'] = ((summary['last'] - summary['first']) / summary['first'] * 100).round(2)
+    return summary.drop(columns='first').reset_index()[SUMMARY_COLUMNS]
+
+
+def prepare_chart_data(df):
+    # returns the data sorted for plotting, with the changed prices as 'text' labels, and the per-element summary
+    df = df.sort_values(by='timestamp', kind='stable')
+    if 'price_changed' not in df.columns:
+        df['price_changed'] = mark_price_changes(df)
+
+    df['text'] = df['current_price'].where(df['price_changed'], "")
+    return df, summarize_price_history(df)
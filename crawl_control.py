@@ -0,0 +1,164 @@
+"""
+Control api of a running crawler (`python crawly.py`), used by the dashboard instead of crawling in its own process.
+
+    GET    /status          engine, schedule, failing shops and driver pool of the crawler
+    PUT    /jobs/<id>       adds / updates the job of a saved element, body {"crawled": true} if the gui just crawled it
+    DELETE /jobs/<id>       removes the job of an element
+    POST   /run             crawls the elements of body {"element_ids": [...]} with the next dispatch
+    POST   /validate        crawls the values of the form in the background, body {"element": {...}, "action":
+                            "snapshot" or "save"}, answers {"id": ...} of the validation, see page_snapshots.py
+
+It listens on localhost only by default and has no authentication. This module doesn't import the crawler, the
+server gets the engine (crawly.CrawlEngine) passed in.
+"""
+import json
+import re
+import threading
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from page_snapshots import VALIDATION_SAVE, VALIDATION_SNAPSHOT
+
+DEFAULT_CONTROL_HOST = '127.0.0.1'
+DEFAULT_CONTROL_PORT = 9109
+DEFAULT_CONTROL_URL = f'http://{DEFAULT_CONTROL_HOST}:{DEFAULT_CONTROL_PORT}'
+CONTROL_TIMEOUT = 5  # seconds
+
+JOB_PATH = re.compile(r'^/jobs/(\d+)$')
+
+
+class ControlRequestHandler(BaseHTTPRequestHandler):
+    engine = None  # set by start_control_server
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._respond_with(self.engine.status)
+        else:
+            self._respond(404, {'error': 'not found'})
+
+    def do_PUT(self):
+        match = JOB_PATH.match(self.path)
+        if match is None:
+            return self._respond(404, {'error': 'not found'})
+        body = self._read_json()
+        if body is not None:
+            self._respond_with(lambda: {'scheduled': self.engine.schedule(int(match.group(1)),
+                                                                          crawled=bool(body.get('crawled')))})
+
+    def do_DELETE(self):
+        match = JOB_PATH.match(self.path)
+        if match is None:
+            return self._respond(404, {'error': 'not found'})
+
+        def unschedule():
+            self.engine.unschedule(int(match.group(1)))
+            return {'scheduled': False}
+        self._respond_with(unschedule)
+
+    def do_POST(self):
+        if self.path not in ('/run', '/validate'):
+            return self._respond(404, {'error': 'not found'})
+        body = self._read_json()
+        if body is None:
+            return
+        if self.path == '/run':
+            self._respond_with(lambda: {'element_ids': self.engine.run_now(
+                [int(element_id) for element_id in body.get('element_ids', [])])})
+        elif isinstance(body.get('element'), dict) and body.get('action') in (VALIDATION_SNAPSHOT, VALIDATION_SAVE):
+            self._respond_with(lambda: {'id': self.engine.validate(body['element'], body['action'])})
+        else:
+            self._respond(400, {'error': 'expected an element and the action'})
+
+    def handle_one_request(self):
+        # errors of the engine are answered with 500 by _respond_with, this only logs what is left (e.g. a client
+        # that disconnected while the response was written)
+        try:
+            super().handle_one_request()
+        except Exception:
+            print(traceback.format_exc())
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            self._respond(400, {'error': 'expected a JSON object'})
+            return None
+        return body
+
+    def _respond_with(self, payload):
+        # answers with the result of the engine call, 500 if it fails. nothing is sent before the call returned
+        try:
+            result = payload()
+        except Exception:
+            print(traceback.format_exc())
+            return self._respond(500, {'error': 'internal error'})
+        self._respond(200, result)
+
+    def _respond(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_control_server(engine, port=DEFAULT_CONTROL_PORT, host=DEFAULT_CONTROL_HOST):
+    # serves the api from a daemon thread, every request on its own thread
+    handler = type('EngineControlRequestHandler', (ControlRequestHandler,), {'engine': engine})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        print(f"Control api not started, port {port}: {e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='control-server', daemon=True).start()
+    print(f"Control api available at http://{host}:{port}")
+    return server
+
+
+class CrawlerClient:
+    """
+    Client of the control api. Every call returns None if the crawler isn't reachable (not started, restarting),
+    so the dashboard keeps working with the database alone.
+    """
+
+    def __init__(self, url=DEFAULT_CONTROL_URL, timeout=CONTROL_TIMEOUT):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def status(self):
+        return self._request('GET', '/status')
+
+    def schedule(self, element_id, crawled=False):
+        response = self._request('PUT', f'/jobs/{int(element_id)}', {'crawled': crawled})
+        return None if response is None else response['scheduled']
+
+    def unschedule(self, element_id):
+        response = self._request('DELETE', f'/jobs/{int(element_id)}')
+        return None if response is None else response['scheduled']
+
+    def run_now(self, element_ids):
+        response = self._request('POST', '/run', {'element_ids': [int(i) for i in element_ids]})
+        return None if response is None else response['element_ids']
+
+    def validate(self, element, action):
+        # id of the validation, its result is read from the database (DbHandler.retrieve_validation)
+        response = self._request('POST', '/validate', {'element': element, 'action': action})
+        return None if response is None else response['id']
+
+    def _request(self, method, path, payload=None):
+        try:
+            response = requests.request(method, self.url + path, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"Crawler control api {self.url}{path} failed: {e}")
+            return None
@@ -0,0 +1,124 @@
+import queue
+import threading
+import traceback
+from collections import defaultdict, deque
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_MAX_PER_HOST = 2
+DEFAULT_QUEUE_SIZE = 100
+
+
+def host_of(url):
+    return (urlsplit(url).hostname or '').lower()
+
+
+def normalize_url(url):
+    # elements whose urls only differ in case of the host, default port, query parameter order or fragment
+    # are on the same page
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f'{host}:{parts.port}'
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+class CrawlExecutor:
+    """
+    Bounded worker pool for crawl tasks.
+
+    - a job is a page with one or more due elements, `max_workers` threads execute `task(element_ids)`
+    - at most `max_per_host` tasks run against the same host at a time, further jobs for that host are parked
+      and handed over to the worker that frees the slot
+    - `submit` blocks while `queue_size` jobs are waiting (backpressure on the scheduler)
+    - an element that is still queued or running is not submitted again
+    """
+
+    def __init__(self, task, max_workers=DEFAULT_MAX_WORKERS, max_per_host=DEFAULT_MAX_PER_HOST,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        self.task = task
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._pending = set()  # element ids that are queued, parked or running
+        self._host_running = defaultdict(int)
+        self._host_waiting = defaultdict(deque)
+        self._stats = {'submitted': 0, 'skipped': 0, 'completed': 0, 'failed': 0}
+
+        self._workers = []
+        for i in range(max_workers):
+            worker = threading.Thread(target=self._work, name=f'crawly-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, element_ids, url, timeout=None):
+        # element_ids: a single id or the ids of all due elements on the page `url`
+        if isinstance(element_ids, int):
+            element_ids = [element_ids]
+
+        with self._lock:
+            skipped = [element_id for element_id in element_ids if element_id in self._pending]
+            element_ids = tuple(element_id for element_id in element_ids if element_id not in self._pending)
+            if skipped:
+                self._stats['skipped'] += len(skipped)
+                print(f"Elements {skipped} are still queued or running, skipping")
+            if not element_ids:
+                return False
+            self._pending.update(element_ids)
+
+        try:
+            # blocks if the queue is full, which holds back the scheduler until workers catch up
+            self._queue.put((element_ids, host_of(url)), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._pending.difference_update(element_ids)
+            return False
+
+        with self._lock:
+            self._stats['submitted'] += 1
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['running'] = sum(self._host_running.values())
+            stats['parked'] = sum(len(waiting) for waiting in self._host_waiting.values())
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+    def _work(self):
+        while True:
+            element_ids, host = self._queue.get()
+            try:
+                with self._lock:
+                    if self._host_running[host] >= self.max_per_host:
+                        self._host_waiting[host].append(element_ids)
+                        continue
+                    self._host_running[host] += 1
+
+                while element_ids is not None:
+                    self._run(element_ids)
+                    with self._lock:
+                        self._pending.difference_update(element_ids)
+                        # hand the host slot over to the next parked job of the same host
+                        if self._host_waiting[host]:
+                            element_ids = self._host_waiting[host].popleft()
+                        else:
+                            self._host_running[host] -= 1
+                            element_ids = None
+            finally:
+                self._queue.task_done()
+
+    def _run(self, element_ids):
+        try:
+            self.task(element_ids)
+            outcome = 'completed'
+        except Exception:
+            print(traceback.format_exc())
+            outcome = 'failed'
+        with self._lock:
+            self._stats[outcome] += 1
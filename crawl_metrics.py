@@ -0,0 +1,248 @@
+import contextvars
+import json
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+DEFAULT_METRICS_PORT = 9108
+DEFAULT_METRICS_HOST = '127.0.0.1'  # the endpoint has no authentication
+
+# stages of a crawl, label `stage` of crawl_stage_seconds
+STAGE_DRIVER = 'driver'  # checkout of a browser session, outcome 'reused' or 'launched'
+STAGE_NAVIGATION = 'navigation'  # HTTP request or page load in the browser
+STAGE_LOOKUP = 'lookup'  # evaluation of a selector, outcome 'xpath', 'css' (fallback) or 'not_found'
+STAGE_EXTRACT = 'extract'  # regex on the element text
+STAGE_DB_WRITE = 'db_write'  # price inserts
+STAGE_PAGE = 'page'  # the whole task, outcome 'ok', 'partial' or 'failed'
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)  # seconds
+LAG_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)  # seconds
+
+# structured log lines (one json object per crawled page) are printed in addition to the metrics
+LOG_EVENTS = True
+
+# the page trace of the running task, a context variable so it follows asyncio tasks as well as threads
+_current_trace = contextvars.ContextVar('crawl_trace', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def log_event(event, **fields):
+    if LOG_EVENTS:
+        print(json.dumps({'ts': round(time.time(), 3), 'event': event, **fields}, default=str))
+
+
+class CrawlMetrics:
+    """
+    In-process registry of counters, histograms and gauges, rendered in the Prometheus text format by `render`
+    (served by `start_metrics_server`).
+
+    The crawl code reports its stages with `stage` (timed block) or `record_stage`, a page task is wrapped in `trace`,
+    which collects the stage timings and element outcomes of the task and logs them as one structured line.
+    Gauges are callbacks that are evaluated on every scrape, e.g. the queue depths.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}  # name -> (type, help text)
+        self._counters = defaultdict(float)  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [buckets, bucket counts, sum, count]
+        self._gauges = {}  # name -> (callback, label name)
+        self._due = {}  # element_id -> due time of its current run, for the scheduler lag
+
+    def inc(self, name, help_text, value=1, **labels):
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ('counter', help_text))
+            self._counters[key] += value
+
+    def observe(self, name, help_text, value, buckets=STAGE_BUCKETS, **labels):
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ('histogram', help_text))
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [buckets, [0] * len(buckets), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram[1][i] += 1
+            histogram[2] += value
+            histogram[3] += 1
+
+    def register_gauge(self, name, help_text, callback, label=None):
+        # callback() returns a number, or {label value: number} if `label` is given. a later registration with the
+        # same name replaces the previous one
+        with self._lock:
+            self._help[name] = ('gauge', help_text)
+            self._gauges[name] = (callback, label)
+
+    def record_stage(self, stage, seconds, outcome='ok', host='', mode=''):
+        self.observe('crawl_stage_seconds', "Duration of the crawl stages", seconds,
+                     stage=stage, outcome=outcome, host=host, mode=mode)
+        trace = _current_trace.get()
+        if trace is not None:
+            with self._lock:
+                timing = trace['stages'].setdefault(stage, {'seconds': 0.0, 'count': 0})
+                timing['seconds'] = round(timing['seconds'] + seconds, 4)
+                timing['count'] += 1
+
+    @contextmanager
+    def stage(self, stage, host='', mode=''):
+        # the block can set result['outcome'], an exception counts as 'error'
+        result = {'outcome': 'ok'}
+        start = time.perf_counter()
+        try:
+            yield result
+        except BaseException:
+            result['outcome'] = 'error'
+            raise
+        finally:
+            self.record_stage(stage, time.perf_counter() - start, result['outcome'], host, mode)
+
+    def element_result(self, element_id, host, outcome, **fields):
+        # outcome of one element of a task: 'extracted', 'confirmed', 'not_found', 'no_match' or 'error'. counted per
+        # host (a label per element would grow with the number of elements), the element is in the page log line
+        self.inc('crawl_elements_total', "Crawled elements by result", host=host, outcome=outcome)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace['elements'].append({'id': element_id, 'outcome': outcome, **fields})
+
+    @contextmanager
+    def trace(self, host, url, element_ids):
+        """
+        Wraps a page task: observes the scheduler lag of its elements, times the task and logs the collected stages
+        and element outcomes. result['outcome'] is derived from the element outcomes unless it is set by the block.
+        """
+        lag = self.observe_start(element_ids)
+        result = {'outcome': None}
+        trace = {'stages': {}, 'elements': []}
+        token = _current_trace.set(trace)
+        start = time.perf_counter()
+        try:
+            yield result
+        except BaseException:
+            result['outcome'] = 'failed'
+            raise
+        finally:
+            _current_trace.reset(token)
+            seconds = time.perf_counter() - start
+            outcome = result['outcome'] or self._page_outcome(trace['elements'])
+            self.record_stage(STAGE_PAGE, seconds, outcome, host)
+            log_event('page', host=host, url=url, outcome=outcome, seconds=round(seconds, 4),
+                      lag=None if lag is None else round(lag, 3), stages=trace['stages'], elements=trace['elements'])
+
+    @staticmethod
+    def _page_outcome(elements):
+        failed = sum(element['outcome'] in ('not_found', 'no_match', 'error') for element in elements)
+        if not failed:
+            return 'ok'
+        return 'failed' if failed == len(elements) else 'partial'
+
+    def mark_due(self, element_id, due):
+        # called by the scheduler when an element is handed out, see `observe_start`
+        with self._lock:
+            self._due[int(element_id)] = due
+
+    def observe_start(self, element_ids):
+        # scheduler lag: seconds between the due time and the actual start of the crawl. returns the largest lag,
+        # None if the due times are unknown (e.g. a crawl from the gui)
+        now = time.time()
+        lags = []
+        with self._lock:
+            for element_id in element_ids:
+                element_due = self._due.pop(int(element_id), None)
+                if element_due is not None:
+                    lags.append(max(0.0, now - element_due))
+        for lag in lags:
+            self.observe('crawl_scheduler_lag_seconds', "Delay between the due time and the start of a crawl", lag,
+                         buckets=LAG_BUCKETS)
+        return max(lags) if lags else None
+
+    def render(self):
+        lines = []
+        with self._lock:
+            help_texts = dict(self._help)
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (buckets, list(counts), total, count))
+                                for key, (buckets, counts, total, count) in self._histograms.items())
+            gauges = sorted(self._gauges.items())
+
+        samples = defaultdict(list)
+        for (name, labels), value in counters:
+            samples[name].append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            for bound, bucket_count in zip(buckets, counts):
+                samples[name].append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {bucket_count}')
+            samples[name].append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+            samples[name].append(f'{name}_sum{_format_labels(labels)} {_format_value(total)}')
+            samples[name].append(f'{name}_count{_format_labels(labels)} {count}')
+        for name, (callback, label) in gauges:
+            try:
+                value = callback()
+            except Exception as e:
+                print(f"Error reading gauge {name}: {e}")
+                continue
+            if label is None:
+                if value is not None:
+                    samples[name].append(f'{name} {_format_value(value)}')
+            else:
+                for label_value, sample in sorted(value.items()):
+                    samples[name].append(f'{name}{_format_labels([(label, label_value)])} {_format_value(sample)}')
+
+        for name in sorted(samples):
+            metric_type, help_text = help_texts[name]
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(samples[name])
+        return '\n'.join(lines) + '\n'
+
+
+# shared by all crawl engines of the process
+metrics = CrawlMetrics()
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes are not logged
+
+
+def start_metrics_server(port=DEFAULT_METRICS_PORT, host=DEFAULT_METRICS_HOST):
+    # serves /metrics from a daemon thread. scrapes are answered one after the other on that thread, so gauges
+    # can keep a connection per thread (e.g. crawly.get_thread_db_handler)
+    try:
+        server = HTTPServer((host, port), MetricsRequestHandler)
+    except OSError as e:
+        print(f"Metrics endpoint not started, port {port}: {e}")
+        return None
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    print(f"Metrics available at http://{host}:{port}/metrics")
+    return server
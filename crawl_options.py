@@ -0,0 +1,21 @@
+# choices of the crawler and of tracked elements. kept free of selenium and the crawler itself, so the dashboard and
+# the bulk import can offer them without paying for those imports
+
+# how an element is fetched: 'http' reads the initial HTML, 'browser' renders the page in Firefox, 'auto' tries 'http'
+# first and falls back to the browser
+FETCH_MODE_AUTO = 'auto'
+FETCH_MODE_HTTP = 'http'
+FETCH_MODE_BROWSER = 'browser'
+FETCH_MODES = [FETCH_MODE_AUTO, FETCH_MODE_HTTP, FETCH_MODE_BROWSER]
+
+# 'lean' doesn't load images, web fonts, media or known trackers and only waits for the DOM (eager page load),
+# 'full' loads the page like a regular browser, for shops that break without
+BROWSER_PROFILE_LEAN = 'lean'
+BROWSER_PROFILE_FULL = 'full'
+BROWSER_PROFILES = [BROWSER_PROFILE_LEAN, BROWSER_PROFILE_FULL]
+DEFAULT_BROWSER_PROFILE = BROWSER_PROFILE_LEAN
+
+ENGINE_THREADED = 'threaded'
+ENGINE_ASYNC = 'async'
+ENGINE_QUEUE = 'queue'  # only schedules, due pages are crawled by crawl_worker.py processes
+ENGINES = [ENGINE_THREADED, ENGINE_ASYNC, ENGINE_QUEUE]
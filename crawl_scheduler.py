@@ -0,0 +1,224 @@
+import heapq
+import random
+import threading
+import time
+from collections import defaultdict
+
+from crawl_executor import normalize_url
+from crawl_metrics import metrics
+
+DEFAULT_JITTER = 0.05  # +- 5% of the interval
+DEFAULT_CATCH_UP_PER_MINUTE = 30  # overdue jobs started per minute after a restart
+ELEMENT_REFRESH_INTERVAL = 30  # seconds, picks up elements added / changed / deleted in the gui
+
+# adaptive intervals
+ADAPTIVE_MIN_OBSERVATIONS = 5  # the fixed interval is used until the element has been crawled this often
+ADAPTIVE_CRAWLS_PER_CHANGE = 4  # crawls within the expected time between two price changes
+ADAPTIVE_MIN_FACTOR = 0.25  # default bounds, relative to update_interval
+ADAPTIVE_MAX_FACTOR = 16
+ADAPTIVE_TOLERANCE = 0.1  # adaptive intervals that changed less than 10% don't reschedule the element
+
+
+def _is_null(value):
+    # NULL from the db / NaN from pandas
+    return value is None or value != value
+
+
+def crawl_interval(task, now=None):
+    """
+    Seconds between two crawls of an element.
+
+    Without `adaptive` this is the fixed update_interval. Otherwise the interval follows the expected time until the
+    next price change, estimated from the crawl statistics (`DbHandler.retrieve_tracked_elements(with_stats=True)`):
+    the moving average of the gap between changes, or the time since the last change if that is longer. Flat prices
+    are crawled less often, volatile ones more often, within min_interval / max_interval.
+    """
+    interval = int(task['update_interval']) * 60
+    observations = task.get('observations')
+    if not task.get('adaptive') or _is_null(observations) or observations < ADAPTIVE_MIN_OBSERVATIONS:
+        return interval
+
+    now = time.time() if now is None else now
+    last_change = task['first_timestamp'] if _is_null(task.get('last_change')) else task['last_change']
+    change_gap = 0 if _is_null(task.get('change_gap')) else task['change_gap']
+    expected_gap = max(change_gap, now - last_change)
+
+    min_interval = interval * ADAPTIVE_MIN_FACTOR if _is_null(task.get('min_interval')) else task['min_interval'] * 60
+    max_interval = interval * ADAPTIVE_MAX_FACTOR if _is_null(task.get('max_interval')) else task['max_interval'] * 60
+    return int(min(max(expected_gap / ADAPTIVE_CRAWLS_PER_CHANGE, min_interval, 60), max(max_interval, min_interval)))
+
+
+def group_by_page(due):
+    # (element_id, url) of due elements -> (url, element ids) per page, elements of a page are fetched together
+    pages = defaultdict(list)
+    urls = {}
+    for element_id, url in due:
+        key = normalize_url(url)
+        pages[key].append(element_id)
+        urls.setdefault(key, url)
+    return [(urls[key], element_ids) for key, element_ids in pages.items()]
+
+
+class CrawlScheduler:
+    """
+    Priority queue of the next due time per tracked element.
+
+    - due times are persisted in tracked_elements.next_due, so a restart doesn't reset the timers
+    - elements that were never scheduled are spread over their first interval instead of all starting at once
+    - jobs that became overdue while the crawler was down are started at `catch_up_per_minute`
+    - every reschedule adds a random jitter, so elements that share an interval drift apart
+    - elements with `adaptive` get their interval from the crawl statistics, see `crawl_interval`
+
+    Not bound to a thread: `pop_due` returns the due elements, the caller dispatches them and persists
+    `take_dirty` with DbHandler.update_next_due.
+    """
+
+    def __init__(self, jitter=DEFAULT_JITTER, catch_up_per_minute=DEFAULT_CATCH_UP_PER_MINUTE):
+        self.jitter = jitter
+        self.catch_up_per_minute = catch_up_per_minute
+
+        self._heap = []  # (due, generation, element_id)
+        self._entries = {}  # element_id -> (due, generation, url, interval in seconds)
+        self._generation = 0
+        self._dirty = {}  # element_id -> next due, not yet persisted
+        self._lock = threading.Lock()
+
+    def load(self, tasks, now=None):
+        # initial load of all tracked elements, e.g. on startup
+        now = time.time() if now is None else now
+        overdue = []
+        with self._lock:
+            for task in tasks:
+                if not task['is_active']:
+                    continue
+                interval = crawl_interval(task, now)
+                next_due = task.get('next_due')
+                if _is_null(next_due):
+                    self._push(task, interval, now + random.uniform(0, interval))
+                elif next_due < now:
+                    overdue.append((next_due, task, interval))
+                else:
+                    self._push(task, interval, next_due)
+
+            # the longest overdue first, at a bounded rate
+            overdue.sort(key=lambda item: item[0])
+            for i, (_, task, interval) in enumerate(overdue):
+                self._push(task, interval, now + i * 60 / self.catch_up_per_minute)
+
+            print(f"Scheduled {len(self._entries)} elements, {len(overdue)} of them overdue")
+
+    def add(self, task, first_due=None):
+        # adds or reschedules an element, without first_due it is spread over its interval
+        with self._lock:
+            if not task['is_active']:
+                self._remove(task['id'])
+                return
+            interval = crawl_interval(task)
+            self._push(task, interval, time.time() + random.uniform(0, interval) if first_due is None else first_due)
+
+    def remove(self, element_id):
+        with self._lock:
+            self._remove(element_id)
+
+    def sync(self, tasks):
+        # keeps the schedule in line with the tracked elements in the database (new, changed and deleted ones)
+        now = time.time()
+        with self._lock:
+            active = {int(task['id']): task for task in tasks if task['is_active']}
+            for element_id in list(self._entries):
+                if element_id not in active:
+                    self._remove(element_id)
+
+            for element_id, task in active.items():
+                interval = crawl_interval(task, now)
+                entry = self._entries.get(element_id)
+                if entry is None:
+                    next_due = task.get('next_due')
+                    self._push(task, interval,
+                               now + random.uniform(0, interval) if _is_null(next_due) else max(next_due, now))
+                elif entry[2] != task['url'] or self._interval_changed(task, entry[3], interval):
+                    # a shorter interval takes effect right away, a longer one after the next run
+                    self._push(task, interval, min(entry[0], now + interval))
+
+    def pop_due(self, now=None):
+        # returns (element_id, url) of all due elements and schedules their next run
+        now = time.time() if now is None else now
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                element_due, generation, element_id = heapq.heappop(self._heap)
+                entry = self._entries.get(element_id)
+                if entry is None or entry[1] != generation:
+                    continue  # removed or rescheduled in the meantime
+                _, _, url, interval = entry
+                due.append((element_id, url))
+                metrics.mark_due(element_id, element_due)
+
+                spread = interval * self.jitter
+                self._push({'id': element_id, 'url': url}, interval, now + interval + random.uniform(-spread, spread))
+        return due
+
+    def retry(self, element_ids, due):
+        # brings the next run of the elements forward to `due` (a retry), unless it is earlier anyway
+        with self._lock:
+            for element_id in element_ids:
+                entry = self._entries.get(int(element_id))
+                if entry is not None and due < entry[0]:
+                    self._push({'id': element_id, 'url': entry[2]}, entry[3], due)
+
+    def postpone(self, element_ids, due):
+        # moves the next run of the elements to `due`, earlier or later: the page that was due now is crawled then
+        # instead, e.g. when the circuit of its host lets it through
+        with self._lock:
+            for element_id in element_ids:
+                entry = self._entries.get(int(element_id))
+                if entry is not None and due != entry[0]:
+                    self._push({'id': element_id, 'url': entry[2]}, entry[3], due)
+
+    def seconds_until_next(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            while self._heap:
+                due, generation, element_id = self._heap[0]
+                entry = self._entries.get(element_id)
+                if entry is not None and entry[1] == generation:
+                    return max(0.0, due - now)
+                heapq.heappop(self._heap)
+        return None
+
+    def take_dirty(self):
+        # (next_due, element_id) of all changed schedules since the last call
+        with self._lock:
+            dirty = [(int(due), element_id) for element_id, due in self._dirty.items()]
+            self._dirty.clear()
+        return dirty
+
+    def overdue(self, now=None):
+        # number of elements whose due time has passed, but weren't handed out yet
+        now = time.time() if now is None else now
+        with self._lock:
+            return sum(1 for entry in self._entries.values() if entry[0] <= now)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, element_id):
+        return int(element_id) in self._entries
+
+    @staticmethod
+    def _interval_changed(task, old_interval, interval):
+        if task.get('adaptive'):
+            return abs(interval - old_interval) > old_interval * ADAPTIVE_TOLERANCE
+        return interval != old_interval
+
+    def _push(self, task, interval, due):
+        element_id = int(task['id'])
+        self._generation += 1
+        self._entries[element_id] = (due, self._generation, task['url'], interval)
+        heapq.heappush(self._heap, (due, self._generation, element_id))
+        self._dirty[element_id] = due
+
+    def _remove(self, element_id):
+        # the heap entry stays and is skipped when it comes up
+        self._entries.pop(int(element_id), None)
+        self._dirty.pop(int(element_id), None)
@@ -0,0 +1,173 @@
+import argparse
+import os
+import socket
+import threading
+import time
+import traceback
+
+from crawl_executor import DEFAULT_MAX_WORKERS, host_of, normalize_url
+from crawl_metrics import DEFAULT_METRICS_HOST, DEFAULT_METRICS_PORT, metrics, start_metrics_server
+from crawl_options import ENGINE_QUEUE
+from crawly import (CrawlEngine, crawl_scheduler, execute_page, get_price_writer, get_thread_db_handler, host_health,
+                    register_gauges, run_scheduler)
+from db_handler import DbHandler
+from host_health import DEFAULT_HOST_RATE
+import page_snapshots
+
+LEASE_SECONDS = 120  # a job is given to another worker if its worker didn't send a heartbeat for this long
+HEARTBEAT_INTERVAL = 30  # seconds
+MAX_ATTEMPTS = 3  # jobs that were claimed this often without completing are dropped
+POLL_INTERVAL = 1.0  # seconds, while the queue is empty
+FLUSH_TIMEOUT = 60  # seconds the prices of a page may take to be written before its jobs are released
+
+
+def enqueue_page(element_ids, url):
+    # used by the scheduler in place of the local executor
+    get_thread_db_handler().enqueue_crawl_jobs(normalize_url(url), url, element_ids)
+
+
+def register_queue_gauges():
+    # read on the thread of the metrics endpoint, with its own connection
+    def queue_stats():
+        return get_thread_db_handler().retrieve_crawl_queue_stats()
+
+    def oldest_job_age():
+        oldest_enqueued = queue_stats()['oldest_enqueued']
+        return 0 if oldest_enqueued is None else max(0, time.time() - oldest_enqueued)
+
+    register_gauges()
+    metrics.register_gauge('crawl_queue_jobs', "Elements in the shared crawl queue",
+                           lambda: {state: count for state, count in queue_stats().items()
+                                    if state in ('jobs', 'leased', 'expired')}, label='state')
+    metrics.register_gauge('crawl_queue_oldest_job_age_seconds', "Age of the oldest job in the shared crawl queue",
+                           oldest_job_age)
+
+
+class CrawlDispatcher(CrawlEngine):
+    """
+    Scheduler without crawler: due pages are put into the crawl_jobs table of the database, where they are
+    claimed by `CrawlWorker` processes (on this or other hosts).
+    """
+    name = ENGINE_QUEUE
+
+    def __init__(self, _db_handler: DbHandler):
+        self.db_handler = _db_handler
+        if self.db_handler.conn is None:
+            self.db_handler.init_db()
+
+    def run(self):
+        df_tracked_elements = self.db_handler.retrieve_tracked_elements(with_stats=True)
+        crawl_scheduler.load(df_tracked_elements.to_dict('records'))
+        self.started = time.time()
+        register_queue_gauges()
+
+        scheduler_thread = threading.Thread(target=run_scheduler, args=[enqueue_page], name='crawl-dispatcher')
+        scheduler_thread.daemon = True  # Daemonize the thread to exit when the main thread exits
+        scheduler_thread.start()
+
+
+class CrawlWorker:
+    """
+    Claims due pages from the crawl_jobs table and crawls them with `workers` threads, prices are written to the
+    same database.
+
+    Claimed jobs are leased for LEASE_SECONDS and the lease is renewed by a heartbeat thread. If the process dies,
+    the lease runs out and the jobs are claimed by another worker. The heartbeat also exchanges the host health with
+    the database, so the dispatcher and the other workers see the circuits this worker opened (and vice versa).
+    Retries of failed pages are left to the dispatcher's schedule.
+    """
+
+    def __init__(self, workers=DEFAULT_MAX_WORKERS, lease_seconds=LEASE_SECONDS,
+                 heartbeat_interval=HEARTBEAT_INTERVAL, max_attempts=MAX_ATTEMPTS, poll_interval=POLL_INTERVAL,
+                 flush_timeout=FLUSH_TIMEOUT):
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.heartbeat_interval = heartbeat_interval
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.flush_timeout = flush_timeout
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}'
+
+    def run(self):
+        register_queue_gauges()
+
+        # the worker is registered with its first heartbeat
+        threads = [threading.Thread(target=self._heartbeat, name='crawl-worker-heartbeat', daemon=True)]
+        threads += [threading.Thread(target=self._work, name=f'crawl-worker-{i}', daemon=True)
+                    for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+        print(f"Crawl worker {self.worker_id} started with {self.workers} threads")
+
+    def _heartbeat(self):
+        _db_handler = DbHandler()
+        _db_handler.connect()
+        while True:
+            _db_handler.heartbeat_crawl_worker(self.worker_id, self.lease_seconds)
+            try:
+                host_states = host_health.take_dirty()
+                if host_states:
+                    _db_handler.update_host_health(host_states)
+                host_health.load(_db_handler.retrieve_host_health())
+            except Exception:
+                print(traceback.format_exc())
+            time.sleep(self.heartbeat_interval)
+
+    def _work(self):
+        _db_handler = get_thread_db_handler()
+        while True:
+            job = _db_handler.claim_crawl_job(self.worker_id, self.lease_seconds, self.max_attempts)
+            if job is None:
+                time.sleep(self.poll_interval)
+                continue
+
+            url, element_ids, enqueued = job
+            blocked_until = host_health.blocked_until(host_of(url))
+            if blocked_until is not None:
+                # e.g. queued before the circuit of the host opened, claimed again when the host may be probed
+                print(f"Skipping {url}, its host is failing until {time.ctime(blocked_until)}")
+                _db_handler.release_crawl_jobs(self.worker_id, element_ids, blocked_until)
+                continue
+            # the dispatcher queues the elements when they are due, so the time since then is the scheduler lag
+            for element_id in element_ids:
+                metrics.mark_due(element_id, enqueued)
+            try:
+                execute_page(element_ids, wait_for_host=True)
+            except Exception:
+                print(traceback.format_exc())
+
+            # the prices have to be in the database before the jobs are gone. if they aren't written in time (the
+            # writer keeps retrying them), the jobs are released and crawled again, so every job completes at least once
+            if get_price_writer().flush(self.flush_timeout):
+                _db_handler.complete_crawl_jobs(self.worker_id, element_ids)
+            else:
+                print(f"Prices of {element_ids} not written after {self.flush_timeout} s, releasing the jobs")
+                _db_handler.release_crawl_jobs(self.worker_id, element_ids)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Crawl the jobs queued by the 'queue' engine")
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS, help="number of crawler threads")
+    parser.add_argument('--metrics-port', type=int, default=DEFAULT_METRICS_PORT,
+                        help="port of the prometheus endpoint /metrics, 0 to disable it")
+    parser.add_argument('--metrics-host', default=DEFAULT_METRICS_HOST,
+                        help="interface of the prometheus endpoint, it has no authentication (0.0.0.0 to scrape the "
+                             "worker from other hosts)")
+    parser.add_argument('--host-rate', type=float, default=DEFAULT_HOST_RATE,
+                        help="pages per minute and shop of this worker, 0 for no limit")
+    parser.add_argument('--no-snapshots', action='store_true', help="don't store page snapshots of the crawls")
+    args = parser.parse_args()
+    host_health.rate_per_minute = args.host_rate
+    page_snapshots.snapshot_scheduled_crawls = not args.no_snapshots
+
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port, args.metrics_host)
+
+    db_handler = DbHandler()
+    db_handler.init_db()
+    db_handler.close_db()
+
+    CrawlWorker(workers=args.workers).run()
+
+    while True:
+        time.sleep(1)
@@ -1,209 +1,616 @@
-import re
+import argparse
+import atexit
+import os
+import signal
+import sys
 import threading
 import time
 import traceback
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
-import schedule
-from selenium import webdriver
-from selenium.common import WebDriverException
-from selenium.webdriver.common.by import By
 
+from alerts import start_alert_dispatcher
+from crawl_executor import CrawlExecutor, DEFAULT_MAX_PER_HOST, DEFAULT_MAX_WORKERS, DEFAULT_QUEUE_SIZE, host_of
+from crawl_control import DEFAULT_CONTROL_HOST, DEFAULT_CONTROL_PORT, start_control_server
+from crawl_metrics import (DEFAULT_METRICS_HOST, DEFAULT_METRICS_PORT, STAGE_DB_WRITE, STAGE_EXTRACT, metrics,
+                           start_metrics_server)
+from crawl_options import DEFAULT_BROWSER_PROFILE, ENGINE_ASYNC, ENGINE_QUEUE, ENGINE_THREADED, ENGINES
+from crawl_scheduler import CrawlScheduler, ELEMENT_REFRESH_INTERVAL, group_by_page
 from db_handler import DbHandler
+from driver_pool import DriverPool
+from extraction import extract_price
+from fetcher import FETCH_MODE_AUTO, FETCH_MODE_HTTP, content_hash, fetch_elements_text, page_validators
+from host_health import DEFAULT_HOST_RATE, FAILURE_BLOCKED, FAILURE_REGEX_MISS, FAILURE_SELECTOR_MISS, HostHealth
+import page_snapshots
+from page_snapshots import (SNAPSHOT_MAX_AGE_DAYS, SNAPSHOTS_PER_PAGE, VALIDATION_DONE, VALIDATION_FAILED,
+                            VALIDATION_SAVE, snapshot_rows)
+from price_writer import PriceWriter
 
+# next due time of every active element, persisted in tracked_elements.next_due
+crawl_scheduler = CrawlScheduler()
 
-scheduled_tasks = {}
+# rate limits, failures and circuit breakers per shop, persisted in the host_health table
+host_health = HostHealth()
 
+# warm browser sessions shared by all tasks, so a run doesn't launch one browser per element
+driver_pool = DriverPool()
+atexit.register(driver_pool.close)
 
-def add_job(task):
-    if not task['is_active']:
-        return
+# bounded worker pool that executes the due jobs, created on first use
+crawl_executor = None
 
-    update_interval = int(task['update_interval'])
-    job = schedule.every(update_interval).minutes
+# scheduled prices are written in batches by a single writer thread, created on first use
+price_writer = None
 
-    # uncomment next line to run task as own thread
-    # job.do(self.run_threaded, task['id'])
+# every crawler thread keeps its own connection for reading tracked elements
+_thread_local = threading.local()
 
-    # or uncomment next line to run task in series
-    job.do(execute_task, task['id'])
+# validations of the form run in the background, so the dashboard doesn't wait for the page to load
+VALIDATION_WORKERS = 2
+validation_executor = None
+
+
+def register_gauges():
+    # queue depths of this engine, evaluated on every scrape of the metrics endpoint
+    metrics.register_gauge('crawl_scheduled_elements', "Elements in the schedule", lambda: len(crawl_scheduler))
+    metrics.register_gauge('crawl_overdue_elements', "Elements whose due time has passed, but weren't dispatched yet",
+                           crawl_scheduler.overdue)
+    metrics.register_gauge('crawl_executor_jobs', "Pages waiting for or running on the crawl executor",
+                           lambda: {state: count for state, count in crawl_executor.stats().items()
+                                    if state in ('queued', 'parked', 'running')} if crawl_executor else {},
+                           label='state')
+    metrics.register_gauge('crawl_price_writer_queued', "Prices waiting for the price writer",
+                           lambda: price_writer.stats()['queued'] if price_writer else 0)
+    metrics.register_gauge('crawl_driver_pool_sessions', "Browser sessions of the driver pool",
+                           lambda: {state: count for state, count in driver_pool.stats().items()
+                                    if state in ('idle', 'alive')}, label='state')
+    metrics.register_gauge('crawl_hosts_failing', "Hosts whose circuit is open or being probed",
+                           host_health.open_hosts)
+
+
+def get_crawl_executor():
+    global crawl_executor
+    if crawl_executor is None:
+        crawl_executor = CrawlExecutor(execute_page)
+    return crawl_executor
+
+
+def get_price_writer():
+    global price_writer
+    if price_writer is None:
+        price_writer = PriceWriter()
+        atexit.register(price_writer.flush, 10)
+    return price_writer
+
+
+def get_validation_executor():
+    global validation_executor
+    if validation_executor is None:
+        validation_executor = ThreadPoolExecutor(VALIDATION_WORKERS, thread_name_prefix='validation')
+    return validation_executor
+
+
+def get_thread_db_handler():
+    _db_handler = getattr(_thread_local, 'db_handler', None)
+    if _db_handler is None:
+        _db_handler = DbHandler()
+        _db_handler.connect()
+        _thread_local.db_handler = _db_handler
+    return _db_handler
+
+
+def submit_task(element_ids, url):
+    # only hands the job over to the executor, so the scheduler thread is never blocked by a crawl
+    # (unless the executor queue is full)
+    get_crawl_executor().submit(element_ids, url)
+
+
+def add_job(task, first_due=None):
+    # adds or replaces the job of the element, inactive elements are removed from the schedule
+    crawl_scheduler.add(task, first_due)
 
-    scheduled_tasks[task['id']] = job
-    print(scheduled_tasks)
 
 def change_update_interval(task):
-    job = scheduled_tasks[task['id']]
-    schedule.cancel_job(job)
-    add_job(task)
+    # the element was just crawled by the gui, so the next run is one interval from now
+    add_job(task, first_due=time.time() + int(task['update_interval']) * 60)
 
 
-def run_scheduler():
-    schedule.run_all()
-    while True:
-        schedule.run_pending()
-        time.sleep(1)  # Adjust as needed to control the frequency of checking for scheduled tasks
+def remove_job(element_id):
+    crawl_scheduler.remove(element_id)
 
 
-def __run_threaded(element_id):
-    job_thread = threading.Thread(target=execute_task, args=[element_id])
-    job_thread.start()
+def run_scheduler(dispatch=submit_task):
+    # dispatch(element_ids, url) is called for every page with due elements
+    _db_handler = get_thread_db_handler()
+    host_health.load(_db_handler.retrieve_host_health())
+    last_refresh = time.monotonic()
+    while True:
+        if time.monotonic() - last_refresh >= ELEMENT_REFRESH_INTERVAL:
+            # picks up elements changed by another process (e.g. the dashboard, if the crawler runs on its own).
+            # an empty result might be a read error, deleted elements are also dropped by execute_task
+            df_tracked_elements = _db_handler.retrieve_tracked_elements(with_stats=True)
+            if not df_tracked_elements.empty:
+                crawl_scheduler.sync(df_tracked_elements.to_dict('records'))
+            # circuits opened by crawl workers of the queue engine
+            host_health.load(_db_handler.retrieve_host_health())
+            last_refresh = time.monotonic()
+
+        # due elements on the same page are crawled together, pages of failing hosts wait for their next probe
+        for url, element_ids in group_by_page(crawl_scheduler.pop_due()):
+            postpone_until = host_health.admit(host_of(url))
+            if postpone_until is not None:
+                crawl_scheduler.postpone(element_ids, postpone_until)
+                continue
+            dispatch(element_ids, url)
+
+        dirty = crawl_scheduler.take_dirty()
+        if dirty:
+            _db_handler.update_next_due(dirty)
+        host_states = host_health.take_dirty()
+        if host_states:
+            _db_handler.update_host_health(host_states)
+
+        # sleep until the next job is due, but check at least every second for jobs added by the gui
+        wait = crawl_scheduler.seconds_until_next()
+        time.sleep(1 if wait is None else min(max(wait, 0.05), 1))
 
 
 def execute_task(element_id, element=None):
-    # open new DBHandler to retrieve the tracked element
+    # the tracked element is read again on every run
     # if anything has been changed in the gui, the updated values are extracted
-    _db_handler = DbHandler()
-    _db_handler.init_db()
+    _db_handler = get_thread_db_handler()
 
     # element is supplied if the function is executed while the element is not yet saved to the db
     # otherwise load tracked_element from the database
     if not element:
         tracked_element = _db_handler.retrieve_tracked_element_by_id(element_id)
+        if not tracked_element:
+            # deleted after it was scheduled
+            remove_job(element_id)
+            return -1
         print('Grabbing', tracked_element['name'])
     else:
         tracked_element = element
-        element_id = tracked_element["id"]
-
-    url = tracked_element['url']
-    xpath = tracked_element['xpath']
-    regex = tracked_element['regex']
 
-    # Pretend being a Human browsing the web
-    user_agent = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.3"
+    return crawl_page(_db_handler, [tracked_element], from_gui=bool(element))[0]
 
-    firefox_options = webdriver.FirefoxOptions()
-    firefox_options.add_argument('--headless')
-    firefox_options.add_argument(f'user-agent={user_agent}')
-    firefox_options.add_argument('--disable-gpu')
-    driver = webdriver.Firefox(options=firefox_options)
 
-    extracted_price = -1
-
-    try:
-        driver.get(url)
+def execute_page(element_ids, wait_for_host=False):
+    # scheduled job: all due elements of one page, the page is only loaded once for all of them
+    _db_handler = get_thread_db_handler()
 
-        html_element = None
-        # Wait for the element to be present on the page
+    tracked_elements = []
+    for element_id in element_ids:
+        tracked_element = _db_handler.retrieve_tracked_element_by_id(element_id)
+        if not tracked_element:
+            # deleted after it was scheduled
+            remove_job(element_id)
+            continue
+        print('Grabbing', tracked_element['name'])
+        tracked_elements.append(tracked_element)
+
+    if tracked_elements:
+        crawl_page(_db_handler, tracked_elements, wait_for_host=wait_for_host)
+
+
+def crawl_page(_db_handler, tracked_elements, from_gui=False, validation_id=None, wait_for_host=False):
+    # evaluates the selectors and regexes of all elements against one load of the page (of the first element).
+    # returns the extracted price per element, -1 if it failed. a scheduled page over the rate limit of its host is
+    # rescheduled, with `wait_for_host` (crawl workers, which have no schedule of their own) it waits
+    prices = [-1] * len(tracked_elements)
+    url = tracked_elements[0]['url']
+    host = host_of(url)
+
+    # timings and outcomes are reported to the metrics and logged as one line per page. crawls from the gui don't
+    # count as scheduler lag
+    element_ids = [] if from_gui else [element['id'] for element in tracked_elements]
+    reported = 0
+    outcomes = []
+
+    if not from_gui:
+        # e.g. queued before the circuit of the host opened. the queue workers check this before they crawl a job
+        blocked_until = None if wait_for_host else host_health.blocked_until(host)
+        if blocked_until is not None:
+            print(f"Skipping {url}, {host} is failing")
+            crawl_scheduler.postpone(element_ids, blocked_until)
+            return prices
+        if wait_for_host:
+            wait = host_health.reserve(host)
+            if wait > 0:
+                time.sleep(wait)
+        else:
+            # the page is crawled again once the host has capacity, instead of blocking a crawler thread
+            wait = host_health.acquire(host)
+            if wait > 0:
+                crawl_scheduler.retry(element_ids, time.time() + wait)
+                return prices
+
+    with metrics.trace(host, url, element_ids):
+        # scheduled runs send conditional requests and skip the regex for unchanged content. the gui always crawls
+        # in full, as it is used to check new / changed parameters
+        states = {} if from_gui else _db_handler.retrieve_fetch_state(element_ids)
+        validators = page_validators([states.get(element['id']) for element in tracked_elements])
+        extracted = [{} for _ in tracked_elements]
         try:
-            html_element = driver.find_element(By.XPATH, xpath)
-        except:
-            try:
-                html_element = driver.find_element(By.CSS_SELECTOR, xpath)
-            except:
-                print("no price found")
-
-        # Extract the element text
-        if html_element:
-            text_content = html_element.get_attribute("textContent")
-            price_str = __extract_price(text_content, regex)
-            if price_str:
-                try:
-                    extracted_price = float(price_str)
-                    print(f"Extracted Price: {extracted_price}")
-
-                    # Get the current system timestamp
-                    current_timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-                    # on the press of the save button the element is not yet in the database.
-                    # therefore it will be created at this point as a valid price was found.
-                    # otherwise, the price is inserted for the existing element ID
-                    if element_id == -1:
-                        element["id"] = None
-                        element_id = _db_handler.insert_tracked_element(pd.DataFrame(element, index=[0]))
-                        print("New tracked element inserted into DB")
-
-                        element = _db_handler.retrieve_tracked_element_by_id(element_id)
-                        add_job(element)
-                        print(schedule.get_jobs())
-
-                    # Create the DataFrame
-                    df = pd.DataFrame({
-                        'tracked_elements_id': [element_id],
-                        'current_price': [extracted_price],
-                        'timestamp': [current_timestamp]
-                    })
-                    # print(df)
-
-                    if _db_handler.insert_price_history(df):
-                        print("Price inserted into DB")
-
-                except ValueError:
-                    print(f"Could not convert extracted price to float: {price_str}")
-                    print(traceback.format_exc())
-            else:
-                print("Could not extract price")
+            # static pages are read with a plain HTTP request, the browser is only used if necessary
+            snapshot = page_snapshots.snapshot_scheduled_crawls or validation_id is not None
+            elements = [fetch_args(element, states.get(element['id']), extracted[i])
+                        for i, element in enumerate(tracked_elements)]
+            results, page = fetch_elements_text(driver_pool, url, elements, validators, snapshot)
+
+            fetch_states = []
+            for i, (tracked_element, (text_content, used_fetch_mode)) in enumerate(zip(tracked_elements, results)):
+                element_id = tracked_element['id']
+                state = states.get(element_id)
+                price = known_price(state, page, text_content, used_fetch_mode)
+                prices[i] = save_price(_db_handler, tracked_element, text_content, used_fetch_mode, from_gui, price,
+                                       extracted[i])
+                outcomes.append(element_outcome(text_content, price, prices[i]))
+                metrics.element_result(element_id, host, outcomes[-1], mode=used_fetch_mode, price=prices[i])
+                reported += 1
+
+                fetch_state = None if from_gui else next_fetch_state(element_id, state, page, text_content,
+                                                                     used_fetch_mode, prices[i])
+                if fetch_state:
+                    fetch_states.append(fetch_state)
+
+            if fetch_states:
+                _db_handler.update_fetch_state(fetch_states)
+            if page['snapshots'] and (validation_id is not None or fetch_states
+                                      or any(outcome in ('not_found', 'no_match') for outcome in outcomes)):
+                save_snapshots(_db_handler, url, page, validation_id)
+            # counted towards the back in stock alerts
+            missing = [element['id'] for element, price in zip(tracked_elements, prices) if price == -1]
+            if missing and not from_gui:
+                _db_handler.record_missing_prices(missing)
+            if not from_gui:
+                retry_page(element_ids, record_page_health(host, element_ids, outcomes, page))
+
+        except Exception:
+            print(traceback.format_exc())
+
+        finally:
+            for tracked_element in tracked_elements[reported:]:
+                metrics.element_result(tracked_element['id'], host, 'error')
+            print('Driver pool', driver_pool.stats())
+    return prices
+
+
+def fetch_args(element, state=None, extracted=None):
+    # (selector, fetch_mode, detected_mode, accept, browser_profile) of fetcher.fetch_elements_text. content that is
+    # unchanged since the last crawl (fetch `state`) is accepted without the regex, known_price confirms its price.
+    # the prices the regex extracts are kept in `extracted` (text -> price string), so save_price reuses them
+    def accept(text, fetch_mode):
+        if state and state['content_hash'] == content_hash(text):
+            return True
+        price_str = extract_text_price(text, element, fetch_mode)
+        if extracted is not None:
+            extracted[text] = price_str
+        return price_str is not None
+
+    return (element['xpath'], element.get('fetch_mode') or FETCH_MODE_AUTO, element.get('detected_fetch_mode'),
+            accept, element.get('browser_profile') or DEFAULT_BROWSER_PROFILE)
+
+
+def extract_text_price(text, element, fetch_mode=None):
+    # price string of the element's text, None if the regex doesn't match
+    with metrics.stage(STAGE_EXTRACT, host_of(element['url']), fetch_mode or '') as result:
+        price_str = extract_price(text, element['regex'])
+        if not price_str:
+            result['outcome'] = 'no_match'
+    return price_str
+
+
+def save_snapshots(_db_handler, url, page, validation_id=None):
+    with metrics.stage(STAGE_DB_WRITE) as result:
+        stored = _db_handler.insert_page_snapshots(snapshot_rows(url, page, validation_id), SNAPSHOTS_PER_PAGE,
+                                                   SNAPSHOT_MAX_AGE_DAYS * 24 * 3600)
+        result['outcome'] = 'ok' if stored else 'error'
+
+
+def run_validation(validation_id, element, action):
+    # background validation of the form's values (see CrawlEngine.validate), the loaded page is stored as snapshot.
+    # 'save' inserts a new element or updates the existing one if a price was found. returns the id of the saved
+    # element, None if nothing was saved
+    _db_handler = get_thread_db_handler()
+    try:
+        if action == VALIDATION_SAVE:
+            element_id = element['id']
+            price = crawl_page(_db_handler, [element], from_gui=True, validation_id=validation_id)[0]
+            if price != -1 and element_id != -1:
+                _db_handler.update_tracked_element(element_id, pd.DataFrame([element]))
+            saved_id = element['id'] if price != -1 else None
         else:
-            print("Element not found")
-
-    except WebDriverException:
-        print("Selenium WebDriver error")
-    except Exception:
+            extracted = {}
+            results, page = fetch_elements_text(driver_pool, element['url'], [fetch_args(element, None, extracted)],
+                                                snapshot=True)
+            if page['snapshots']:
+                save_snapshots(_db_handler, element['url'], page, validation_id)
+            price_str = extracted.get(results[0][0])
+            price = float(price_str) if price_str else -1
+            saved_id = None
+        # why no price was found is shown by testing the form against the stored snapshot
+        _db_handler.update_validation(validation_id, VALIDATION_DONE, price if price != -1 else None, saved_id)
+        return saved_id
+    except Exception as e:
         print(traceback.format_exc())
-
-    finally:
-        driver.quit()  # Close the browser session
-        _db_handler.close_db()
-        return extracted_price
+        _db_handler.update_validation(validation_id, VALIDATION_FAILED, error=str(e))
+        return None
+
+
+def record_page_health(host, element_ids, outcomes, page):
+    # reports the page to the host health: a failure if none of the elements could be read, because of a
+    # (classified) error or because the page that loaded had none of them (e.g. a captcha or a block page, blocked),
+    # a success if at least one was found. returns the due time of a retry, None if there is none
+    if not page['not_modified'] and all(outcome == 'not_found' for outcome in outcomes):
+        failure, error = page['error'] or (FAILURE_BLOCKED, "none of the elements on the page")
+        host_health.record(host, failure, error)
+        return host_health.next_retry(element_ids, failure)
+
+    host_health.record(host)
+    host_health.reset_retries(element_ids)
+    for outcome in outcomes:
+        if outcome in ('not_found', 'no_match'):
+            host_health.record_element(host, FAILURE_SELECTOR_MISS if outcome == 'not_found' else FAILURE_REGEX_MISS)
+    return None
 
 
-# Function to extract text content of an element
-def __extract_price(text, pattern):
-    match = re.search(pattern, text)
-    if match:
-        number_str = match.group()
+def retry_page(element_ids, due):
+    if due is not None:
+        print(f"Retrying elements {element_ids} at {time.ctime(due)}")
+        crawl_scheduler.retry(element_ids, due)
 
-        # number_str somehow gets treated as bytes
-        if isinstance(number_str, bytes):
-            number_str = number_str.decode('utf-8')
 
-        # replace all separators with .
-        number_str = number_str.replace(',', '.')
+def element_outcome(text_content, confirmed_price, price):
+    # label of crawl_elements_total
+    if price == -1:
+        return 'not_found' if text_content is None else 'no_match'
+    return 'extracted' if confirmed_price is None else 'confirmed'
 
-        # find indices of separators
-        separators = [m.start() for m in re.finditer(r'[.]', number_str)]
 
-        # delete all separators except last one
-        if len(separators) > 1:
-            for i in separators[:-1]:
-                number_str = number_str[:i] + '' + number_str[i + 1:]
-        return number_str
+def known_price(state, page, text_content, used_fetch_mode):
+    # the previous price is confirmed if the server answered 304 or the content of the element didn't change
+    if not state:
+        return None
+    if used_fetch_mode == FETCH_MODE_HTTP and text_content is None and page['not_modified']:
+        print("Page not modified")
+        return state['price']
+    if text_content is not None and state['content_hash'] == content_hash(text_content):
+        print("Content unchanged")
+        return state['price']
     return None
 
 
-class Crawly:
+def next_fetch_state(element_id, state, page, text_content, used_fetch_mode, price):
+    # row for DbHandler.update_fetch_state, None if nothing changed or no price was found
+    if price == -1:
+        return None
+    validators = page['validators'] if used_fetch_mode == FETCH_MODE_HTTP and page['validators'] else (None, None)
+    if text_content is not None:
+        text_hash = content_hash(text_content)
+    else:
+        text_hash = state['content_hash'] if state else None
+    fetch_state = (int(element_id), *validators, text_hash, price)
+    if state and (state['etag'], state['last_modified'], state['content_hash'], state['price']) == fetch_state[1:]:
+        return None
+    return fetch_state
+
+
+def save_price(_db_handler, tracked_element, text_content, used_fetch_mode, from_gui=False, price=None,
+               extracted=None):
+    # price is given if the previous price was confirmed, the text is not evaluated then. extracted: the prices
+    # fetch_args' accept already extracted (text -> price string)
+    element_id = tracked_element['id']
+    fetch_mode = tracked_element.get('fetch_mode') or FETCH_MODE_AUTO
+    detected_fetch_mode = tracked_element.get('detected_fetch_mode')
+
+    extracted_price = -1
+    price_str = price
+
+    # Extract the element text
+    if price is None:
+        if text_content is None:
+            print("Element not found")
+            return extracted_price
+
+        if extracted and text_content in extracted:
+            price_str = extracted[text_content]
+        else:
+            price_str = extract_text_price(text_content, tracked_element, used_fetch_mode)
+        if not price_str:
+            print("Could not extract price")
+            return extracted_price
+
+    try:
+        extracted_price = float(price_str)
+        print(f"Extracted Price: {extracted_price}")
+
+        # Get the current system timestamp
+        current_timestamp = int(time.time())
+
+        # on the press of the save button the element is not yet in the database.
+        # therefore it will be created at this point as a valid price was found.
+        # otherwise, the price is inserted for the existing element ID
+        if element_id == -1:
+            tracked_element["id"] = None
+            element_id = _db_handler.insert_tracked_element(pd.DataFrame(tracked_element, index=[0]))
+            tracked_element["id"] = element_id
+            if element_id is None:
+                # e.g. the name was taken in the meantime
+                return -1
+            print("New tracked element inserted into DB")
+
+            element = _db_handler.retrieve_tracked_element_by_id(element_id)
+            add_job(element, first_due=time.time() + int(element['update_interval']) * 60)
+
+        if from_gui:
+            # executed from the gui, which shows the price right away, so it is written directly
+            with metrics.stage(STAGE_DB_WRITE) as result:
+                inserted = _db_handler.insert_price_rows([(int(element_id), extracted_price, current_timestamp)])
+                result['outcome'] = 'ok' if inserted else 'error'
+            if inserted:
+                print("Price inserted into DB")
+        else:
+            get_price_writer().put(element_id, extracted_price, current_timestamp)
+
+        # remember the mode that worked, so the next run goes straight to it
+        if fetch_mode == FETCH_MODE_AUTO and used_fetch_mode and used_fetch_mode != detected_fetch_mode:
+            _db_handler.update_detected_fetch_mode(element_id, used_fetch_mode)
+
+    except ValueError:
+        print(f"Could not convert extracted price to float: {price_str}")
+        print(traceback.format_exc())
+
+    return extracted_price
+
+
+class CrawlEngine:
+    """
+    Operations of the control api (crawl_control.py) that are the same for all engines. Engines that keep their own
+    schedule or copies of the tracked elements override `scheduler` and `refresh`.
+    """
+    name = ENGINE_THREADED
+    scheduler = crawl_scheduler
+    started = None
+
+    def schedule(self, element_id, crawled=False):
+        # adds, updates or removes (if inactive or deleted) the job of the element. crawled: the element was just
+        # crawled by the gui, so the next run is one interval from now
+        tracked_element = get_thread_db_handler().retrieve_tracked_element_by_id(element_id)
+        if not tracked_element:
+            self.scheduler.remove(element_id)
+            return False
+        first_due = time.time() + int(tracked_element['update_interval']) * 60 if crawled else None
+        self.scheduler.add(tracked_element, first_due)
+        self.refresh()
+        return bool(tracked_element['is_active'])
+
+    def unschedule(self, element_id):
+        self.scheduler.remove(element_id)
+        self.refresh()
+
+    def run_now(self, element_ids):
+        # the elements are crawled with the next dispatch of the scheduler, returns the ones that are scheduled
+        now = time.time()
+        self.scheduler.retry(element_ids, now)
+        return [element_id for element_id in element_ids if element_id in self.scheduler]
+
+    def validate(self, element, action):
+        # crawls the form's values in the background (see run_validation), returns the id of the validation the
+        # dashboard polls
+        validation_id = get_thread_db_handler().insert_validation(action, element)
+        if validation_id is not None:
+            get_validation_executor().submit(self._validate, validation_id, element, action)
+        return validation_id
+
+    def _validate(self, validation_id, element, action):
+        element_id = run_validation(validation_id, element, action)
+        if element_id is not None:
+            self.schedule(element_id, crawled=True)
+
+    def refresh(self):
+        pass
+
+    def status(self):
+        seconds_until_next = self.scheduler.seconds_until_next()
+        return {'engine': self.name, 'pid': os.getpid(), 'started': self.started, 'scheduled': len(self.scheduler),
+                'overdue': self.scheduler.overdue(), 'seconds_until_next': seconds_until_next,
+                'hosts_failing': host_health.open_hosts(), 'driver_pool': driver_pool.stats()}
+
+
+class Crawly(CrawlEngine):
     db_handler = None
 
-    def __init__(self, _db_handler: DbHandler):
+    def __init__(self, _db_handler: DbHandler, max_workers=DEFAULT_MAX_WORKERS, max_per_host=DEFAULT_MAX_PER_HOST,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        global crawl_executor
         self.db_handler = _db_handler
         if self.db_handler.conn is None:
             self.db_handler.init_db()
 
-    def run(self):
-        df_tracked_elements = self.db_handler.retrieve_tracked_elements()
+        if crawl_executor is None:
+            crawl_executor = CrawlExecutor(execute_page, max_workers=max_workers, max_per_host=max_per_host,
+                                           queue_size=queue_size)
 
-        # create tasks
-        for _, task in df_tracked_elements.iterrows():
-            add_job(task)
+    def run(self):
+        # due times are restored from the database, overdue jobs are caught up gradually
+        df_tracked_elements = self.db_handler.retrieve_tracked_elements(with_stats=True)
+        crawl_scheduler.load(df_tracked_elements.to_dict('records'))
+        self.started = time.time()
 
-        print(schedule.get_jobs())
+        register_gauges()
 
         # Run the scheduler
         ### THREADED APPROACH ###
-        scheduler_thread = threading.Thread(target=run_scheduler)
+        scheduler_thread = threading.Thread(target=run_scheduler, name='crawl-scheduler')
         scheduler_thread.daemon = True  # Daemonize the thread to exit when the main thread exits
         scheduler_thread.start()
 
 
+def create_engine(_db_handler: DbHandler, engine=ENGINE_THREADED):
+    # imported here, as async_crawly and crawl_worker themselves depend on this module
+    if engine == ENGINE_ASYNC:
+        from async_crawly import AsyncCrawly
+        return AsyncCrawly(_db_handler)
+    if engine == ENGINE_QUEUE:
+        from crawl_worker import CrawlDispatcher
+        return CrawlDispatcher(_db_handler)
+    return Crawly(_db_handler)
+
+
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the price crawler without the dashboard")
+    parser.add_argument('--engine', choices=ENGINES, default=ENGINE_THREADED,
+                        help="'threaded' runs the scheduler with a worker pool, 'async' runs an asyncio event loop, "
+                             "'queue' only queues the due pages for crawl_worker.py processes")
+    parser.add_argument('--workers', type=int, default=DEFAULT_MAX_WORKERS, help="number of crawler threads")
+    parser.add_argument('--per-host', type=int, default=DEFAULT_MAX_PER_HOST,
+                        help="max. concurrent crawls against the same shop")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="max. number of due jobs waiting for a worker")
+    parser.add_argument('--metrics-port', type=int, default=DEFAULT_METRICS_PORT,
+                        help="port of the prometheus endpoint /metrics, 0 to disable it")
+    parser.add_argument('--metrics-host', default=DEFAULT_METRICS_HOST,
+                        help="interface of the prometheus endpoint, it has no authentication")
+    parser.add_argument('--host-rate', type=float, default=DEFAULT_HOST_RATE,
+                        help="max. pages per minute and shop, 0 for no limit")
+    parser.add_argument('--control-port', type=int, default=DEFAULT_CONTROL_PORT,
+                        help="port of the control api used by the dashboard, 0 to disable it")
+    parser.add_argument('--control-host', default=DEFAULT_CONTROL_HOST,
+                        help="interface of the control api, it has no authentication")
+    parser.add_argument('--no-snapshots', action='store_true',
+                        help="don't store page snapshots of scheduled crawls (validations of the form still do)")
+    args = parser.parse_args()
+
+    # a stopped service (SIGTERM) exits like on ctrl-c, so the queued prices are still written (atexit)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     print("Starting Scheduler...")
+    host_health.rate_per_minute = args.host_rate
+    page_snapshots.snapshot_scheduled_crawls = not args.no_snapshots
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port, args.metrics_host)
 
     db_handler = DbHandler()
     if db_handler.conn is None:
         db_handler.init_db()
 
-    scheduler = Crawly(db_handler)
+    if args.engine == ENGINE_ASYNC:
+        from async_crawly import AsyncCrawly
+        scheduler = AsyncCrawly(db_handler, max_per_host=args.per_host)
+    elif args.engine == ENGINE_QUEUE:
+        scheduler = create_engine(db_handler, ENGINE_QUEUE)
+    else:
+        scheduler = Crawly(db_handler, max_workers=args.workers, max_per_host=args.per_host,
+                           queue_size=args.queue_size)
     scheduler.run()
+    start_alert_dispatcher()
+    if args.control_port:
+        start_control_server(scheduler, args.control_port, args.control_host)
 
-    while True:
-        time.sleep(1)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print("Stopping Scheduler...")
@@ -1,90 +1,1286 @@
+import collections
+import itertools
+import json
+import os
 import sqlite3
+import time
+from datetime import datetime
 
+import numpy as np
 import pandas as pd
 
+import price_archive
+from crawl_executor import host_of
 
-class DbHandler:
+DB_PATH = 'pricetracker.db'
 
-    def __init__(self):
-        self.conn = None
+# WAL lets the dashboard read while the crawler writes, synchronous=NORMAL only fsyncs on checkpoints in WAL mode
+CONNECTION_PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',  # 16 MB
+]
 
-    def init_db(self):
-        self.conn = sqlite3.connect('pricetracker.db')
-        cursor = self.conn.cursor()
 
-        # Create a table
-        cursor.execute('''CREATE TABLE IF NOT EXISTS tracked_elements (
-                            id INTEGER PRIMARY KEY,
-                            name VARCHAR(255) NOT NULL,
-                            url VARCHAR(2048) NOT NULL,
-                            xpath TEXT NOT NULL,
-                            update_interval INTEGER NOT NULL,
-                            is_active BOOLEAN NOT NULL DEFAULT TRUE,
-                            regex TEXT NOT NULL
-                        )''')
-
-        cursor.execute('''CREATE TABLE IF NOT EXISTS price_history (
+PRICE_HISTORY_ROWID = '''CREATE TABLE price_history (
                             id INTEGER PRIMARY KEY,
                             tracked_elements_id INTEGER NOT NULL,
                             current_price DOUBLE NOT NULL,
-                            timestamp TIMESTAMP NOT NULL,
+                            timestamp INTEGER NOT NULL,  -- unix epoch in seconds, start of the run
+                            last_seen INTEGER,  -- last time the price was confirmed, end of the run
+                            FOREIGN KEY (tracked_elements_id) REFERENCES tracked_elements (id)
+                        )'''
+
+PRICE_HISTORY_CLUSTERED = '''CREATE TABLE price_history (
+                            tracked_elements_id INTEGER NOT NULL,
+                            timestamp INTEGER NOT NULL,  -- unix epoch in seconds, start of the run
+                            current_price DOUBLE NOT NULL,
+                            last_seen INTEGER,  -- last time the price was confirmed, end of the run
+                            id INTEGER,
+                            PRIMARY KEY (tracked_elements_id, timestamp),
                             FOREIGN KEY (tracked_elements_id) REFERENCES tracked_elements (id)
-                        )''')
+                        ) WITHOUT ROWID'''
+
+PRICE_HISTORY_INDEX = '''CREATE INDEX IF NOT EXISTS idx_price_history_element_timestamp 
+                         ON price_history (tracked_elements_id, timestamp)'''
+
+
+def _add_column_if_missing(cursor, table, column, definition):
+    cursor.execute(f'''PRAGMA table_info({table})''')
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f'''ALTER TABLE {table} ADD COLUMN {column} {definition}''')
+
+
+def _rebuild_price_history(cursor, create_sql, timestamp_expression):
+    # sqlite can't change column types or the table layout in place, so the table is copied
+    cursor.execute('''PRAGMA table_info(price_history)''')
+    has_last_seen = 'last_seen' in [row[1] for row in cursor.fetchall()]
+    last_seen_expression = 'last_seen' if has_last_seen else timestamp_expression
+
+    cursor.execute('''ALTER TABLE price_history RENAME TO price_history_old''')
+    cursor.execute('''DROP INDEX IF EXISTS idx_price_history_element_timestamp''')
+    cursor.execute(create_sql)
+    cursor.execute(f'''INSERT OR REPLACE INTO price_history (id, tracked_elements_id, current_price, timestamp, last_seen)
+                       SELECT id, tracked_elements_id, current_price, {timestamp_expression}, {last_seen_expression} 
+                       FROM price_history_old ORDER BY id''')
+    cursor.execute('''DROP TABLE price_history_old''')
+    if 'WITHOUT ROWID' not in create_sql:
+        cursor.execute(PRICE_HISTORY_INDEX)
+
+
+def _create_tables(cursor):
+    # databases created before migrations were introduced already have these tables
+    cursor.execute('''CREATE TABLE IF NOT EXISTS tracked_elements (
+                        id INTEGER PRIMARY KEY,
+                        name VARCHAR(255) NOT NULL,
+                        url VARCHAR(2048) NOT NULL,
+                        xpath TEXT NOT NULL,
+                        update_interval INTEGER NOT NULL,
+                        is_active BOOLEAN NOT NULL DEFAULT TRUE,
+                        regex TEXT NOT NULL
+                    )''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS price_history (
+                        id INTEGER PRIMARY KEY,
+                        tracked_elements_id INTEGER NOT NULL,
+                        current_price DOUBLE NOT NULL,
+                        timestamp TIMESTAMP NOT NULL,
+                        FOREIGN KEY (tracked_elements_id) REFERENCES tracked_elements (id)
+                    )''')
+
+
+def _add_fetch_mode(cursor):
+    # might already exist in databases that were opened by a version without migrations
+    _add_column_if_missing(cursor, 'tracked_elements', 'fetch_mode', "TEXT NOT NULL DEFAULT 'auto'")
+    _add_column_if_missing(cursor, 'tracked_elements', 'detected_fetch_mode', 'TEXT')
+
+
+def _epoch_timestamps(cursor):
+    # timestamps were stored as local time strings ('%Y-%m-%d %H:%M:%S')
+    _rebuild_price_history(cursor, PRICE_HISTORY_ROWID, '''CASE WHEN typeof(timestamp) = 'integer' THEN timestamp 
+                                                              ELSE CAST(strftime('%s', timestamp, 'utc') AS INTEGER) END''')
+
+
+def _index_price_history(cursor):
+    cursor.execute(PRICE_HISTORY_INDEX)
+
+
+def _price_runs(cursor):
+    # every row becomes a run from timestamp to last_seen, consecutive equal prices can then be merged into one row
+    _add_column_if_missing(cursor, 'price_history', 'last_seen', 'INTEGER')
+    cursor.execute('''UPDATE price_history SET last_seen = timestamp WHERE last_seen IS NULL''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS settings (
+                        key TEXT PRIMARY KEY,
+                        value TEXT
+                    )''')
+
+
+# start of the bucket (epoch) a timestamp belongs to. days and weeks (starting on monday) follow local time
+ROLLUP_BUCKETS = {
+    'hour': "{ts} - {ts} % 3600",
+    'day': "CAST(strftime('%s', {ts}, 'unixepoch', 'localtime', 'start of day', 'utc') AS INTEGER)",
+    'week': "CAST(strftime('%s', {ts}, 'unixepoch', 'localtime', 'start of day', 'weekday 0', '-6 days', 'utc') "
+            "AS INTEGER)",
+}
+ROLLUP_RESOLUTIONS = list(ROLLUP_BUCKETS)
+
+
+def _rebuild_rollups(cursor):
+    # rollups of the stored runs, for existing databases. the writers maintain them per observed price
+    cursor.execute('''DELETE FROM price_rollup''')
+    for resolution, bucket in ROLLUP_BUCKETS.items():
+        # every run counts as an observation at its start and, if it was confirmed later, at its end. the last price
+        # of a bucket is the one of its latest observation, picked by the window function (a bare column next to
+        # several min / max aggregates may come from any row)
+        cursor.execute(f'''INSERT INTO price_rollup 
+                           (tracked_elements_id, resolution, bucket, min_price, max_price, 
+                            last_price, last_timestamp, sum_price, count) 
+                           SELECT tracked_elements_id, ?, bucket, MIN(current_price), MAX(current_price), 
+                                  MAX(last_price), MAX(ts), SUM(current_price), COUNT(*) 
+                           FROM (SELECT tracked_elements_id, current_price, ts, bucket, 
+                                        FIRST_VALUE(current_price) OVER (
+                                            PARTITION BY tracked_elements_id, bucket ORDER BY ts DESC) AS last_price 
+                                 FROM (SELECT tracked_elements_id, current_price, ts, {bucket.format(ts='ts')} AS bucket 
+                                       FROM (SELECT tracked_elements_id, current_price, timestamp AS ts 
+                                             FROM price_history 
+                                             UNION ALL 
+                                             SELECT tracked_elements_id, current_price, last_seen AS ts 
+                                             FROM price_history WHERE last_seen > timestamp))) 
+                           GROUP BY tracked_elements_id, bucket''', [resolution])
+
+
+def _price_rollups(cursor):
+    cursor.execute('''CREATE TABLE IF NOT EXISTS price_rollup (
+                        tracked_elements_id INTEGER NOT NULL,
+                        resolution TEXT NOT NULL,
+                        bucket INTEGER NOT NULL,  -- unix epoch of the start of the bucket
+                        min_price DOUBLE NOT NULL,
+                        max_price DOUBLE NOT NULL,
+                        last_price DOUBLE NOT NULL,
+                        last_timestamp INTEGER NOT NULL,
+                        sum_price DOUBLE NOT NULL,
+                        count INTEGER NOT NULL,
+                        PRIMARY KEY (tracked_elements_id, resolution, bucket)
+                    ) WITHOUT ROWID''')
+    _rebuild_rollups(cursor)
+
+
+def _data_version(cursor):
+    # bumped by every write, readers compare it to find out whether their cached results are still valid
+    cursor.execute('''CREATE TABLE IF NOT EXISTS data_version (
+                        id INTEGER PRIMARY KEY CHECK (id = 1),
+                        version INTEGER NOT NULL
+                    )''')
+    cursor.execute('''INSERT OR IGNORE INTO data_version (id, version) VALUES (1, 0)''')
+
+
+def _next_due(cursor):
+    # epoch of the next scheduled crawl, survives restarts of the crawler
+    _add_column_if_missing(cursor, 'tracked_elements', 'next_due', 'INTEGER')
+
+
+# weight of the latest gap between two price changes in crawl_stats.change_gap. gaps are capped, so a single change
+# after a long flat period doesn't hide the following frequent changes (flat periods show in last_change anyway)
+CHANGE_GAP_SMOOTHING = 0.5
+CHANGE_GAP_CAP = 7 * 24 * 3600
+
+
+def _crawl_stats(cursor):
+    # adaptive crawl frequency: per element switch and bounds (minutes, NULL = derived from update_interval)
+    _add_column_if_missing(cursor, 'tracked_elements', 'adaptive', 'INTEGER NOT NULL DEFAULT 0')
+    _add_column_if_missing(cursor, 'tracked_elements', 'min_interval', 'INTEGER')
+    _add_column_if_missing(cursor, 'tracked_elements', 'max_interval', 'INTEGER')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS crawl_stats (
+                        tracked_elements_id INTEGER PRIMARY KEY,
+                        first_timestamp INTEGER NOT NULL,
+                        last_timestamp INTEGER NOT NULL,
+                        last_price DOUBLE NOT NULL,
+                        last_change INTEGER,  -- time of the last price change
+                        change_gap DOUBLE,  -- moving average of the seconds between two price changes
+                        observations INTEGER NOT NULL,
+                        changes INTEGER NOT NULL
+                    )''')
+
+    # initial stats from the existing history, the gap between changes starts as their average
+    cursor.execute('''INSERT INTO crawl_stats 
+                      (tracked_elements_id, first_timestamp, last_timestamp, last_price, last_change, change_gap, 
+                       observations, changes) 
+                      SELECT tracked_elements_id, MIN(timestamp), MAX(last_seen), MAX(last_price), 
+                             MAX(CASE WHEN changed THEN timestamp END), 
+                             MIN(CAST(MAX(CASE WHEN changed THEN timestamp END) - MIN(timestamp) AS DOUBLE) 
+                                 / NULLIF(SUM(changed), 0), ?), 
+                             COUNT(*) + SUM(last_seen > timestamp), SUM(changed) 
+                      FROM (SELECT tracked_elements_id, timestamp, last_seen, current_price, 
+                                   COALESCE(current_price != LAG(current_price) OVER w, 0) AS changed, 
+                                   LAST_VALUE(current_price) OVER (w ROWS BETWEEN UNBOUNDED PRECEDING 
+                                                                     AND UNBOUNDED FOLLOWING) AS last_price 
+                            FROM price_history 
+                            WINDOW w AS (PARTITION BY tracked_elements_id ORDER BY timestamp)) 
+                      GROUP BY tracked_elements_id''', (CHANGE_GAP_CAP,))
+
+
+def _fetch_state(cursor):
+    # what the page / element looked like at the last successful crawl, for conditional requests
+    cursor.execute('''CREATE TABLE IF NOT EXISTS fetch_state (
+                        tracked_elements_id INTEGER PRIMARY KEY,
+                        etag TEXT,
+                        last_modified TEXT,
+                        content_hash TEXT,  -- sha1 of the textContent of the element
+                        price DOUBLE NOT NULL  -- price extracted from that content
+                    )''')
+
+
+def _browser_profile(cursor):
+    # per element override of the browser profile, NULL uses the default
+    _add_column_if_missing(cursor, 'tracked_elements', 'browser_profile', 'TEXT')
+
+
+def _crawl_jobs(cursor):
+    # shared job queue of the crawl workers, one row per due element. a row is leased by a worker until
+    # lease_until, after that (the worker died) it can be claimed by another one
+    cursor.execute('''CREATE TABLE IF NOT EXISTS crawl_jobs (
+                        tracked_elements_id INTEGER PRIMARY KEY,
+                        page TEXT NOT NULL,  -- normalized url, elements of a page are claimed together
+                        url TEXT NOT NULL,
+                        enqueued INTEGER NOT NULL,
+                        worker TEXT,
+                        lease_until INTEGER,
+                        attempts INTEGER NOT NULL DEFAULT 0
+                    )''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_crawl_jobs_page ON crawl_jobs (page)''')
+    cursor.execute('''CREATE TABLE IF NOT EXISTS crawl_workers (
+                        worker TEXT PRIMARY KEY,
+                        started INTEGER NOT NULL,
+                        last_heartbeat INTEGER NOT NULL,
+                        completed INTEGER NOT NULL DEFAULT 0
+                    )''')
+
+
+# weight of the latest price in crawl_stats.avg_price
+AVG_PRICE_SMOOTHING = 0.1
+# consecutive crawls without a price after which an element counts as out of stock
+OUT_OF_STOCK_AFTER = 3
+
+ALERT_BELOW = 'below'  # price below the threshold
+ALERT_DROP = 'drop'  # price dropped by more than threshold % compared to the previous price
+ALERT_ALL_TIME_LOW = 'all_time_low'
+ALERT_BACK_IN_STOCK = 'back_in_stock'  # price found again after OUT_OF_STOCK_AFTER crawls without one
+ALERT_KINDS = [ALERT_BELOW, ALERT_DROP, ALERT_ALL_TIME_LOW, ALERT_BACK_IN_STOCK]
+
+
+def _alerts(cursor):
+    # running state for the alert rules, maintained with every inserted price like the rest of crawl_stats
+    _add_column_if_missing(cursor, 'crawl_stats', 'min_price', 'DOUBLE')
+    _add_column_if_missing(cursor, 'crawl_stats', 'max_price', 'DOUBLE')
+    _add_column_if_missing(cursor, 'crawl_stats', 'avg_price', 'DOUBLE')  # moving average
+    _add_column_if_missing(cursor, 'crawl_stats', 'missing', 'INTEGER NOT NULL DEFAULT 0')  # crawls without price
+    cursor.execute('''UPDATE crawl_stats SET (min_price, max_price, avg_price) = 
+                          (SELECT MIN(current_price), MAX(current_price), AVG(current_price) FROM price_history 
+                           WHERE price_history.tracked_elements_id = crawl_stats.tracked_elements_id)''')
+
+    cursor.execute('''CREATE TABLE IF NOT EXISTS alert_rules (
+                        id INTEGER PRIMARY KEY,
+                        tracked_elements_id INTEGER NOT NULL,
+                        kind TEXT NOT NULL,  -- one of ALERT_KINDS
+                        threshold DOUBLE,  -- price for 'below', percent for 'drop'
+                        sink TEXT NOT NULL,  -- 'file', 'webhook' or 'smtp'
+                        target TEXT,  -- file path, url or email addresses
+                        is_active BOOLEAN NOT NULL DEFAULT TRUE,
+                        FOREIGN KEY (tracked_elements_id) REFERENCES tracked_elements (id)
+                    )''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_alert_rules_element ON alert_rules (tracked_elements_id)''')
+
+    # outbox of triggered alerts, delivered by alerts.AlertDispatcher
+    cursor.execute('''CREATE TABLE IF NOT EXISTS alert_events (
+                        id INTEGER PRIMARY KEY,
+                        rule_id INTEGER NOT NULL,
+                        tracked_elements_id INTEGER NOT NULL,
+                        kind TEXT NOT NULL,
+                        timestamp INTEGER NOT NULL,
+                        price DOUBLE,
+                        reference DOUBLE,  -- threshold, previous price, previous low or crawls without price
+                        avg_price DOUBLE,
+                        dedup_key TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'pending',  -- pending, delivered, suppressed or failed
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        delivered INTEGER,
+                        error TEXT
+                    )''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_alert_events_status ON alert_events (status, id)''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_alert_events_dedup ON alert_events (dedup_key, delivered)''')
+
+
+def _host_health(cursor):
+    # circuit breaker state and classified failures per host, see host_health.py
+    cursor.execute('''CREATE TABLE IF NOT EXISTS host_health (
+                        host TEXT PRIMARY KEY,
+                        state TEXT NOT NULL DEFAULT 'closed',  -- closed, open or half_open
+                        consecutive_failures INTEGER NOT NULL DEFAULT 0,
+                        open_until INTEGER,
+                        cooldown INTEGER,
+                        successes INTEGER NOT NULL DEFAULT 0,
+                        timeouts INTEGER NOT NULL DEFAULT 0,
+                        blocked INTEGER NOT NULL DEFAULT 0,
+                        errors INTEGER NOT NULL DEFAULT 0,
+                        selector_misses INTEGER NOT NULL DEFAULT 0,
+                        regex_misses INTEGER NOT NULL DEFAULT 0,
+                        last_success INTEGER,
+                        last_failure INTEGER,
+                        last_failure_kind TEXT,
+                        last_error TEXT
+                    )''')
+
+
+def _page_snapshots(cursor):
+    # compressed DOM of crawled pages, see page_snapshots.py
+    cursor.execute('''CREATE TABLE IF NOT EXISTS page_snapshots (
+                        id INTEGER PRIMARY KEY,
+                        page TEXT NOT NULL,  -- normalized url
+                        url TEXT NOT NULL,
+                        fetch_mode TEXT NOT NULL,  -- 'http' (initial HTML) or 'browser' (rendered DOM)
+                        browser_profile TEXT,
+                        fetched INTEGER NOT NULL,
+                        content BLOB NOT NULL,  -- zlib compressed HTML
+                        size INTEGER NOT NULL,  -- uncompressed characters
+                        validation_id INTEGER
+                    )''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_page_snapshots_page ON page_snapshots (page, fetched)''')
+
+    # background validations of the form, polled by the dashboard
+    cursor.execute('''CREATE TABLE IF NOT EXISTS validations (
+                        id INTEGER PRIMARY KEY,
+                        action TEXT NOT NULL,  -- 'snapshot' or 'save'
+                        element TEXT NOT NULL,  -- JSON of the form values
+                        status TEXT NOT NULL DEFAULT 'pending',  -- pending, done or failed
+                        requested INTEGER NOT NULL,
+                        finished INTEGER,
+                        price DOUBLE,
+                        tracked_elements_id INTEGER,  -- the saved element
+                        error TEXT
+                    )''')
+
+
+# the trigram tokenizer of FTS5 needs SQLite 3.34
+FTS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+
+def _element_search(cursor):
+    # host of the url for the filter of the element list, set by the writers
+    _add_column_if_missing(cursor, 'tracked_elements', 'host', 'TEXT')
+    rows = cursor.execute('''SELECT id, url FROM tracked_elements''').fetchall()
+    cursor.executemany('''UPDATE tracked_elements SET host = ? WHERE id = ?''',
+                       [(host_of(url), element_id) for element_id, url in rows])
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_tracked_elements_host ON tracked_elements (host)''')
+
+    # names identify the elements in the chart. duplicates from before the index get their id appended, and a counter
+    # if that name is taken too
+    taken = {row[0] for row in cursor.execute('''SELECT name FROM tracked_elements''')}
+    duplicates = cursor.execute('''SELECT id, name FROM tracked_elements 
+                                  WHERE id NOT IN (SELECT MIN(id) FROM tracked_elements GROUP BY name) 
+                                  ORDER BY id''').fetchall()
+    for element_id, name in duplicates:
+        new_name, number = f'{name} ({element_id})', 1
+        while new_name in taken:
+            number += 1
+            new_name = f'{name} ({element_id}, {number})'
+        taken.add(new_name)
+        cursor.execute('''UPDATE tracked_elements SET name = ? WHERE id = ?''', (new_name, element_id))
+    cursor.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_tracked_elements_name ON tracked_elements (name)''')
+
+    # search of the element list. the trigram tokenizer matches any part (3+ characters) of a name or url, case
+    # insensitive. the index only references tracked_elements and is kept in sync by triggers. without it (older
+    # sqlite) the list is searched with LIKE
+    if not FTS_TRIGRAM:
+        print(f"SQLite {sqlite3.sqlite_version} has no trigram tokenizer, the element list is searched without index")
+        return
+    cursor.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS tracked_elements_fts USING fts5(
+                        name, url, content='tracked_elements', content_rowid='id', tokenize='trigram'
+                    )''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS tracked_elements_fts_insert AFTER INSERT ON tracked_elements BEGIN
+                          INSERT INTO tracked_elements_fts (rowid, name, url) VALUES (new.id, new.name, new.url);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS tracked_elements_fts_delete AFTER DELETE ON tracked_elements BEGIN
+                          INSERT INTO tracked_elements_fts (tracked_elements_fts, rowid, name, url) 
+                          VALUES ('delete', old.id, old.name, old.url);
+                      END''')
+    cursor.execute('''CREATE TRIGGER IF NOT EXISTS tracked_elements_fts_update 
+                      AFTER UPDATE OF name, url ON tracked_elements BEGIN
+                          INSERT INTO tracked_elements_fts (tracked_elements_fts, rowid, name, url) 
+                          VALUES ('delete', old.id, old.name, old.url);
+                          INSERT INTO tracked_elements_fts (rowid, name, url) VALUES (new.id, new.name, new.url);
+                      END''')
+    cursor.execute('''INSERT INTO tracked_elements_fts (tracked_elements_fts) VALUES ('rebuild')''')
+
+
+def _alert_retries(cursor):
+    # failed and rate limited deliveries wait until next_attempt (epoch), the dispatcher only reads due events
+    _add_column_if_missing(cursor, 'alert_events', 'next_attempt', 'INTEGER NOT NULL DEFAULT 0')
+    cursor.execute('''DROP INDEX IF EXISTS idx_alert_events_status''')
+    cursor.execute('''CREATE INDEX IF NOT EXISTS idx_alert_events_due ON alert_events (status, next_attempt)''')
+
+
+# last crawl status of an element in the element list: its shop is failing (circuit open), its last crawls found no
+# price, it had no price yet or the last crawl found one
+CRAWL_STATUS_FAILING = 'shop_failing'
+CRAWL_STATUS_NO_PRICE = 'no_price'
+CRAWL_STATUS_NEW = 'no_price_yet'
+CRAWL_STATUS_OK = 'ok'
+CRAWL_STATUSES = [CRAWL_STATUS_OK, CRAWL_STATUS_NO_PRICE, CRAWL_STATUS_NEW, CRAWL_STATUS_FAILING]
+CRAWL_STATUS_EXPRESSION = f'''CASE WHEN h.state IN ('open', 'half_open') THEN '{CRAWL_STATUS_FAILING}' 
+                                   WHEN s.tracked_elements_id IS NULL THEN '{CRAWL_STATUS_NEW}' 
+                                   WHEN s.missing > 0 THEN '{CRAWL_STATUS_NO_PRICE}' 
+                                   ELSE '{CRAWL_STATUS_OK}' END'''
+
+# sort orders of the element list, the id keeps the order of equal values stable between pages
+ELEMENT_SORTS = {
+    'name': 'e.name',
+    'host': 'e.host',
+    'last_crawl': 's.last_timestamp',
+    'last_price': 's.last_price',
+    'added': 'e.id',
+}
+ELEMENT_PAGE_SIZE = 50
 
-        self.conn.commit()
+
+def evaluate_alert_rule(kind, threshold, state, price):
+    """
+    Returns the reference value (threshold, previous price, low or missed crawls) if the rule fires for the new price, None otherwise.
+    `state` is the crawl_stats row of the element before the price: (last_price, min_price, missing), None for the
+    first price. Rules fire when the condition starts to hold, not as long as it holds.
+    """
+    last_price, min_price, missing = state or (None, None, 0)
+    if kind == ALERT_BELOW:
+        if threshold is not None and price < threshold and (last_price is None or last_price >= threshold):
+            return threshold
+    elif kind == ALERT_DROP:
+        if threshold is not None and last_price and price <= last_price * (1 - threshold / 100):
+            return last_price
+    elif kind == ALERT_ALL_TIME_LOW:
+        if min_price is not None and price < min_price:
+            return min_price
+    elif kind == ALERT_BACK_IN_STOCK:
+        if missing >= OUT_OF_STOCK_AFTER:
+            return float(missing)
+    return None
+
+
+def _bump_data_version(cursor):
+    cursor.execute('''UPDATE data_version SET version = version + 1 WHERE id = 1''')
+
+
+# append only, the position in the list is the schema version
+MIGRATIONS = [
+    _create_tables,
+    _add_fetch_mode,
+    _epoch_timestamps,
+    _index_price_history,
+    _price_runs,
+    _price_rollups,
+    _data_version,
+    _next_due,
+    _crawl_stats,
+    _fetch_state,
+    _browser_profile,
+    _crawl_jobs,
+    _alerts,
+    _host_health,
+    _page_snapshots,
+    _element_search,
+    _alert_retries,
+]
+
+# 'full' stores every crawled price, 'changes' only stores a price when it changed and extends the last_seen
+# timestamp of the current run otherwise
+HISTORY_MODE_FULL = 'full'
+HISTORY_MODE_CHANGES = 'changes'
+
+
+def to_epoch(timestamp):
+    # naive datetimes and strings are interpreted as local time
+    if isinstance(timestamp, (int, np.integer)):
+        return int(timestamp)
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+    if isinstance(timestamp, pd.Timestamp):
+        timestamp = timestamp.to_pydatetime()
+    return int(timestamp.timestamp())
+
+
+def _optional_int(value):
+    return None if value is None or pd.isna(value) else int(value)
+
+
+class DbHandler:
+
+    def __init__(self, db_path=DB_PATH, archive_dir=None):
+        self.db_path = db_path
+        self.archive_dir = archive_dir or price_archive.default_archive_dir(db_path)
+        self.conn = None
+        self._element_index = None  # whether the database has the search index, see _has_element_index
+
+    def connect(self):
+        # opens the connection without touching the schema, see init_db for that
+        self.conn = sqlite3.connect(self.db_path)
+        for pragma in CONNECTION_PRAGMAS:
+            self.conn.execute(pragma)
+
+    def init_db(self):
+        self.connect()
+        self.migrate()
+
+    def migrate(self):
+        # the schema version is kept in sqlite's user_version, every migration runs in its own transaction
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        for target_version, migration in enumerate(MIGRATIONS, start=1):
+            if version >= target_version:
+                continue
+            print(f"Migrating database to version {target_version}: {migration.__name__}")
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute('BEGIN')
+                migration(cursor)
+                cursor.execute(f'PRAGMA user_version = {target_version}')
+                self.conn.commit()
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+
+    def set_price_history_layout(self, clustered):
+        """
+        Rebuilds price_history either as a regular rowid table with an index on (tracked_elements_id, timestamp)
+        or as a WITHOUT ROWID table clustered by that key, which stores the rows of an element next to each other.
+        In the clustered layout, only one price per element and second is kept.
+        """
+        if self.is_price_history_clustered() == clustered:
+            return
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            _rebuild_price_history(cursor, PRICE_HISTORY_CLUSTERED if clustered else PRICE_HISTORY_ROWID,
+                                   'timestamp')
+            _bump_data_version(cursor)
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+
+    def is_price_history_clustered(self):
+        row = self.conn.execute('''SELECT sql FROM sqlite_master 
+                                   WHERE type = 'table' AND name = 'price_history' ''').fetchone()
+        return row is not None and 'WITHOUT ROWID' in row[0].upper()
 
     def insert_tracked_element(self, df):
         cursor = self.conn.cursor()
         try:
             for index, row in df.iterrows():
                 cursor.execute('''INSERT INTO tracked_elements 
-                                  (name, url, xpath, update_interval, is_active, regex) 
-                                  VALUES (?, ?, ?, ?, ?, ?)''',
+                                  (name, url, xpath, update_interval, is_active, regex, fetch_mode, 
+                                   adaptive, min_interval, max_interval, browser_profile, host) 
+                                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                                (row['name'], row['url'], row['xpath'], row['update_interval'],
-                                row['is_active'], row['regex']))
+                                row['is_active'], row['regex'], row.get('fetch_mode', 'auto'),
+                                bool(row.get('adaptive', False)), _optional_int(row.get('min_interval')),
+                                _optional_int(row.get('max_interval')), row.get('browser_profile'),
+                                host_of(row['url'])))
+            new_id = cursor.lastrowid
+            _bump_data_version(cursor)
             self.conn.commit()
-            return cursor.lastrowid  # return new id
+            return new_id  # return new id
         except sqlite3.Error as e:
+            # e.g. the name is taken (unique index)
+            self.conn.rollback()
             print(f"Error inserting data: {e}")
 
+    def insert_tracked_elements(self, rows):
+        # rows: list of dicts with the columns of insert_tracked_element, inserted in one transaction.
+        # returns the new ids, None if the transaction failed
+        try:
+            with self.conn:
+                cursor = self.conn.cursor()
+                ids = []
+                for row in rows:
+                    cursor.execute('''INSERT INTO tracked_elements 
+                                      (name, url, xpath, update_interval, is_active, regex, fetch_mode, 
+                                       adaptive, min_interval, max_interval, browser_profile, host) 
+                                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                                   (row['name'], row['url'], row['xpath'], int(row['update_interval']),
+                                    bool(row['is_active']), row['regex'], row.get('fetch_mode', 'auto'),
+                                    bool(row.get('adaptive', False)), _optional_int(row.get('min_interval')),
+                                    _optional_int(row.get('max_interval')), row.get('browser_profile'),
+                                    host_of(row['url'])))
+                    ids.append(cursor.lastrowid)
+                _bump_data_version(cursor)
+            return ids
+        except sqlite3.Error as e:
+            print(f"Error inserting tracked elements: {e}")
+            return None
+
     def update_tracked_element(self, id_, df):
         cursor = self.conn.cursor()
         try:
             for index, row in df.iterrows():
+                # the detected fetch mode is reset, as it might not work for the changed url / selector
                 cursor.execute('''UPDATE tracked_elements 
                                   SET name=?, url=?, xpath=?, update_interval=?, 
-                                     is_active=?, regex=? 
+                                     is_active=?, regex=?, fetch_mode=?, detected_fetch_mode=NULL, 
+                                     adaptive=?, min_interval=?, max_interval=?, browser_profile=?, host=? 
                                   WHERE id=?''',
                                (row['name'], row['url'], row['xpath'], row['update_interval'],
-                                row['is_active'], row.get('regex', ''), int(id_)))
+                                row['is_active'], row.get('regex', ''), row.get('fetch_mode', 'auto'),
+                                bool(row.get('adaptive', False)), _optional_int(row.get('min_interval')),
+                                _optional_int(row.get('max_interval')), row.get('browser_profile'),
+                                host_of(row['url']), int(id_)))
                 print(f"Done updating row {index + 1}/{len(df)}. Rows affected: {cursor.rowcount}")
+                # the stored content might belong to another page / selector / regex now
+                cursor.execute('''DELETE FROM fetch_state WHERE tracked_elements_id=?''', (int(id_),))
+            _bump_data_version(cursor)
             self.conn.commit()
             print("Data updated successfully!")
+            return True
         except sqlite3.Error as e:
+            self.conn.rollback()
             print(f"Error updating data: {e}")
+            return False
 
-    def insert_price_history(self, df):
+    def update_detected_fetch_mode(self, element_id, fetch_mode):
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''UPDATE tracked_elements SET detected_fetch_mode=? WHERE id=?''',
+                           (fetch_mode, int(element_id)))
+            _bump_data_version(cursor)
+            self.conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error updating fetch mode: {e}")
+
+    def update_next_due(self, rows):
+        # rows of (next_due, element_id). only written by the scheduler, the data version is not bumped,
+        # so cached dashboard reads stay valid
+        try:
+            self.conn.executemany('''UPDATE tracked_elements SET next_due=? WHERE id=?''', rows)
+            self.conn.commit()
+            return True
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"Error updating next due times: {e}")
+            return False
+
+    def retrieve_fetch_state(self, element_ids):
+        # element id -> {'etag', 'last_modified', 'content_hash', 'price'}
+        element_ids = [int(element_id) for element_id in element_ids]
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(f'''SELECT tracked_elements_id, etag, last_modified, content_hash, price FROM fetch_state 
+                               WHERE tracked_elements_id IN ({','.join('?' * len(element_ids))})''', element_ids)
+            return {row[0]: {'etag': row[1], 'last_modified': row[2], 'content_hash': row[3], 'price': row[4]}
+                    for row in cursor.fetchall()}
+        except sqlite3.Error as e:
+            print(f"Error retrieving fetch state: {e}")
+            return {}
+
+    def update_fetch_state(self, rows):
+        # rows of (element_id, etag, last_modified, content_hash, price). crawler internal like next_due,
+        # the data version is not bumped
+        try:
+            self.conn.executemany('''INSERT OR REPLACE INTO fetch_state 
+                                     (tracked_elements_id, etag, last_modified, content_hash, price) 
+                                     VALUES (?, ?, ?, ?, ?)''', rows)
+            self.conn.commit()
+            return True
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"Error updating fetch state: {e}")
+            return False
+
+    def enqueue_crawl_jobs(self, page, url, element_ids):
+        # elements that are already queued or leased are not queued again
+        try:
+            with self.conn:
+                self.conn.executemany('''INSERT OR IGNORE INTO crawl_jobs (tracked_elements_id, page, url, enqueued) 
+                                         VALUES (?, ?, ?, ?)''',
+                                      [(int(element_id), page, url, int(time.time())) for element_id in element_ids])
+            return True
+        except sqlite3.Error as e:
+            print(f"Error enqueuing crawl jobs: {e}")
+            return False
+
+    def claim_crawl_job(self, worker, lease_seconds, max_attempts):
+        """
+        Leases the oldest claimable page (queued, or leased by a worker whose lease expired) to `worker` and returns
+        (url, element ids, time the oldest of them was queued), None if nothing is due. Elements that were claimed
+        `max_attempts` times without being completed are dropped.
+        """
+        now = int(time.time())
         cursor = self.conn.cursor()
         try:
-            for index, row in df.iterrows():
-                cursor.execute('''INSERT INTO price_history 
-                                  (tracked_elements_id, current_price, timestamp) 
-                                  VALUES (?, ?, ?)''',
-                               (row['tracked_elements_id'], row['current_price'], row['timestamp']))
+            # IMMEDIATE takes the write lock right away, so two workers can't claim the same page
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''DELETE FROM crawl_jobs WHERE lease_until < ? AND attempts >= ?''', (now, max_attempts))
+            if cursor.rowcount:
+                print(f"Dropped {cursor.rowcount} crawl jobs after {max_attempts} attempts")
+
+            # queued jobs have no lease, released ones may have one until they can be claimed again
+            row = cursor.execute('''SELECT page FROM crawl_jobs WHERE lease_until IS NULL OR lease_until < ? 
+                                     ORDER BY enqueued LIMIT 1''', (now,)).fetchone()
+            if row is None:
+                self.conn.commit()
+                return None
+
+            jobs = cursor.execute('''SELECT tracked_elements_id, url, enqueued FROM crawl_jobs 
+                                      WHERE page = ? AND (lease_until IS NULL OR lease_until < ?)''',
+                                  (row[0], now)).fetchall()
+            element_ids = [job[0] for job in jobs]
+            cursor.execute(f'''UPDATE crawl_jobs SET worker = ?, lease_until = ?, attempts = attempts + 1 
+                                WHERE tracked_elements_id IN ({','.join('?' * len(element_ids))})''',
+                           (worker, now + lease_seconds, *element_ids))
             self.conn.commit()
+            return jobs[0][1], element_ids, min(job[2] for job in jobs)
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"Error claiming crawl job: {e}")
+            return None
+
+    def complete_crawl_jobs(self, worker, element_ids):
+        # only removes jobs that are still leased by the worker, it might have lost the lease in the meantime
+        try:
+            with self.conn:
+                cursor = self.conn.cursor()
+                cursor.executemany('''DELETE FROM crawl_jobs WHERE tracked_elements_id = ? AND worker = ?''',
+                                   [(int(element_id), worker) for element_id in element_ids])
+                cursor.execute('''UPDATE crawl_workers SET completed = completed + ? WHERE worker = ?''',
+                               (len(element_ids), worker))
+            return True
+        except sqlite3.Error as e:
+            print(f"Error completing crawl jobs: {e}")
+            return False
+
+    def release_crawl_jobs(self, worker, element_ids, not_before=None):
+        # gives the jobs back to the queue without completing them, they can be claimed again right away or after
+        # `not_before` (epoch). a release with not_before (the page wasn't crawled) doesn't count as an attempt
+        try:
+            with self.conn:
+                self.conn.executemany('''UPDATE crawl_jobs SET worker = NULL, lease_until = ?, 
+                                                             attempts = attempts - (? IS NOT NULL) 
+                                         WHERE tracked_elements_id = ? AND worker = ?''',
+                                      [(_optional_int(not_before), _optional_int(not_before), int(element_id), worker)
+                                       for element_id in element_ids])
+            return True
+        except sqlite3.Error as e:
+            print(f"Error releasing crawl jobs: {e}")
+            return False
+
+    def heartbeat_crawl_worker(self, worker, lease_seconds):
+        # renews the leases of all jobs the worker holds
+        now = int(time.time())
+        try:
+            with self.conn:
+                self.conn.execute('''INSERT INTO crawl_workers (worker, started, last_heartbeat) VALUES (?, ?, ?) 
+                                     ON CONFLICT (worker) DO UPDATE SET last_heartbeat = excluded.last_heartbeat''',
+                                  (worker, now, now))
+                self.conn.execute('''UPDATE crawl_jobs SET lease_until = ? WHERE worker = ?''',
+                                  (now + lease_seconds, worker))
+            return True
+        except sqlite3.Error as e:
+            print(f"Error sending heartbeat: {e}")
+            return False
+
+    def retrieve_crawl_queue_stats(self):
+        now = int(time.time())
+        row = self.conn.execute('''SELECT COUNT(*), 
+                                           COALESCE(SUM(worker IS NOT NULL AND lease_until >= ?), 0), 
+                                           COALESCE(SUM(worker IS NOT NULL AND lease_until < ?), 0), 
+                                           MIN(enqueued) 
+                                    FROM crawl_jobs''', (now, now)).fetchone()
+        return {'jobs': row[0], 'leased': row[1], 'expired': row[2], 'oldest_enqueued': row[3]}
+
+    def insert_price_history(self, df):
+        rows = [(row['tracked_elements_id'], row['current_price'], row['timestamp']) for _, row in df.iterrows()]
+        return self.insert_price_rows(rows)
+
+    def insert_price_rows(self, rows):
+        # rows: list of (tracked_elements_id, current_price, timestamp), written in one transaction
+        try:
+            self.write_price_rows(rows)
             return True
         except sqlite3.Error as e:
             print(f"Error inserting data: {e}")
             return False
 
-    def retrieve_tracked_elements(self):
+    def write_price_rows(self, rows):
+        # like insert_price_rows, but raises the sqlite3.Error, so the price writers can tell a locked database from
+        # rows that can't be written
+        with self.conn:
+            cursor = self.conn.cursor()
+            self._write_prices(cursor, rows)
+            _bump_data_version(cursor)
+
+    def _write_prices(self, cursor, rows):
+        changes_only = self.get_setting('history_mode', HISTORY_MODE_FULL) == HISTORY_MODE_CHANGES
+        last_runs = {}  # element id -> (timestamp, price) of the latest run
+
+        for element_id, price, timestamp in rows:
+            element_id, price, timestamp = int(element_id), float(price), to_epoch(timestamp)
+
+            self._update_rollups(cursor, element_id, price, timestamp)
+            # the rules see the state before the price
+            self._evaluate_alerts(cursor, element_id, price, timestamp)
+            self._update_crawl_stats(cursor, element_id, price, timestamp)
+
+            if changes_only:
+                if element_id not in last_runs:
+                    cursor.execute('''SELECT timestamp, current_price FROM price_history 
+                                      WHERE tracked_elements_id = ? ORDER BY timestamp DESC LIMIT 1''', (element_id,))
+                    last_runs[element_id] = cursor.fetchone()
+                last_run = last_runs[element_id]
+
+                if last_run is not None and last_run[1] == price and timestamp >= last_run[0]:
+                    # price didn't change, the current run is extended
+                    cursor.execute('''UPDATE price_history SET last_seen = MAX(last_seen, ?) 
+                                      WHERE tracked_elements_id = ? AND timestamp = ?''',
+                                   (timestamp, element_id, last_run[0]))
+                    continue
+                last_runs[element_id] = (timestamp, price)
+
+            # OR REPLACE: the clustered layout keeps one price per element and second
+            cursor.execute('''INSERT OR REPLACE INTO price_history 
+                              (tracked_elements_id, current_price, timestamp, last_seen) 
+                              VALUES (?, ?, ?, ?)''', (element_id, price, timestamp, timestamp))
+
+    @staticmethod
+    def _update_rollups(cursor, element_id, price, timestamp):
+        # rollups are maintained with every observed price, also if the history only stores changes
+        for resolution, bucket in ROLLUP_BUCKETS.items():
+            cursor.execute(f'''INSERT INTO price_rollup 
+                               (tracked_elements_id, resolution, bucket, min_price, max_price, 
+                                last_price, last_timestamp, sum_price, count) 
+                               VALUES (:id, :resolution, {bucket.format(ts=':ts')}, :price, :price, :price, :ts, :price, 1) 
+                               ON CONFLICT (tracked_elements_id, resolution, bucket) DO UPDATE SET 
+                                   min_price = MIN(min_price, excluded.min_price), 
+                                   max_price = MAX(max_price, excluded.max_price), 
+                                   last_price = CASE WHEN excluded.last_timestamp >= last_timestamp 
+                                                     THEN excluded.last_price ELSE last_price END, 
+                                   last_timestamp = MAX(last_timestamp, excluded.last_timestamp), 
+                                   sum_price = sum_price + excluded.sum_price, 
+                                   count = count + 1''',
+                           {'id': element_id, 'resolution': resolution, 'price': price, 'ts': timestamp})
+
+    @staticmethod
+    def _correct_rollups(cursor, element_id, old_price, price, timestamp):
+        # the observation at `timestamp` had old_price, its buckets keep their count. if it was the minimum or maximum
+        # of a bucket, that is taken from the runs of the bucket again (price_history already has the new price)
+        for resolution, bucket in ROLLUP_BUCKETS.items():
+            row = cursor.execute(f'''SELECT bucket, min_price, max_price FROM price_rollup 
+                                     WHERE tracked_elements_id = :id AND resolution = :resolution 
+                                     AND bucket = {bucket.format(ts=':ts')}''',
+                                 {'id': element_id, 'resolution': resolution, 'ts': timestamp}).fetchone()
+            if row is None:
+                continue
+            start, old_min, old_max = row
+            min_price, max_price = min(old_min, price), max(old_max, price)
+            if old_price in (old_min, old_max):
+                runs = cursor.execute(f'''SELECT MIN(current_price), MAX(current_price) FROM price_history 
+                                          WHERE tracked_elements_id = ? AND last_seen >= ? 
+                                          AND {bucket.format(ts='timestamp')} <= ?''',
+                                      (element_id, start, start)).fetchone()
+                min_price = runs[0] if old_price == old_min else min_price
+                max_price = runs[1] if old_price == old_max else max_price
+            cursor.execute('''UPDATE price_rollup SET min_price = ?, max_price = ?, sum_price = sum_price + ?, 
+                                     last_price = CASE WHEN last_timestamp = ? THEN ? ELSE last_price END 
+                              WHERE tracked_elements_id = ? AND resolution = ? AND bucket = ?''',
+                           (min_price, max_price, price - old_price, timestamp, price, element_id, resolution, start))
+
+    @staticmethod
+    def _update_crawl_stats(cursor, element_id, price, timestamp):
+        # all expressions see the values before the update. prices older than the last one are ignored
+        cursor.execute('''INSERT INTO crawl_stats 
+                          (tracked_elements_id, first_timestamp, last_timestamp, last_price, observations, changes, 
+                           min_price, max_price, avg_price) 
+                          VALUES (:id, :ts, :ts, :price, 1, 0, :price, :price, :price) 
+                          ON CONFLICT (tracked_elements_id) DO UPDATE SET 
+                              min_price = MIN(COALESCE(min_price, :price), :price), 
+                              max_price = MAX(COALESCE(max_price, :price), :price), 
+                              avg_price = COALESCE(avg_price * (1 - :beta) + :beta * :price, :price), 
+                              missing = 0, 
+                              change_gap = CASE WHEN excluded.last_price = last_price THEN change_gap 
+                                                WHEN change_gap IS NULL 
+                                                THEN MIN(excluded.last_timestamp - COALESCE(last_change, first_timestamp), 
+                                                         :cap) 
+                                                ELSE change_gap * (1 - :alpha) + :alpha * 
+                                                     MIN(excluded.last_timestamp - COALESCE(last_change, first_timestamp), 
+                                                         :cap) 
+                                           END, 
+                              last_change = CASE WHEN excluded.last_price != last_price 
+                                                 THEN excluded.last_timestamp ELSE last_change END, 
+                              changes = changes + (excluded.last_price != last_price), 
+                              observations = observations + 1, 
+                              last_price = excluded.last_price, 
+                              last_timestamp = excluded.last_timestamp 
+                          WHERE excluded.last_timestamp >= last_timestamp''',
+                       {'id': element_id, 'ts': timestamp, 'price': price, 'alpha': CHANGE_GAP_SMOOTHING,
+                        'cap': CHANGE_GAP_CAP, 'beta': AVG_PRICE_SMOOTHING})
+
+    @staticmethod
+    def _evaluate_alerts(cursor, element_id, price, timestamp):
+        # two primary key / index lookups per price, the history is never scanned
+        rules = cursor.execute('''SELECT id, kind, threshold FROM alert_rules 
+                                  WHERE tracked_elements_id = ? AND is_active''', (element_id,)).fetchall()
+        if not rules:
+            return
+        row = cursor.execute('''SELECT last_timestamp, last_price, min_price, missing, avg_price FROM crawl_stats 
+                                WHERE tracked_elements_id = ?''', (element_id,)).fetchone()
+        if row is not None and timestamp < row[0]:
+            return  # older than the latest price, e.g. an import
+        state = row[1:4] if row is not None else None
+        avg_price = row[4] if row is not None else None
+
+        for rule_id, kind, threshold in rules:
+            reference = evaluate_alert_rule(kind, threshold, state, price)
+            if reference is None:
+                continue
+            # the same alert for the same price is only delivered once within the dedup window
+            dedup_key = f'{rule_id}:{kind}' if kind == ALERT_BACK_IN_STOCK else f'{rule_id}:{kind}:{price}'
+            cursor.execute('''INSERT INTO alert_events 
+                              (rule_id, tracked_elements_id, kind, timestamp, price, reference, avg_price, dedup_key) 
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?)''',
+                           (rule_id, element_id, kind, timestamp, price, reference, avg_price, dedup_key))
+
+    def record_missing_prices(self, element_ids):
+        # crawls that didn't find a price, OUT_OF_STOCK_AFTER of them in a row arm the back in stock alerts
+        try:
+            with self.conn:
+                cursor = self.conn.cursor()
+                cursor.executemany('''UPDATE crawl_stats SET missing = missing + 1 WHERE tracked_elements_id = ?''',
+                                   [(int(element_id),) for element_id in element_ids])
+                # the status of the element list
+                _bump_data_version(cursor)
+            return True
+        except sqlite3.Error as e:
+            print(f"Error recording missing prices: {e}")
+            return False
+
+    def update_host_health(self, rows):
+        # rows of HostHealth.take_dirty: the state replaces the stored one, the counters are added
+        try:
+            with self.conn:
+                cursor = self.conn.cursor()
+                cursor.executemany('''INSERT INTO host_health 
+                                      (host, state, consecutive_failures, open_until, cooldown, successes, 
+                                       timeouts, blocked, errors, selector_misses, regex_misses, last_success, 
+                                       last_failure, last_failure_kind, last_error) 
+                                      VALUES (:host, :state, :consecutive_failures, :open_until, :cooldown, 
+                                              :successes, :timeouts, :blocked, :errors, :selector_misses, 
+                                              :regex_misses, :last_success, :last_failure, :last_failure_kind, 
+                                              :last_error) 
+                                      ON CONFLICT (host) DO UPDATE SET 
+                                          state = excluded.state, 
+                                          consecutive_failures = excluded.consecutive_failures, 
+                                          open_until = excluded.open_until, 
+                                          cooldown = excluded.cooldown, 
+                                          successes = successes + excluded.successes, 
+                                          timeouts = timeouts + excluded.timeouts, 
+                                          blocked = blocked + excluded.blocked, 
+                                          errors = errors + excluded.errors, 
+                                          selector_misses = selector_misses + excluded.selector_misses, 
+                                          regex_misses = regex_misses + excluded.regex_misses, 
+                                          last_success = MAX(COALESCE(last_success, 0), 
+                                                             COALESCE(excluded.last_success, 0)), 
+                                          last_failure = COALESCE(excluded.last_failure, last_failure), 
+                                          last_failure_kind = COALESCE(excluded.last_failure_kind, 
+                                                                       last_failure_kind), 
+                                          last_error = COALESCE(excluded.last_error, last_error)''', rows)
+                # the status of the element list (failing shops)
+                _bump_data_version(cursor)
+            return True
+        except sqlite3.Error as e:
+            print(f"Error updating host health: {e}")
+            return False
+
+    def retrieve_host_health(self):
+        cursor = self.conn.execute('''SELECT * FROM host_health ORDER BY host''')
+        return [{column[0]: value for column, value in zip(cursor.description, row)} for row in cursor.fetchall()]
+
+    def insert_page_snapshots(self, rows, keep=None, max_age=None):
+        """
+        Stores the rows of page_snapshots.snapshot_rows. Afterwards only the latest `keep` crawls of those pages are
+        kept and snapshots older than `max_age` seconds are deleted. Doesn't bump the data version.
+        """
+        try:
+            with self.conn:
+                self.conn.executemany('''INSERT INTO page_snapshots 
+                                         (page, url, fetch_mode, browser_profile, fetched, content, size, 
+                                          validation_id) 
+                                         VALUES (:page, :url, :fetch_mode, :browser_profile, :fetched, :content, 
+                                                 :size, :validation_id)''', rows)
+                if keep:
+                    # a crawl can store a snapshot per fetch mode, those count as one
+                    self.conn.executemany('''DELETE FROM page_snapshots WHERE page = ? AND fetched < 
+                                                 (SELECT MIN(fetched) FROM 
+                                                      (SELECT DISTINCT fetched FROM page_snapshots WHERE page = ? 
+                                                       ORDER BY fetched DESC LIMIT ?))''',
+                                          [(page, page, keep) for page in {row['page'] for row in rows}])
+                if max_age:
+                    self.conn.execute('''DELETE FROM page_snapshots WHERE fetched < ?''',
+                                      (int(time.time() - max_age),))
+            return True
+        except sqlite3.Error as e:
+            print(f"Error inserting page snapshots: {e}")
+            return False
+
+    def retrieve_page_snapshots(self, page, fetch_mode=None, start=None, limit=None, with_content=False):
+        # snapshots of a page (normalized url), latest first
+        columns = 'id, page, url, fetch_mode, browser_profile, fetched, size, validation_id'
+        if with_content:
+            columns += ', content'
+        cursor = self.conn.execute(f'''SELECT {columns} FROM page_snapshots 
+                                       WHERE page = ? AND (? IS NULL OR fetch_mode = ?) AND fetched >= ? 
+                                       ORDER BY fetched DESC, id DESC LIMIT ?''',
+                                   (page, fetch_mode, fetch_mode, start or 0, limit or -1))
+        return [{column[0]: value for column, value in zip(cursor.description, row)} for row in cursor.fetchall()]
+
+    def retrieve_page_snapshot(self, snapshot_id):
+        cursor = self.conn.execute('''SELECT * FROM page_snapshots WHERE id = ?''', (int(snapshot_id),))
+        row = cursor.fetchone()
+        return {column[0]: value for column, value in zip(cursor.description, row)} if row else None
+
+    def insert_validation(self, action, element):
+        try:
+            with self.conn:
+                cursor = self.conn.execute('''INSERT INTO validations (action, element, requested) VALUES (?, ?, ?)''',
+                                           (action, json.dumps(element, default=str), int(time.time())))
+            return cursor.lastrowid
+        except sqlite3.Error as e:
+            print(f"Error inserting validation: {e}")
+            return None
+
+    def update_validation(self, validation_id, status, price=None, element_id=None, error=None):
+        try:
+            with self.conn:
+                self.conn.execute('''UPDATE validations SET status = ?, finished = ?, price = ?, 
+                                                            tracked_elements_id = ?, error = ? 
+                                     WHERE id = ?''',
+                                  (status, int(time.time()), price, _optional_int(element_id), error, validation_id))
+            return True
+        except sqlite3.Error as e:
+            print(f"Error updating validation: {e}")
+            return False
+
+    def retrieve_validation(self, validation_id):
+        cursor = self.conn.execute('''SELECT * FROM validations WHERE id = ?''', (int(validation_id),))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        validation = {column[0]: value for column, value in zip(cursor.description, row)}
+        validation['element'] = json.loads(validation['element'])
+        return validation
+
+    def backfill_prices(self, element_id, points, window, apply=True):
+        """
+        Corrects and fills in the price history of an element with re-extracted prices, `points` is a list of
+        (timestamp, price), see page_snapshots.reextract_element. A point belongs to the stored run that covers its
+        timestamp (give or take `window` seconds):
+        - no run: the price is inserted (filled in)
+        - same price: unchanged
+        - the run starts at the point: its price is corrected
+        - the run started at an earlier crawl: skipped, the run can't be split without the other crawls
+        Points in archived weeks are skipped too. The rollups are adjusted for the changed crawls only: a filled in
+        price is added as an observation, a corrected one replaces the price of its crawl.
+        Without `apply` nothing is written, the result only reports.
+        """
+        element_id = int(element_id)
+        result = {'corrected': 0, 'filled': 0, 'unchanged': 0, 'missing': 0, 'skipped': 0, 'changes': []}
+        archived_before = int(self.get_setting('archived_before', 0))
+        week_bucket = ROLLUP_BUCKETS['week'].format(ts='?')
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            changed = False
+            for timestamp, price in points:
+                timestamp = int(timestamp)
+                if price is None:
+                    result['missing'] += 1
+                    continue
+                week = cursor.execute(f'SELECT {week_bucket}', (timestamp,)).fetchone()[0]
+                if week < archived_before:
+                    result['skipped'] += 1
+                    continue
+                run = cursor.execute('''SELECT timestamp, current_price FROM price_history 
+                                        WHERE tracked_elements_id = ? AND timestamp <= ? AND last_seen >= ? 
+                                        ORDER BY ABS(timestamp - ?) LIMIT 1''',
+                                     (element_id, timestamp + window, timestamp - window, timestamp)).fetchone()
+                if run is not None and run[1] == price:
+                    result['unchanged'] += 1
+                    continue
+                if run is None:
+                    cursor.execute('''INSERT OR REPLACE INTO price_history 
+                                      (tracked_elements_id, current_price, timestamp, last_seen) 
+                                      VALUES (?, ?, ?, ?)''', (element_id, price, timestamp, timestamp))
+                    self._update_rollups(cursor, element_id, price, timestamp)
+                    result['filled'] += 1
+                elif abs(run[0] - timestamp) <= window:
+                    cursor.execute('''UPDATE price_history SET current_price = ? 
+                                      WHERE tracked_elements_id = ? AND timestamp = ?''', (price, element_id, run[0]))
+                    self._correct_rollups(cursor, element_id, run[1], price, run[0])
+                    result['corrected'] += 1
+                else:
+                    result['skipped'] += 1
+                    continue
+                result['changes'].append((timestamp, None if run is None else run[1], price))
+                changed = True
+
+            if not changed or not apply:
+                self.conn.rollback()
+                return result
+            # the state the alert rules compare new prices with. min / max from the weekly rollups, they still cover
+            # the archived history
+            cursor.execute('''UPDATE crawl_stats SET (last_price, min_price, max_price) = 
+                                  (SELECT (SELECT current_price FROM price_history WHERE tracked_elements_id = ? 
+                                           ORDER BY timestamp DESC LIMIT 1), 
+                                          MIN(min_price), MAX(max_price) 
+                                   FROM price_rollup WHERE tracked_elements_id = ? AND resolution = 'week') 
+                              WHERE tracked_elements_id = ?''', (element_id, element_id, element_id))
+            _bump_data_version(cursor)
+            self.conn.commit()
+            return result
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"Error backfilling prices: {e}")
+            return None
+
+    def insert_alert_rule(self, element_id, kind, threshold, sink, target):
+        try:
+            with self.conn:
+                cursor = self.conn.cursor()
+                cursor.execute('''INSERT INTO alert_rules (tracked_elements_id, kind, threshold, sink, target) 
+                                  VALUES (?, ?, ?, ?, ?)''', (int(element_id), kind, threshold, sink, target))
+                _bump_data_version(cursor)
+            return cursor.lastrowid
+        except sqlite3.Error as e:
+            print(f"Error inserting alert rule: {e}")
+            return None
+
+    def delete_alert_rules(self, rule_ids):
+        try:
+            with self.conn:
+                cursor = self.conn.cursor()
+                cursor.executemany('''DELETE FROM alert_rules WHERE id = ?''',
+                                   [(int(rule_id),) for rule_id in rule_ids])
+                _bump_data_version(cursor)
+            return True
+        except sqlite3.Error as e:
+            print(f"Error deleting alert rules: {e}")
+            return False
+
+    def retrieve_alert_rules(self, element_id):
+        return pd.read_sql_query('''SELECT * FROM alert_rules WHERE tracked_elements_id = ? ORDER BY id''',
+                                 self.conn, params=(int(element_id),))
+
+    def retrieve_alert_events(self, element_id, limit=20):
+        return pd.read_sql_query('''SELECT kind, price, reference, status, 
+                                           datetime(timestamp, 'unixepoch', 'localtime') AS timestamp, error 
+                                    FROM alert_events WHERE tracked_elements_id = ? 
+                                    ORDER BY id DESC LIMIT ?''', self.conn, params=(int(element_id), limit))
+
+    def retrieve_pending_alerts(self, limit=100, now=None):
+        # pending events that are due (not waiting for a retry), with their rule and element, oldest first
+        now = int(time.time()) if now is None else now
+        cursor = self.conn.execute('''SELECT a.id, a.rule_id, a.tracked_elements_id, a.kind, a.timestamp, a.price, 
+                                             a.reference, a.avg_price, a.dedup_key, a.attempts, r.threshold, r.sink, 
+                                             r.target, e.name, e.url 
+                                      FROM alert_events a 
+                                      JOIN alert_rules r ON r.id = a.rule_id 
+                                      JOIN tracked_elements e ON e.id = a.tracked_elements_id 
+                                      WHERE a.status = 'pending' AND a.next_attempt <= ? 
+                                      ORDER BY a.id LIMIT ?''', (now, limit))
+        return [{column[0]: value for column, value in zip(cursor.description, row)} for row in cursor.fetchall()]
+
+    def is_alert_delivered_since(self, dedup_key, since):
+        return self.conn.execute('''SELECT 1 FROM alert_events 
+                                    WHERE dedup_key = ? AND status = 'delivered' AND delivered >= ? LIMIT 1''',
+                                 (dedup_key, since)).fetchone() is not None
+
+    def update_alert_status(self, event_id, status, error=None, attempts=None, next_attempt=None):
+        # delivery bookkeeping, doesn't bump the data version
+        try:
+            with self.conn:
+                self.conn.execute('''UPDATE alert_events SET status = ?, error = ?, attempts = COALESCE(?, attempts), 
+                                                             next_attempt = COALESCE(?, next_attempt), 
+                                                             delivered = CASE WHEN ? = 'delivered' 
+                                                                              THEN ? ELSE delivered END 
+                                     WHERE id = ?''',
+                                  (status, error, attempts, next_attempt, status, int(time.time()), event_id))
+            return True
+        except sqlite3.Error as e:
+            print(f"Error updating alert: {e}")
+            return False
+
+    def postpone_alerts(self, event_ids, next_attempt):
+        # e.g. over the rate limit of their sink, the attempts aren't counted
+        try:
+            with self.conn:
+                self.conn.executemany('''UPDATE alert_events SET next_attempt = ? WHERE id = ?''',
+                                      [(int(next_attempt), event_id) for event_id in event_ids])
+            return True
+        except sqlite3.Error as e:
+            print(f"Error postponing alerts: {e}")
+            return False
+
+    def get_data_version(self):
+        return self.conn.execute('''SELECT version FROM data_version WHERE id = 1''').fetchone()[0]
+
+    def get_setting(self, key, default=None):
+        row = self.conn.execute('''SELECT value FROM settings WHERE key = ?''', (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def set_setting(self, key, value):
+        with self.conn:
+            self.conn.execute('''INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)''', (key, value))
+
+    def set_history_mode(self, history_mode, compact=False):
+        self.set_setting('history_mode', history_mode)
+        if history_mode == HISTORY_MODE_CHANGES and compact:
+            self.compact_price_history()
+
+    def compact_price_history(self):
+        # merges consecutive rows with the same price of an element into one run
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute('BEGIN')
+            cursor.execute('''CREATE TEMP TABLE price_runs AS 
+                              SELECT tracked_elements_id, current_price, 
+                                     MIN(timestamp) AS timestamp, MAX(last_seen) AS last_seen 
+                              FROM (SELECT *, SUM(changed) OVER (PARTITION BY tracked_elements_id ORDER BY timestamp 
+                                                                 ROWS UNBOUNDED PRECEDING) AS run 
+                                    FROM (SELECT tracked_elements_id, current_price, timestamp, last_seen, 
+                                                 current_price IS NOT LAG(current_price) OVER (
+                                                     PARTITION BY tracked_elements_id ORDER BY timestamp) AS changed 
+                                          FROM price_history)) 
+                              GROUP BY tracked_elements_id, run''')
+            cursor.execute('''DELETE FROM price_history''')
+            cursor.execute('''INSERT INTO price_history (tracked_elements_id, current_price, timestamp, last_seen) 
+                              SELECT tracked_elements_id, current_price, timestamp, last_seen FROM price_runs''')
+            runs = cursor.rowcount
+            cursor.execute('''DROP TABLE price_runs''')
+            _bump_data_version(cursor)
+            self.conn.commit()
+            print(f"Compacted price history to {runs} runs")
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            print(f"Error compacting price history: {e}")
+
+    def retrieve_tracked_elements(self, with_stats=False):
+        # with_stats adds the crawl statistics the scheduler needs for adaptive intervals
         try:
             cursor = self.conn.cursor()
-            cursor.execute('''SELECT * FROM tracked_elements''')
+            if with_stats:
+                cursor.execute('''SELECT e.*, s.first_timestamp, s.last_change, s.change_gap, s.observations 
+                                  FROM tracked_elements e 
+                                  LEFT JOIN crawl_stats s ON s.tracked_elements_id = e.id''')
+            else:
+                cursor.execute('''SELECT * FROM tracked_elements''')
             rows = cursor.fetchall()
             if rows:
-                df = pd.DataFrame(rows, columns=['id', 'name', 'url', 'xpath', 'update_interval',
-                                                 'is_active', 'regex'])
+                df = pd.DataFrame(rows, columns=[column[0] for column in cursor.description])
                 return df
             else:
                 return pd.DataFrame()  # return empty DataFrame if no data found
@@ -92,21 +1288,78 @@ class DbHandler:
             print(f"Error retrieving tracked elements: {e}")
             return pd.DataFrame()  # return empty DataFrame in case of error
 
+    def search_tracked_elements(self, search=None, host=None, is_active=None, status=None, sort='name',
+                                descending=False, limit=ELEMENT_PAGE_SIZE, offset=0):
+        """
+        One page of the element list and the number of matching elements. `search` matches parts of the name or url
+        (every word has to match), `status` is one of CRAWL_STATUSES, `sort` one of ELEMENT_SORTS. Only the page is
+        read. The count is answered from the indexes, except for `status`, which is evaluated per element (joined
+        with crawl_stats and host_health).
+        """
+        conditions, params = [], []
+        words = (search or '').split()
+        # words with 3+ characters are looked up in the trigram index, shorter ones can only be scanned for (all of
+        # them if the database has no index, see _element_search)
+        fts_words = [word for word in words if len(word) >= 3] if self._has_element_index() else []
+        if fts_words:
+            conditions.append('''e.id IN (SELECT rowid FROM tracked_elements_fts WHERE tracked_elements_fts MATCH ?)''')
+            params.append(' '.join('"{}"'.format(word.replace('"', '""')) for word in fts_words))
+        for word in words:
+            if word not in fts_words:
+                conditions.append('''(e.name LIKE ? ESCAPE '\\' OR e.url LIKE ? ESCAPE '\\')''')
+                pattern = '%{}%'.format(word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_'))
+                params += [pattern, pattern]
+        if host:
+            conditions.append('''e.host = ?''')
+            params.append(host)
+        if is_active is not None:
+            conditions.append('''e.is_active = ?''')
+            params.append(bool(is_active))
+        if status:
+            conditions.append(f'''{CRAWL_STATUS_EXPRESSION} = ?''')
+            params.append(status)
+        where = ' AND '.join(conditions) or '1'
+        joins = '''LEFT JOIN crawl_stats s ON s.tracked_elements_id = e.id 
+                   LEFT JOIN host_health h ON h.host = e.host'''
+        direction = 'DESC' if descending else 'ASC'
+        try:
+            total = self.conn.execute(f'''SELECT COUNT(*) FROM tracked_elements e {joins if status else ''} 
+                                          WHERE {where}''', params).fetchone()[0]
+            df = pd.read_sql_query(f'''SELECT e.*, s.last_timestamp AS last_crawl, s.last_price, 
+                                              {CRAWL_STATUS_EXPRESSION} AS status 
+                                       FROM tracked_elements e {joins} 
+                                       WHERE {where} 
+                                       ORDER BY {ELEMENT_SORTS[sort]} {direction}, e.id {direction} 
+                                       LIMIT ? OFFSET ?''', self.conn, params=params + [int(limit), int(offset)])
+            return df, total
+        except sqlite3.Error as e:
+            print(f"Error searching tracked elements: {e}")
+            return pd.DataFrame(), 0
+
+    def _has_element_index(self):
+        # the search index is only created by sqlite versions with the trigram tokenizer
+        if self._element_index is None:
+            self._element_index = FTS_TRIGRAM and self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'tracked_elements_fts'").fetchone() is not None
+        return self._element_index
+
+    def retrieve_element_hosts(self):
+        # distinct hosts of the elements, read from the index on host
+        return [row[0] for row in self.conn.execute('''SELECT DISTINCT host FROM tracked_elements 
+                                                       WHERE host IS NOT NULL ORDER BY host''')]
+
+    def is_name_taken(self, name, element_id=None):
+        # names are unique (index on name), element_id is the element that is being edited
+        return self.conn.execute('''SELECT 1 FROM tracked_elements WHERE name = ? AND id IS NOT ?''',
+                                 (name, _optional_int(element_id))).fetchone() is not None
+
     def retrieve_tracked_element_by_id(self, element_id):
         try:
             cursor = self.conn.cursor()
             cursor.execute('''SELECT * FROM tracked_elements WHERE id = ?''', (element_id,))
             row = cursor.fetchone()
             if row:
-                tracked_element = {
-                    'id': row[0],
-                    'name': row[1],
-                    'url': row[2],
-                    'xpath': row[3],
-                    'update_interval': row[4],
-                    'is_active': row[5],
-                    'regex': row[6]
-                }
+                tracked_element = {column[0]: value for column, value in zip(cursor.description, row)}
                 return tracked_element
             else:
                 return {}  # return empty dictionary if no data found
@@ -114,16 +1367,45 @@ class DbHandler:
             print(f"Error retrieving tracked element: {e}")
             return {}  # return empty dictionary in case of an error
 
-    def retrieve_price_history(self, element_ids):
+    def retrieve_price_history(self, element_ids, start=None, end=None, expand=False):
+        """
+        Returns one row per stored run of an element's price. `price_changed` marks rows whose price differs from
+        the previous one. With `expand`, a run that was confirmed later is expanded into two points (first and last
+        seen), so the result can be plotted as a series.
+        start / end (inclusive) can be datetimes, strings or epoch seconds.
+        """
         try:
             cursor = self.conn.cursor()
+            query = '''SELECT id, tracked_elements_id, current_price, 
+                              datetime(timestamp, 'unixepoch', 'localtime') AS timestamp, 
+                              datetime(last_seen, 'unixepoch', 'localtime') AS last_seen, 
+                              current_price IS NOT LAG(current_price) OVER (
+                                  PARTITION BY tracked_elements_id ORDER BY timestamp) AS price_changed 
+                       FROM price_history WHERE tracked_elements_id IN ({})'''.format(','.join(['?'] * len(element_ids)))
+            params = [int(element_id) for element_id in element_ids]
+            if start is not None:
+                # runs that started earlier but were still confirmed in the range
+                query += ''' AND last_seen >= ?'''
+                params.append(to_epoch(start))
+            if end is not None:
+                query += ''' AND timestamp <= ?'''
+                params.append(to_epoch(end))
+            query += ''' ORDER BY tracked_elements_id, timestamp'''
+
             # use the IN clause to fetch data for all specified element_ids
-            cursor.execute('''SELECT * FROM price_history WHERE tracked_elements_id IN ({})'''.format(
-                ','.join(['?'] * len(element_ids))), element_ids)
+            cursor.execute(query, params)
             rows = cursor.fetchall()
-            if rows:
-                df = pd.DataFrame(rows, columns=['id', 'tracked_elements_id', 'current_price', 'timestamp'])
+            archived = self._retrieve_archived_history(element_ids, start, end)
+            if rows or not archived.empty:
+                df = pd.DataFrame(rows, columns=['id', 'tracked_elements_id', 'current_price', 'timestamp',
+                                                 'last_seen', 'price_changed'])
                 df['timestamp'] = pd.to_datetime(df['timestamp'])
+                df['last_seen'] = pd.to_datetime(df['last_seen'])
+                df['price_changed'] = df['price_changed'].astype(bool)
+                if not archived.empty:
+                    df = self._merge_archived_history(archived, df)
+                if expand:
+                    df = self._expand_runs(df)
                 return df
             else:
                 return pd.DataFrame()  # return empty DataFrame if no data found
@@ -131,6 +1413,227 @@ class DbHandler:
             print(f"Error retrieving data: {e}")
             return pd.DataFrame()  # return empty DataFrame in case of an error
 
+    def _retrieve_archived_history(self, element_ids, start=None, end=None):
+        # only read if the range reaches before the archived boundary, all archived runs were last seen before it
+        archived_before = self.get_setting('archived_before')
+        start = None if start is None else to_epoch(start)
+        if archived_before is None or (start is not None and start >= int(archived_before)):
+            return pd.DataFrame()
+        return price_archive.read_archive(self.archive_dir, element_ids, start,
+                                          None if end is None else to_epoch(end))
+
+    @staticmethod
+    def _merge_archived_history(archived, df):
+        archived = archived.copy()
+        archived['timestamp'] = price_archive.to_local_datetime(archived['timestamp'])
+        archived['last_seen'] = price_archive.to_local_datetime(archived['last_seen'])
+        # a run that was archived and extended afterwards is still in the hot table, that version wins
+        if not df.empty:
+            archived = pd.concat([archived, df.drop(columns='price_changed')], ignore_index=True)
+        df = archived.astype({'id': 'int64', 'tracked_elements_id': 'int64'})
+        df = df.drop_duplicates(['tracked_elements_id', 'timestamp'], keep='last')
+        df = df.sort_values(['tracked_elements_id', 'timestamp'], ignore_index=True)
+        df['price_changed'] = df['current_price'] != df.groupby('tracked_elements_id')['current_price'].shift()
+        return df
+
+    def archive_price_history(self, older_than_days=price_archive.DEFAULT_RETENTION_DAYS, vacuum=True):
+        """
+        Moves the runs last seen more than `older_than_days` ago into the price archive, element by element, and
+        reclaims the space in the database. The first run switches the database to incremental auto vacuum, which
+        needs a full VACUUM once.
+        """
+        price_archive._require_pyarrow()
+        cutoff = int(time.time() - older_than_days * 24 * 3600)
+        size_before = os.path.getsize(self.db_path)
+        # readers include the archive from now on, rows that are in both are read once
+        archived_before = max(int(self.get_setting('archived_before', 0)), cutoff)
+        self.set_setting('archived_before', archived_before)
+
+        result = {'rows': 0, 'elements': 0, 'files': 0}
+        element_ids = [row[0] for row in
+                       self.conn.execute('''SELECT DISTINCT tracked_elements_id FROM price_history''')]
+        for element_id in element_ids:
+            # uses the index on (tracked_elements_id, timestamp)
+            condition = '''tracked_elements_id = ? AND timestamp < ? AND last_seen < ?'''
+            df = pd.read_sql_query(f'''SELECT id, tracked_elements_id, current_price, timestamp, last_seen 
+                                       FROM price_history WHERE {condition}''',
+                                   self.conn, params=(element_id, cutoff, cutoff))
+            if df.empty:
+                continue
+            months = df['timestamp'].map(price_archive.month_of)
+            for month, rows in df.groupby(months):
+                price_archive.write_partition(self.archive_dir, element_id, month, rows)
+                result['files'] += 1
+
+            # rows extended in the meantime no longer match and stay
+            with self.conn:
+                cursor = self.conn.execute(f'''DELETE FROM price_history WHERE {condition}''',
+                                           (element_id, cutoff, cutoff))
+            result['rows'] += cursor.rowcount
+            result['elements'] += 1
+            print(f"Archived {cursor.rowcount} prices of element {element_id}")
+
+        if vacuum:
+            if self.conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                self.conn.execute('VACUUM')
+            else:
+                # frees a page per step, executescript runs it to its end
+                self.conn.executescript('PRAGMA incremental_vacuum;')
+        self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        result['size_before'] = size_before
+        result['size_after'] = os.path.getsize(self.db_path)
+        return result
+
+    def iter_price_history(self, element_ids=None, start=None, end=None, chunk_size=50_000):
+        """
+        Yields the stored runs as DataFrames of at most `chunk_size` rows (tracked_elements_id, current_price,
+        timestamp, last_seen as epoch seconds), ordered by element and time. Only one chunk is in memory at a time and
+        all chunks are read from the same snapshot of the database. Archived runs are merged in like in
+        retrieve_price_history, one element at a time. start / end like in retrieve_price_history, all elements if
+        element_ids is None.
+        """
+        query = '''SELECT tracked_elements_id, current_price, timestamp, last_seen FROM price_history WHERE 1'''
+        params = []
+        if element_ids is not None:
+            query += ''' AND tracked_elements_id IN ({})'''.format(','.join(['?'] * len(element_ids)))
+            params += [int(element_id) for element_id in element_ids]
+        if start is not None:
+            query += ''' AND last_seen >= ?'''
+            params.append(to_epoch(start))
+        if end is not None:
+            query += ''' AND timestamp <= ?'''
+            params.append(to_epoch(end))
+        query += ''' ORDER BY tracked_elements_id, timestamp'''
+        archived_ids = collections.deque(self._archived_element_ids(element_ids, start))
+
+        # a separate cursor, so other reads on this connection don't interfere
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            rows = []
+            for row in self._merge_archived_rows(self._fetch_rows(cursor, chunk_size), archived_ids, start, end):
+                rows.append(row)
+                if len(rows) == chunk_size:
+                    yield pd.DataFrame(rows, columns=columns)
+                    rows = []
+            if rows:
+                yield pd.DataFrame(rows, columns=columns)
+        finally:
+            cursor.close()
+
+    @staticmethod
+    def _fetch_rows(cursor, chunk_size):
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield from rows
+
+    def _archived_element_ids(self, element_ids, start=None):
+        # elements with an archive directory, sorted like the export. none if the range ends at the archived boundary
+        archived_before = self.get_setting('archived_before')
+        if archived_before is None or (start is not None and to_epoch(start) >= int(archived_before)):
+            return []
+        if element_ids is None:
+            if not os.path.isdir(self.archive_dir):
+                return []
+            element_ids = [name[len('element='):] for name in os.listdir(self.archive_dir)
+                           if name.startswith('element=')]
+        return sorted(int(element_id) for element_id in set(element_ids)
+                      if os.path.isdir(price_archive.element_dir(self.archive_dir, element_id)))
+
+    def _merge_archived_rows(self, rows, archived_ids, start=None, end=None):
+        # rows of the table ordered by element, the archived runs of each element are read when it comes up
+        for element_id, hot_rows in itertools.groupby(rows, key=lambda row: row[0]):
+            # elements whose whole range is archived come before the next element of the table
+            while archived_ids and archived_ids[0] < element_id:
+                yield from self._archived_rows(archived_ids.popleft(), start, end)
+            archived = []
+            if archived_ids and archived_ids[0] == element_id:
+                archived = self._archived_rows(archived_ids.popleft(), start, end)
+            yield from self._merge_runs(archived, hot_rows)
+        while archived_ids:
+            yield from self._archived_rows(archived_ids.popleft(), start, end)
+
+    def _archived_rows(self, element_id, start=None, end=None):
+        start = None if start is None else to_epoch(start)
+        end = None if end is None else to_epoch(end)
+        archived = price_archive.read_archive(self.archive_dir, [element_id], start, end).sort_values('timestamp')
+        return [(int(row.tracked_elements_id), row.current_price, int(row.timestamp), int(row.last_seen))
+                for row in archived.itertuples(index=False)]
+
+    @staticmethod
+    def _merge_runs(archived, hot_rows):
+        # both in time order. a run that was archived and extended afterwards is still in the hot table, that version
+        # wins, like in _merge_archived_history
+        archived = iter(archived)
+        pending = next(archived, None)
+        for row in hot_rows:
+            while pending is not None and pending[2] <= row[2]:
+                if pending[2] < row[2]:
+                    yield pending
+                pending = next(archived, None)
+            yield row
+        while pending is not None:
+            yield pending
+            pending = next(archived, None)
+
+    @staticmethod
+    def _expand_runs(df):
+        run_ends = df[df['last_seen'] > df['timestamp']].copy()
+        run_ends['timestamp'] = run_ends['last_seen']
+        run_ends['price_changed'] = False
+        df = pd.concat([df, run_ends])
+        return df.sort_values(['tracked_elements_id', 'timestamp'], kind='stable').reset_index(drop=True)
+
+    def retrieve_price_rollup(self, element_ids, resolution, start=None, end=None):
+        # min / max / last / avg price per element and hour, day or week. start / end like in retrieve_price_history
+        try:
+            cursor = self.conn.cursor()
+            query = '''SELECT tracked_elements_id, datetime(bucket, 'unixepoch', 'localtime') AS timestamp, 
+                              min_price, max_price, last_price, sum_price / count AS avg_price, count 
+                       FROM price_rollup 
+                       WHERE resolution = ? AND tracked_elements_id IN ({})'''.format(','.join(['?'] * len(element_ids)))
+            params = [resolution] + [int(element_id) for element_id in element_ids]
+            if start is not None:
+                # the bucket that contains start is included
+                query += ''' AND last_timestamp >= ?'''
+                params.append(to_epoch(start))
+            if end is not None:
+                query += ''' AND bucket <= ?'''
+                params.append(to_epoch(end))
+            query += ''' ORDER BY tracked_elements_id, bucket'''
+
+            cursor.execute(query, params)
+            rows = cursor.fetchall()
+            if rows:
+                df = pd.DataFrame(rows, columns=['tracked_elements_id', 'timestamp', 'min_price', 'max_price',
+                                                 'last_price', 'avg_price', 'count'])
+                df['timestamp'] = pd.to_datetime(df['timestamp'])
+                return df
+            else:
+                return pd.DataFrame()  # return empty DataFrame if no data found
+        except sqlite3.Error as e:
+            print(f"Error retrieving rollup: {e}")
+            return pd.DataFrame()  # return empty DataFrame in case of an error
+
+    def retrieve_history_range(self, element_ids):
+        # first and last timestamp of the elements' history, read from the (small) weekly rollup
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''SELECT MIN(bucket), MAX(last_timestamp) FROM price_rollup 
+                              WHERE resolution = 'week' AND tracked_elements_id IN ({})'''.format(
+                ','.join(['?'] * len(element_ids))), [int(element_id) for element_id in element_ids])
+            first, last = cursor.fetchone()
+            if first is None:
+                return None, None
+            return datetime.fromtimestamp(first), datetime.fromtimestamp(last)
+        except sqlite3.Error as e:
+            print(f"Error retrieving history range: {e}")
+            return None, None
+
     def delete_tracked_element_by_id(self, ids_to_delete):
         cursor = self.conn.cursor()
         try:
@@ -138,13 +1641,22 @@ class DbHandler:
                 # delete price history associated with the element
                 cursor.execute('''DELETE FROM price_history WHERE tracked_elements_id = ?''', (id_to_delete,))
                 print(f"Deleted {cursor.rowcount} price history records.")
+                cursor.execute('''DELETE FROM price_rollup WHERE tracked_elements_id = ?''', (id_to_delete,))
+                cursor.execute('''DELETE FROM crawl_stats WHERE tracked_elements_id = ?''', (id_to_delete,))
+                cursor.execute('''DELETE FROM fetch_state WHERE tracked_elements_id = ?''', (id_to_delete,))
+                cursor.execute('''DELETE FROM crawl_jobs WHERE tracked_elements_id = ?''', (id_to_delete,))
+                cursor.execute('''DELETE FROM alert_events WHERE tracked_elements_id = ?''', (id_to_delete,))
+                cursor.execute('''DELETE FROM alert_rules WHERE tracked_elements_id = ?''', (id_to_delete,))
 
                 # delete the element
                 cursor.execute('''DELETE FROM tracked_elements WHERE id = ?''', (id_to_delete,))
                 if cursor.rowcount == 0:
                     print("No tracked element found with the given ID.")
 
+            _bump_data_version(cursor)
             self.conn.commit()
+            for id_to_delete in ids_to_delete:
+                price_archive.delete_element_archive(self.archive_dir, id_to_delete)
             return True
 
         except sqlite3.Error as e:
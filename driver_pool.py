@@ -0,0 +1,205 @@
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common import WebDriverException
+
+from crawl_metrics import STAGE_DRIVER, metrics
+from crawl_options import BROWSER_PROFILE_LEAN, BROWSER_PROFILES, DEFAULT_BROWSER_PROFILE
+
+# Pretend being a Human browsing the web
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/121.0.0.0 Safari/537.3"
+
+DEFAULT_POOL_SIZE = 2
+DEFAULT_MAX_PAGES_PER_SESSION = 50
+
+PAGE_LOAD_TIMEOUT = 20  # seconds
+ELEMENT_WAIT_TIMEOUT = 10  # seconds, for all selectors of a page together
+
+LEAN_PREFERENCES = {
+    'permissions.default.image': 2,  # block images
+    'browser.display.use_document_fonts': 0,
+    'gfx.downloadable_fonts.enabled': False,
+    'media.autoplay.default': 5,  # block audio and video
+    'media.preload.default': 0,
+    'media.preload.auto': 0,
+    'privacy.trackingprotection.enabled': True,
+    'network.prefetch-next': False,
+    'network.dns.disablePrefetch': True,
+}
+
+
+def create_driver(profile=DEFAULT_BROWSER_PROFILE):
+    firefox_options = webdriver.FirefoxOptions()
+    firefox_options.add_argument('--headless')
+    firefox_options.add_argument(f'user-agent={USER_AGENT}')
+    firefox_options.add_argument('--disable-gpu')
+    if profile == BROWSER_PROFILE_LEAN:
+        for name, value in LEAN_PREFERENCES.items():
+            firefox_options.set_preference(name, value)
+        firefox_options.page_load_strategy = 'eager'
+
+    driver = webdriver.Firefox(options=firefox_options)
+    driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+    return driver
+
+
+class DriverSession:
+
+    def __init__(self, driver, profile):
+        self.driver = driver
+        self.profile = profile
+        self.pages = 0
+
+
+class DriverPool:
+    """
+    Bounded pool of warm headless Firefox sessions.
+
+    At most `size` browsers exist at the same time. A session is checked out per task, its state is reset when it
+    is handed back, and it is replaced after `max_pages` page loads or as soon as it crashed.
+    Sessions are launched with a browser profile (see BROWSER_PROFILES) and only reused for the same profile.
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE, max_pages=DEFAULT_MAX_PAGES_PER_SESSION, driver_factory=create_driver):
+        self.size = size
+        self.max_pages = max_pages
+        self.driver_factory = driver_factory
+
+        # per profile, most recently used session first, it is the warmest one
+        self._idle = {profile: queue.LifoQueue() for profile in BROWSER_PROFILES}
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stats = {'hits': 0, 'misses': 0, 'launches': 0, 'recycles': 0, 'crashes': 0, 'quits': 0,
+                       'pages': 0, 'bytes': 0, 'load_ms': 0.0}
+
+    @contextmanager
+    def driver(self, profile=DEFAULT_BROWSER_PROFILE, host=''):
+        # the wait for a free slot and the checkout are reported as the 'driver' stage of `host`
+        start = time.perf_counter()
+        self._slots.acquire()
+        session = None
+        crashed = False
+        try:
+            try:
+                session = self._checkout(profile)
+            except Exception:
+                metrics.record_stage(STAGE_DRIVER, time.perf_counter() - start, 'error', host, 'browser')
+                raise
+            metrics.record_stage(STAGE_DRIVER, time.perf_counter() - start, 'reused' if session.pages else 'launched',
+                                 host, 'browser')
+            session.pages += 1
+            yield session.driver
+        except WebDriverException:
+            crashed = True
+            raise
+        finally:
+            try:
+                if session is not None:
+                    self._checkin(session, crashed)
+            finally:
+                self._slots.release()
+
+    def record_page(self, transferred_bytes, load_ms, profile=DEFAULT_BROWSER_PROFILE):
+        metrics.inc('crawl_browser_transferred_bytes_total', "Bytes transferred by browser page loads",
+                    transferred_bytes, profile=profile)
+        with self._lock:
+            self._stats['pages'] += 1
+            self._stats['bytes'] += transferred_bytes
+            self._stats['load_ms'] += load_ms
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['idle'] = sum(idle.qsize() for idle in self._idle.values())
+        stats['alive'] = stats['launches'] - stats['quits']
+        stats['avg_load_ms'] = stats.pop('load_ms') / stats['pages'] if stats['pages'] else 0.0
+        return stats
+
+    def close(self):
+        self._closed = True
+        for idle in self._idle.values():
+            while True:
+                try:
+                    session = idle.get_nowait()
+                except queue.Empty:
+                    break
+                self._quit(session)
+
+    def _checkout(self, profile):
+        try:
+            session = self._idle[profile].get_nowait()
+            self._count('hits')
+            return session
+        except queue.Empty:
+            self._count('misses')
+
+        # an idle browser of another profile is replaced, so there are never more than `size` browsers
+        for other_profile, idle in self._idle.items():
+            if other_profile != profile and self._alive() >= self.size:
+                try:
+                    session = idle.get_nowait()
+                except queue.Empty:
+                    continue
+                self._count('recycles')
+                self._quit(session)
+
+        driver = self.driver_factory(profile)
+        self._count('launches')
+        return DriverSession(driver, profile)
+
+    def _checkin(self, session, crashed):
+        if crashed:
+            self._count('crashes')
+            self._quit(session)
+            return
+
+        if self._closed or session.pages >= self.max_pages:
+            self._count('recycles')
+            self._quit(session)
+            return
+
+        try:
+            self._reset(session.driver)
+        except WebDriverException:
+            # the browser died while cleaning up, a fresh one will be launched on the next checkout
+            self._count('crashes')
+            self._quit(session)
+            return
+
+        self._idle[session.profile].put(session)
+
+    @staticmethod
+    def _reset(driver):
+        # close popups / additional tabs opened by the page
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+
+        # storage and cookies can only be cleared for the origin that is currently loaded
+        try:
+            driver.execute_script("window.localStorage.clear(); window.sessionStorage.clear();")
+        except WebDriverException:
+            pass
+        driver.delete_all_cookies()
+        driver.get('about:blank')
+
+    def _quit(self, session):
+        try:
+            session.driver.quit()
+        except Exception:
+            pass
+        self._count('quits')
+
+    def _alive(self):
+        with self._lock:
+            return self._stats['launches'] - self._stats['quits']
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
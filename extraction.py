@@ -0,0 +1,83 @@
+import re
+
+from lxml import etree
+from lxml.cssselect import CSSSelector
+
+# selector lookup and price extraction on parsed documents, without the crawler or selenium, so the same rules are
+# used by the crawler, for the page snapshots and in the dashboard
+
+
+def find_node_in_document(document, selector):
+    # same order as in the browser: XPATH first, CSS selector as fallback. returns the first node and the selector
+    # type that matched ('xpath', 'css' or 'not_found').
+    # a CSS selector can be a valid XPATH expression too (e.g. 'div.price > span' is a comparison), so only node
+    # lists count as a match
+    result = None
+    try:
+        result = document.xpath(selector)
+    except etree.XPathError:
+        pass
+    if isinstance(result, list) and result:
+        return result[0], 'xpath'
+
+    try:
+        result = CSSSelector(selector)(document)
+    except Exception:
+        return None, 'not_found'
+    if not result:
+        return None, 'not_found'
+    return result[0], 'css'
+
+
+def node_text(node):
+    if isinstance(node, etree._Element):
+        return node.text_content()
+    # xpath can also select text() nodes or attributes
+    return str(node)
+
+
+# Function to extract text content of an element
+def extract_price(text, pattern):
+    match = re.search(pattern, text)
+    if match:
+        number_str = match.group()
+
+        # number_str somehow gets treated as bytes
+        if isinstance(number_str, bytes):
+            number_str = number_str.decode('utf-8')
+
+        # replace all separators with .
+        number_str = number_str.replace(',', '.')
+
+        # find indices of separators
+        separators = [m.start() for m in re.finditer(r'[.]', number_str)]
+
+        # delete all separators except last one
+        if len(separators) > 1:
+            for i in separators[:-1]:
+                number_str = number_str[:i] + '' + number_str[i + 1:]
+        return number_str
+    return None
+
+
+def evaluate_document(document, selector, regex):
+    """
+    Evaluates an element against a parsed page like a crawl does. Returns a dict with the text of the element (None
+    if the selector didn't match), the selector type that matched, the price (None if the regex didn't match) and
+    the error of an invalid regex.
+    """
+    node, selector_type = find_node_in_document(document, selector)
+    result = {'text': None, 'selector_type': selector_type, 'price': None, 'error': None}
+    if node is None:
+        return result
+    result['text'] = node_text(node)
+    try:
+        price_str = extract_price(result['text'], regex)
+    except re.error as e:
+        result['error'] = f"invalid regex: {e}"
+        return result
+    try:
+        result['price'] = float(price_str) if price_str else None
+    except ValueError:
+        result['error'] = f"not a number: {price_str}"
+    return result
@@ -0,0 +1,311 @@
+import hashlib
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from lxml import etree
+from lxml import html as lxml_html
+from requests.adapters import HTTPAdapter
+from selenium.common import InvalidSelectorException, NoSuchElementException, TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+
+from crawl_executor import host_of
+from crawl_metrics import STAGE_LOOKUP, STAGE_NAVIGATION, metrics
+from crawl_options import DEFAULT_BROWSER_PROFILE, FETCH_MODE_AUTO, FETCH_MODE_BROWSER, FETCH_MODE_HTTP
+from driver_pool import ELEMENT_WAIT_TIMEOUT, PAGE_LOAD_TIMEOUT, USER_AGENT
+from extraction import find_node_in_document, node_text
+from host_health import FAILURE_TIMEOUT, classify_exception
+
+HTTP_TIMEOUT = 10  # seconds
+HTTP_POOL_MAXSIZE = 10  # kept-alive connections per host
+
+# failures of a page load that fail the fetch mode, see fetch_steps
+FETCH_ERRORS = (requests.RequestException, WebDriverException)
+
+TRANSFER_SIZE_SCRIPT = """
+    return performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'))
+        .reduce((total, entry) => total + (entry.transferSize || 0), 0);
+"""
+
+HTTP_HEADERS = {
+    'User-Agent': USER_AGENT,
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'de-AT,de;q=0.9,en;q=0.8',
+}
+
+# requests.Session is not guaranteed to be thread-safe, so every crawler thread keeps its own.
+# Each session pools keep-alive connections per host.
+_thread_local = threading.local()
+
+
+def get_http_session():
+    session = getattr(_thread_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_MAXSIZE, pool_maxsize=HTTP_POOL_MAXSIZE)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(HTTP_HEADERS)
+        _thread_local.session = session
+    return session
+
+
+def fetch_http_document(url):
+    return fetch_http_page(url)[0]
+
+
+def fetch_http_page(url, validators=None):
+    """
+    Returns the parsed page and its validators (ETag, Last-Modified). With the validators of a previous response
+    the request is conditional, if the page wasn't modified since (304) the document is None.
+    """
+    headers = conditional_headers(validators)
+    with metrics.stage(STAGE_NAVIGATION, host_of(url), FETCH_MODE_HTTP) as result:
+        response = get_http_session().get(url, timeout=HTTP_TIMEOUT, headers=headers)
+        if response.status_code == 304 and headers:
+            result['outcome'] = 'not_modified'
+            return None, validators
+        response.raise_for_status()
+    charset = requests.utils.get_encoding_from_headers(response.headers) if 'charset' in \
+        response.headers.get('Content-Type', '') else None
+    return (parse_html(response.content, url, charset),
+            (response.headers.get('ETag'), response.headers.get('Last-Modified')))
+
+
+def parse_html(content, url, charset=None):
+    # the charset of the Content-Type header wins over the document's meta tag, without either lxml assumes latin-1.
+    # raises etree.ParserError if there is nothing to parse (e.g. an empty body)
+    parser = lxml_html.HTMLParser(encoding=charset) if charset else None
+    return lxml_html.fromstring(content, base_url=url, parser=parser)
+
+
+def conditional_headers(validators):
+    etag, last_modified = validators or (None, None)
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+
+def page_validators(fetch_states):
+    # the validators can only be sent if all elements of the page were confirmed by the same response before
+    validators = {(state['etag'], state['last_modified']) if state else None for state in fetch_states}
+    if len(validators) != 1:
+        return None
+    validators = validators.pop()
+    return validators if validators and any(validators) else None
+
+
+def content_hash(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def find_text_in_document(document, selector, host=''):
+    with metrics.stage(STAGE_LOOKUP, host, FETCH_MODE_HTTP) as result:
+        node, result['outcome'] = find_node_in_document(document, selector)
+    if node is None:
+        return None
+    return node_text(node)
+
+
+def fetch_http_text(url, selector):
+    return find_text_in_document(fetch_http_document(url), selector)
+
+
+def fetch_browser_text(pool, url, selector, profile=DEFAULT_BROWSER_PROFILE):
+    return fetch_browser_texts(pool, url, [selector], profile)[0]
+
+
+def fetch_browser_texts(pool, url, selectors, profile=DEFAULT_BROWSER_PROFILE, page=None):
+    # renders the page once and returns the textContent of every selector (None if not found).
+    # a page load timeout is reported as page['error'], see fetch_elements_text
+    texts = []
+    host = host_of(url)
+    with pool.driver(profile, host) as driver:
+        start = time.perf_counter()
+        with metrics.stage(STAGE_NAVIGATION, host, FETCH_MODE_BROWSER) as result:
+            try:
+                driver.get(url)
+            except TimeoutException:
+                # the DOM might already contain the element, even if the page didn't finish loading
+                print(f"Page load timed out after {PAGE_LOAD_TIMEOUT} s")
+                result['outcome'] = 'timeout'
+                if page is not None:
+                    page['error'] = (FAILURE_TIMEOUT, f"page load timed out after {PAGE_LOAD_TIMEOUT} s")
+
+        # waits for the elements to appear (e.g. rendered by javascript), at most ELEMENT_WAIT_TIMEOUT for the page
+        deadline = time.monotonic() + ELEMENT_WAIT_TIMEOUT
+        for selector in selectors:
+            html_element = wait_for_element(driver, selector, max(0.0, deadline - time.monotonic()), host)
+            if html_element is None:
+                print("no price found")
+            texts.append(html_element.get_attribute("textContent") if html_element else None)
+
+        if page is not None and page.get('snapshots') is not None:
+            page['snapshots'].append((FETCH_MODE_BROWSER, profile, driver.page_source))
+
+        load_ms = (time.perf_counter() - start) * 1000
+        transferred_bytes = page_transfer_size(driver)
+        pool.record_page(transferred_bytes, load_ms, profile)
+        print(f"Loaded page in {load_ms:.0f} ms, {transferred_bytes / 1024:.1f} kB transferred ({profile} profile)")
+    return texts
+
+
+def find_element(driver, selector):
+    # XPATH first, CSS selector as fallback. returns the element and the selector type that matched
+    for by, selector_type in ((By.XPATH, 'xpath'), (By.CSS_SELECTOR, 'css')):
+        try:
+            return driver.find_element(by, selector), selector_type
+        except (NoSuchElementException, InvalidSelectorException):
+            pass
+    return None, 'not_found'
+
+
+def wait_for_element(driver, selector, timeout, host=''):
+    # the wait is reported as the 'lookup' stage, so slow javascript rendering shows up there
+    with metrics.stage(STAGE_LOOKUP, host, FETCH_MODE_BROWSER) as result:
+        found = [None, 'not_found']
+
+        def poll(d):
+            found[:] = find_element(d, selector)
+            return found[0] or False
+
+        try:
+            WebDriverWait(driver, timeout, poll_frequency=0.2).until(poll)
+        except TimeoutException:
+            pass
+        result['outcome'] = found[1]
+        return found[0]
+
+
+def page_transfer_size(driver):
+    # bytes transferred for the document and all its resources, according to the resource timing api
+    try:
+        return int(driver.execute_script(TRANSFER_SIZE_SCRIPT) or 0)
+    except WebDriverException:
+        return 0
+
+
+def fetch_order(fetch_mode, detected_mode=None):
+    # explicitly configured modes are used as they are. in auto mode, the plain HTTP request is tried first,
+    # unless a previous run detected that the page needs the browser
+    if fetch_mode in (FETCH_MODE_HTTP, FETCH_MODE_BROWSER):
+        return [fetch_mode]
+    if detected_mode == FETCH_MODE_BROWSER:
+        return [FETCH_MODE_BROWSER, FETCH_MODE_HTTP]
+    return [FETCH_MODE_HTTP, FETCH_MODE_BROWSER]
+
+
+def fetch_element_text(pool, url, selector, fetch_mode=FETCH_MODE_AUTO, detected_mode=None, accept=None,
+                       browser_profile=DEFAULT_BROWSER_PROFILE):
+    """
+    Returns the textContent of the element and the fetch mode that found it.
+
+    In auto mode the browser is only launched if the element can't be found in the initial HTML (or
+    `accept(text, fetch mode)` rejects its text).
+    """
+    return fetch_elements_text(pool, url, [(selector, fetch_mode, detected_mode, accept, browser_profile)])[0][0]
+
+
+def fetch_elements_text(pool, url, elements, validators=None, snapshot=False):
+    """
+    Like `fetch_element_text` for several elements on the same page, `elements` is a list of
+    (selector, fetch_mode, detected_mode, accept, browser_profile). The page is loaded once per fetch mode (and
+    browser profile) and all selectors are evaluated against that document.
+
+    Returns a (text, fetch mode) tuple per element and the page info: with `validators` the HTTP request is
+    conditional, `not_modified` tells that the server answered 304 (the text of the HTTP elements is None then),
+    `validators` are the ones of the response, `error` is the classified last failure (kind, message) or None.
+    With `snapshot` the page info also has the loaded pages in `snapshots`, a (fetch mode, browser profile, parsed
+    document or HTML) tuple each, see page_snapshots.snapshot_rows.
+    """
+    def load(mode, browser_profile, selectors, page):
+        if mode == FETCH_MODE_HTTP:
+            return fetch_http_page(url, validators)
+        return fetch_browser_texts(pool, url, selectors, browser_profile, page)
+
+    steps = fetch_steps(url, elements, validators, snapshot)
+    try:
+        step = next(steps)
+        while True:
+            try:
+                loaded = load(*step)
+            except Exception as e:
+                step = steps.throw(e)
+            else:
+                step = steps.send(loaded)
+    except StopIteration as stop:
+        return stop.value
+
+
+def fetch_steps(url, elements, validators=None, snapshot=False, errors=FETCH_ERRORS):
+    """
+    The fetch loop of `fetch_elements_text` without the page loads, so the async engine runs the same loop with
+    its own HTTP client. Yields a (fetch mode, browser profile, selectors, page info) tuple for every page load it
+    needs: for FETCH_MODE_HTTP the (document, validators) of `fetch_http_page` are sent back, for
+    FETCH_MODE_BROWSER the texts of `fetch_browser_texts`. A failed load is thrown into the generator, `errors`
+    fail the fetch mode (the other modes are still tried), anything else is raised. Returns the results and the page
+    info of `fetch_elements_text`.
+    """
+    results = [(None, None)] * len(elements)
+    orders = [fetch_order(fetch_mode, detected_mode) for _, fetch_mode, detected_mode, _, _ in elements]
+    pending = set(range(len(elements)))
+    document = None  # the initial HTML, fetched at most once
+    page = {'not_modified': False, 'validators': None, 'error': None, 'fetched': time.time(),
+            'snapshots': [] if snapshot else None}
+    failed_modes = set()
+
+    for attempt in range(max(len(order) for order in orders)):
+        # the elements that still miss a price, by the fetch mode (and browser profile) they try next
+        by_mode = defaultdict(list)
+        for i in sorted(pending):
+            if attempt < len(orders[i]):
+                mode = orders[i][attempt]
+                browser_profile = elements[i][4] or DEFAULT_BROWSER_PROFILE if mode == FETCH_MODE_BROWSER else None
+                by_mode[mode, browser_profile].append(i)
+
+        for (mode, browser_profile), indexes in by_mode.items():
+            if mode in failed_modes:
+                continue
+            selectors = [elements[i][0] for i in indexes]
+            try:
+                if mode == FETCH_MODE_HTTP:
+                    if document is None and not page['not_modified']:
+                        document, page['validators'] = yield mode, None, None, page
+                        page['not_modified'] = document is None
+                        if snapshot and document is not None:
+                            page['snapshots'].append((FETCH_MODE_HTTP, None, document))
+                    if page['not_modified']:
+                        # the previous prices are still valid, nothing to parse
+                        for i in indexes:
+                            results[i] = (None, mode)
+                            pending.discard(i)
+                        continue
+                    texts = [find_text_in_document(document, selector, host_of(url)) for selector in selectors]
+                else:
+                    texts = yield mode, browser_profile, selectors, page
+            except etree.ParserError as e:
+                # e.g. an empty body: the elements aren't in the initial HTML, auto mode goes on with the browser
+                print(f"HTTP response can't be parsed: {e}")
+                failed_modes.add(mode)
+                continue
+            except errors as e:
+                # the elements of this mode are missing, the ones found by the other mode are kept
+                print(f"{'HTTP fetch' if mode == FETCH_MODE_HTTP else 'Browser'} failed: {e!r}")
+                failed_modes.add(mode)
+                page['error'] = (classify_exception(e), getattr(e, 'msg', None) or str(e))
+                continue
+
+            for i, text_content in zip(indexes, texts):
+                accept = elements[i][3]
+                if text_content is not None and (accept is None or accept(text_content, mode)):
+                    results[i] = (text_content, mode)
+                    pending.discard(i)
+                elif text_content is not None:
+                    results[i] = (text_content, None)
+
+    return results, page
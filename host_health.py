@@ -0,0 +1,280 @@
+import random
+import threading
+import time
+
+import requests
+
+from crawl_metrics import metrics
+
+# classified crawl failures. the first ones are failures of the host, the misses are failures of an element
+FAILURE_TIMEOUT = 'timeout'  # request or page load timed out
+FAILURE_BLOCKED = 'blocked'  # 401, 403, 429, 451
+FAILURE_ERROR = 'error'  # connection errors, 5xx, browser errors
+FAILURE_SELECTOR_MISS = 'selector_miss'  # page loaded, element not found
+FAILURE_REGEX_MISS = 'regex_miss'  # element found, no price in its text
+HOST_FAILURES = [FAILURE_TIMEOUT, FAILURE_BLOCKED, FAILURE_ERROR]
+TRANSIENT_FAILURES = [FAILURE_TIMEOUT, FAILURE_ERROR]  # worth a retry before the next interval
+BLOCKED_STATUS_CODES = {401, 403, 429, 451}
+
+STATE_CLOSED = 'closed'  # crawled normally
+STATE_OPEN = 'open'  # failing, no crawls until open_until
+STATE_HALF_OPEN = 'half_open'  # one probe crawl decides whether the host is closed or opened again
+
+DEFAULT_HOST_RATE = 30  # pages per minute and host
+DEFAULT_HOST_BURST = 5
+FAILURE_THRESHOLD = 5  # consecutive host failures that open the circuit
+BREAKER_COOLDOWN = 300  # seconds until the first probe, doubled with every failed probe
+BREAKER_MAX_COOLDOWN = 6 * 3600
+PROBE_TIMEOUT = 600  # seconds after which a probe that didn't report back is given up
+PROBE_RECHECK = 60  # seconds other pages of a probed host are postponed
+RETRY_BASE_DELAY = 30  # seconds, doubled with every retry
+MAX_RETRIES = 3
+
+# host_health columns of the outcomes
+COUNTER_COLUMNS = {None: 'successes', FAILURE_TIMEOUT: 'timeouts', FAILURE_BLOCKED: 'blocked',
+                   FAILURE_ERROR: 'errors', FAILURE_SELECTOR_MISS: 'selector_misses',
+                   FAILURE_REGEX_MISS: 'regex_misses'}
+
+
+def classify_exception(e):
+    # failure kind of an exception raised by a fetch
+    if isinstance(e, requests.Timeout):
+        return FAILURE_TIMEOUT
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return FAILURE_BLOCKED if e.response.status_code in BLOCKED_STATUS_CODES else FAILURE_ERROR
+    if type(e).__name__ == 'TimeoutException' or isinstance(e, TimeoutError):  # selenium / asyncio
+        return FAILURE_TIMEOUT
+    status = getattr(e, 'status', None)  # aiohttp.ClientResponseError
+    if isinstance(status, int):
+        return FAILURE_BLOCKED if status in BLOCKED_STATUS_CODES else FAILURE_ERROR
+    return FAILURE_ERROR
+
+
+def retry_delay(attempt):
+    # exponential backoff with +-20% jitter
+    delay = RETRY_BASE_DELAY * 2 ** attempt
+    return delay * random.uniform(0.8, 1.2)
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst):
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def reserve(self, now):
+        # takes a token, returns the seconds to wait for it (the balance may go negative, so waiting callers queue up)
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def take(self, now):
+        # takes a token if one is available and returns 0, otherwise the seconds until there is one (nothing is taken)
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class HostHealth:
+    """
+    Crawl state per host (shop).
+
+    - a token bucket limits the pages per minute and host, `reserve` returns how long to wait before a request,
+      `acquire` how long to postpone it
+    - every crawled page reports its outcome with `record`, host failures are classified into timeout, blocked and
+      error, element misses into selector and regex misses
+    - after `failure_threshold` consecutive host failures the circuit opens: `admit` postpones all pages of the host
+      until the cooldown is over, then one page is let through as a probe. a successful probe closes the circuit,
+      a failed one opens it again with twice the cooldown
+    - transient failures get up to MAX_RETRIES retries with exponential backoff, see `next_retry`
+
+    The state is persisted in the host_health table: `take_dirty` returns the changes since the last call for
+    DbHandler.update_host_health, `load` restores / merges the persisted state (e.g. of other crawler processes).
+    """
+
+    def __init__(self, rate_per_minute=DEFAULT_HOST_RATE, burst=DEFAULT_HOST_BURST,
+                 failure_threshold=FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self._lock = threading.Lock()
+        self._hosts = {}  # host -> state dict
+        self._buckets = {}
+        self._retries = {}  # element id -> retries since the last success
+        self._dirty = {}  # host -> counter deltas since the last take_dirty
+
+    def _host(self, host):
+        state = self._hosts.get(host)
+        if state is None:
+            state = {'state': STATE_CLOSED, 'consecutive_failures': 0, 'open_until': None, 'cooldown': self.cooldown,
+                     'probe_started': None, 'last_success': None, 'last_failure': None, 'last_failure_kind': None,
+                     'last_error': None}
+            self._hosts[host] = state
+        return state
+
+    def reserve(self, host):
+        if not self.rate_per_minute:
+            return 0.0
+        with self._lock:
+            return self._bucket(host).reserve(time.monotonic())
+
+    def acquire(self, host):
+        # like reserve, but without queueing: 0 if a page may be requested now, otherwise the seconds until the
+        # host has capacity again. the caller reschedules the page instead of waiting
+        if not self.rate_per_minute:
+            return 0.0
+        with self._lock:
+            return self._bucket(host).take(time.monotonic())
+
+    def _bucket(self, host):
+        bucket = self._buckets.get(host)
+        if bucket is None:
+            bucket = self._buckets[host] = TokenBucket(self.rate_per_minute, self.burst)
+        return bucket
+
+    def admit(self, host, now=None):
+        # None if a page of the host may be crawled now, otherwise the time (epoch) to postpone it to
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state['state'] == STATE_CLOSED:
+                return None
+            if state['state'] == STATE_OPEN:
+                if now < state['open_until']:
+                    return state['open_until']
+                # this page is the probe
+                state['state'] = STATE_HALF_OPEN
+                state['probe_started'] = now
+                self._mark(host)
+                print(f"Probing {host}")
+                return None
+            if state['probe_started'] is None or now - state['probe_started'] > PROBE_TIMEOUT:
+                state['probe_started'] = now
+                return None
+            return now + PROBE_RECHECK
+
+    def blocked_until(self, host, now=None):
+        # open_until if the circuit of the host is open, e.g. for jobs that were queued before it opened
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is not None and state['state'] == STATE_OPEN and now < state['open_until']:
+                return state['open_until']
+        return None
+
+    def record(self, host, failure=None, error=None, now=None):
+        # outcome of a page: None if it was loaded and had at least one of the elements, otherwise one of
+        # HOST_FAILURES. a loaded page without any of the elements (e.g. a captcha) counts as FAILURE_BLOCKED
+        now = time.time() if now is None else now
+        with self._lock:
+            state = self._host(host)
+            self._count(host, failure)
+            if failure is None:
+                if state['state'] != STATE_CLOSED:
+                    print(f"Circuit of {host} closed")
+                state.update({'state': STATE_CLOSED, 'consecutive_failures': 0, 'open_until': None,
+                              'cooldown': self.cooldown, 'probe_started': None, 'last_success': int(now)})
+            elif failure in HOST_FAILURES:
+                state['consecutive_failures'] += 1
+                state.update({'last_failure': int(now), 'last_failure_kind': failure, 'last_error': error})
+                if state['state'] == STATE_HALF_OPEN:
+                    state['cooldown'] = min(state['cooldown'] * 2, BREAKER_MAX_COOLDOWN)
+                    self._open(host, state, now)
+                elif state['state'] == STATE_CLOSED and state['consecutive_failures'] >= self.failure_threshold:
+                    self._open(host, state, now)
+        if failure is not None:
+            metrics.inc('crawl_host_failures_total', "Classified crawl failures per host", host=host, kind=failure)
+
+    def record_element(self, host, failure):
+        # element misses (FAILURE_SELECTOR_MISS / FAILURE_REGEX_MISS) of a page that loaded
+        with self._lock:
+            self._host(host)
+            self._count(host, failure)
+        metrics.inc('crawl_host_failures_total', "Classified crawl failures per host", host=host, kind=failure)
+
+    def next_retry(self, element_ids, failure, now=None):
+        # due time of the retry of elements whose page failed, None if the failure isn't transient or the retries
+        # are used up. reset by a success
+        now = time.time() if now is None else now
+        with self._lock:
+            if failure not in TRANSIENT_FAILURES:
+                return None
+            attempt = max(self._retries.get(element_id, 0) for element_id in element_ids)
+            if attempt >= MAX_RETRIES:
+                return None
+            for element_id in element_ids:
+                self._retries[element_id] = attempt + 1
+        return now + retry_delay(attempt)
+
+    def reset_retries(self, element_ids):
+        with self._lock:
+            for element_id in element_ids:
+                self._retries.pop(element_id, None)
+
+    def state(self, host):
+        with self._lock:
+            return self._hosts.get(host, {}).get('state', STATE_CLOSED)
+
+    def open_hosts(self):
+        with self._lock:
+            return sum(1 for state in self._hosts.values() if state['state'] != STATE_CLOSED)
+
+    def take_dirty(self):
+        # rows for DbHandler.update_host_health: the current state and the counter deltas since the last call
+        with self._lock:
+            rows = []
+            for host, counters in self._dirty.items():
+                state = self._hosts[host]
+                rows.append({'host': host, **{key: state[key] for key in (
+                    'state', 'consecutive_failures', 'open_until', 'cooldown', 'last_success', 'last_failure',
+                    'last_failure_kind', 'last_error')}, **counters})
+            self._dirty.clear()
+        return rows
+
+    def load(self, rows, now=None):
+        # persisted state, e.g. on startup or written by other crawler processes (the queue workers report the
+        # outcomes of the pages the dispatcher admitted). a circuit that is open in the database is adopted, unless
+        # this process saw a later success. a probe of this process is decided by a later success or failure
+        now = time.time() if now is None else now
+        with self._lock:
+            for row in rows:
+                state = self._host(row['host'])
+                if state['state'] == STATE_HALF_OPEN and state['probe_started'] is not None:
+                    if (row['last_success'] or 0) >= int(state['probe_started']):
+                        print(f"Circuit of {row['host']} closed")
+                        state.update({'state': STATE_CLOSED, 'consecutive_failures': 0, 'open_until': None,
+                                      'cooldown': self.cooldown, 'probe_started': None})
+                    elif (row['last_failure'] or 0) >= int(state['probe_started']):
+                        state['cooldown'] = min(state['cooldown'] * 2, BREAKER_MAX_COOLDOWN)
+                        self._open(row['host'], state, now)
+                newer_success = state['last_success'] and row['last_success'] and \
+                    state['last_success'] > row['last_success']
+                if row['state'] == STATE_OPEN and row['open_until'] and row['open_until'] > now and not newer_success \
+                        and state['state'] == STATE_CLOSED:
+                    state.update({'state': STATE_OPEN, 'open_until': row['open_until'], 'cooldown': row['cooldown'],
+                                  'consecutive_failures': row['consecutive_failures']})
+                    print(f"Circuit of {row['host']} is open until {time.ctime(row['open_until'])}")
+                for key in ('last_success', 'last_failure', 'last_failure_kind', 'last_error'):
+                    if state[key] is None:
+                        state[key] = row[key]
+
+    def _open(self, host, state, now):
+        state['state'] = STATE_OPEN
+        state['open_until'] = int(now + state['cooldown'])
+        state['probe_started'] = None
+        print(f"Circuit of {host} opened after {state['consecutive_failures']} failures "
+              f"({state['last_failure_kind']}), next probe in {state['cooldown']} s")
+
+    def _mark(self, host):
+        self._dirty.setdefault(host, {column: 0 for column in COUNTER_COLUMNS.values()})
+
+    def _count(self, host, failure):
+        self._mark(host)
+        self._dirty[host][COUNTER_COLUMNS[failure]] += 1
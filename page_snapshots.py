@@ -0,0 +1,193 @@
+"""
+Compressed snapshots of crawled pages.
+
+    python page_snapshots.py reextract [--elements 1 2] [--selector S] [--regex R] [--since-days 30] [--apply]
+
+The crawler stores the DOM of a page (the initial HTML and / or the DOM rendered by the browser) zlib compressed in
+the page_snapshots table: for every background validation of the form, and for scheduled crawls whenever the content
+of an element changed or an element had no price. The form tests selector and regex changes against the latest
+snapshots of the page in milliseconds instead of fetching it again.
+
+`reextract` re-runs the selector and regex of elements (their saved ones, or the given ones) over all stored
+snapshots of their pages and corrects or fills in their price_history: prices that differ from the stored price of
+the same crawl are corrected, crawls without a stored price are filled in. Without --apply it only reports.
+"""
+import argparse
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from lxml import etree
+from lxml import html as lxml_html
+
+from crawl_executor import normalize_url
+from crawl_options import FETCH_MODE_BROWSER, FETCH_MODE_HTTP
+from extraction import evaluate_document
+
+SNAPSHOT_COMPRESSION_LEVEL = 6
+SNAPSHOTS_PER_PAGE = 50  # older snapshots of a page are deleted
+SNAPSHOT_MAX_AGE_DAYS = 90
+PRICE_MATCH_WINDOW = 60  # seconds between a snapshot and the price of the same crawl
+DOCUMENT_CACHE_SIZE = 16  # parsed snapshots kept in memory
+
+# background validations of the form, see crawly.run_validation
+VALIDATION_SNAPSHOT = 'snapshot'  # only fetches the page
+VALIDATION_SAVE = 'save'  # saves the element if a price was found
+VALIDATION_PENDING = 'pending'
+VALIDATION_DONE = 'done'
+VALIDATION_FAILED = 'failed'
+
+# scheduled crawls store the page when the content of an element changed or it had no price (crawly --no-snapshots
+# turns it off), validations of the form always store it
+snapshot_scheduled_crawls = True
+
+_documents = OrderedDict()  # snapshot id -> parsed document
+_documents_lock = threading.Lock()  # also held while a document is evaluated, lxml documents aren't shared safely
+
+
+def compress_page(html):
+    return zlib.compress(html.encode('utf-8'), SNAPSHOT_COMPRESSION_LEVEL)
+
+
+def decompress_page(content):
+    return zlib.decompress(content).decode('utf-8')
+
+
+def snapshot_rows(url, page, validation_id=None):
+    # rows for DbHandler.insert_page_snapshots from the pages captured by fetcher.fetch_elements_text(snapshot=True),
+    # the initial HTML is kept as parsed document and only serialized here
+    rows = []
+    for fetch_mode, browser_profile, content in page['snapshots'] or []:
+        html = content if isinstance(content, str) else lxml_html.tostring(content, encoding='unicode')
+        rows.append({'page': normalize_url(url), 'url': url, 'fetch_mode': fetch_mode,
+                     'browser_profile': browser_profile, 'fetched': page['fetched'], 'content': compress_page(html),
+                     'size': len(html), 'validation_id': validation_id})
+    return rows
+
+
+def snapshot_modes(fetch_mode):
+    # the snapshots an element is evaluated against, in the order of fetcher.fetch_order
+    if fetch_mode in (FETCH_MODE_HTTP, FETCH_MODE_BROWSER):
+        return [fetch_mode]
+    return [FETCH_MODE_HTTP, FETCH_MODE_BROWSER]
+
+
+def load_document(snapshot):
+    # parsed document of a snapshot row (with content), the last DOCUMENT_CACHE_SIZE are kept
+    with _documents_lock:
+        document = _documents.get(snapshot['id'])
+        if document is not None:
+            _documents.move_to_end(snapshot['id'])
+            return document
+    try:
+        document = lxml_html.fromstring(decompress_page(snapshot['content']), base_url=snapshot['url'])
+    except (etree.ParserError, zlib.error) as e:
+        print(f"Could not parse snapshot {snapshot['id']}: {e}")
+        return None
+    with _documents_lock:
+        _documents[snapshot['id']] = document
+        while len(_documents) > DOCUMENT_CACHE_SIZE:
+            _documents.popitem(last=False)
+    return document
+
+
+def evaluate_snapshot(snapshot, selector, regex):
+    start = time.perf_counter()
+    document = load_document(snapshot)
+    if document is None:
+        result = {'text': None, 'selector_type': 'not_found', 'price': None, 'error': "snapshot can't be parsed"}
+    else:
+        with _documents_lock:
+            result = evaluate_document(document, selector, regex)
+    return {'snapshot_id': snapshot['id'], 'fetch_mode': snapshot['fetch_mode'], 'fetched': snapshot['fetched'],
+            **result, 'ms': (time.perf_counter() - start) * 1000}
+
+
+def test_element(db_handler, url, selector, regex, fetch_mode):
+    """
+    Evaluates selector and regex against the latest snapshot of the page per fetch mode, in the order a crawl
+    would try them. Returns one result dict per snapshot (see extraction.evaluate_document), empty if the page
+    has no snapshots yet.
+    """
+    results = []
+    for mode in snapshot_modes(fetch_mode):
+        snapshots = db_handler.retrieve_page_snapshots(normalize_url(url), fetch_mode=mode, limit=1,
+                                                       with_content=True)
+        if snapshots:
+            results.append(evaluate_snapshot(snapshots[0], selector, regex))
+    return results
+
+
+def reextract_element(db_handler, element, selector=None, regex=None, since=None):
+    """
+    Prices of the element on all stored snapshots of its page: a list of (fetched, price) in time order, the price
+    is None if the element or the price wasn't found. The snapshots of one crawl are tried in fetch order.
+    """
+    selector = selector or element['xpath']
+    regex = regex or element['regex']
+    modes = snapshot_modes(element.get('fetch_mode'))
+    crawls = {}  # fetched -> {mode: snapshot}
+    for snapshot in db_handler.retrieve_page_snapshots(normalize_url(element['url']), start=since):
+        if snapshot['fetch_mode'] in modes:
+            crawls.setdefault(snapshot['fetched'], {})[snapshot['fetch_mode']] = snapshot
+
+    points = []
+    for fetched in sorted(crawls):
+        price = None
+        for mode in modes:
+            snapshot = crawls[fetched].get(mode)
+            if snapshot is None:
+                continue
+            # the content is read per snapshot, so the history of a page isn't loaded into memory at once
+            snapshot = db_handler.retrieve_page_snapshot(snapshot['id'])
+            price = evaluate_snapshot(snapshot, selector, regex)['price']
+            if price is not None:
+                break
+        points.append((fetched, price))
+    return points
+
+
+def main():
+    from db_handler import DB_PATH, DbHandler
+
+    parser = argparse.ArgumentParser(description="Re-run selectors / regexes over the stored page snapshots")
+    parser.add_argument('--db', default=DB_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    reextract_parser = commands.add_parser('reextract', help="correct / fill in price_history from the snapshots")
+    reextract_parser.add_argument('--elements', type=int, nargs='+', help="element ids, default: all elements")
+    reextract_parser.add_argument('--selector', help="instead of the saved selector of the elements")
+    reextract_parser.add_argument('--regex', help="instead of the saved regex of the elements")
+    reextract_parser.add_argument('--since-days', type=float, help="only snapshots of the last days")
+    reextract_parser.add_argument('--apply', action='store_true', help="write the prices, otherwise only report")
+    args = parser.parse_args()
+
+    db_handler = DbHandler(args.db)
+    db_handler.init_db()
+    since = time.time() - args.since_days * 86400 if args.since_days else None
+    if args.elements:
+        elements = [db_handler.retrieve_tracked_element_by_id(element_id) for element_id in args.elements]
+    else:
+        elements = db_handler.retrieve_tracked_elements().to_dict('records')
+    try:
+        for element in elements:
+            if not element:
+                continue
+            start = time.perf_counter()
+            points = reextract_element(db_handler, element, args.selector, args.regex, since)
+            result = db_handler.backfill_prices(element['id'], points, PRICE_MATCH_WINDOW, apply=args.apply)
+            if result is None:
+                continue
+            print(f"{element['name']}: {len(points)} snapshots, {result['corrected']} corrected, "
+                  f"{result['filled']} filled in, {result['unchanged']} unchanged, {result['missing']} without price, "
+                  f"{result['skipped']} inside longer runs ({(time.perf_counter() - start) * 1000:.0f} ms)")
+            for timestamp, old_price, price in result['changes'][:10]:
+                print(f"  {time.ctime(timestamp)}: {'-' if old_price is None else old_price} -> {price}")
+        if not args.apply:
+            print("Dry run, use --apply to write the prices")
+    finally:
+        db_handler.close_db()
+
+
+if __name__ == '__main__':
+    main()
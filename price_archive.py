@@ -0,0 +1,137 @@
+"""
+Columnar archive of old price history.
+
+    python price_archive.py --older-than-days 180 [--db pricetracker.db] [--no-vacuum]
+
+Runs whose last_seen is older than the retention are moved from price_history into zstd compressed Parquet files,
+one per element and month (UTC, of the run's start): <archive dir>/element=<id>/<YYYY-MM>.parquet. The live database
+is shrunk afterwards. DbHandler.retrieve_price_history reads the archive (memory-mapped) whenever a query's time range
+reaches before the archived boundary, rollups and crawl statistics stay in the database. Needs pyarrow.
+"""
+import argparse
+import os
+import shutil
+import time
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed once history is archived
+    pa = pq = None
+
+ARCHIVE_DIR_NAME = 'price_archive'
+ARCHIVE_COMPRESSION = 'zstd'
+DEFAULT_RETENTION_DAYS = 180
+ARCHIVE_COLUMNS = ['id', 'tracked_elements_id', 'current_price', 'timestamp', 'last_seen']
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("the price archive needs pyarrow: pip install pyarrow")
+
+
+def default_archive_dir(db_path):
+    # next to the database
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), ARCHIVE_DIR_NAME)
+
+
+def element_dir(archive_dir, element_id):
+    return os.path.join(archive_dir, f'element={int(element_id)}')
+
+
+def month_of(epoch):
+    return time.strftime('%Y-%m', time.gmtime(epoch))
+
+
+def write_partition(archive_dir, element_id, month, df):
+    # merges the rows into the month's file. rows that are already archived are replaced, so a job that is repeated
+    # after a crash doesn't duplicate them
+    _require_pyarrow()
+    path = os.path.join(element_dir(archive_dir, element_id), f'{month}.parquet')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df = df[ARCHIVE_COLUMNS]
+    if os.path.exists(path):
+        df = pd.concat([pq.read_table(path).to_pandas(), df], ignore_index=True)
+        df = df.drop_duplicates('id', keep='last')
+    df = df.sort_values('timestamp')
+
+    # replaced atomically, readers see either the old or the new file
+    temp_path = path + '.tmp'
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), temp_path, compression=ARCHIVE_COMPRESSION)
+    os.replace(temp_path, path)
+    return len(df)
+
+
+def read_archive(archive_dir, element_ids, start=None, end=None):
+    """
+    Archived runs of the elements as a DataFrame with ARCHIVE_COLUMNS (epoch seconds), filtered like
+    retrieve_price_history: last_seen >= start and timestamp <= end.
+    """
+    frames = []
+    end_month = month_of(end) if end is not None else None
+    for element_id in element_ids:
+        directory = element_dir(archive_dir, element_id)
+        if not os.path.isdir(directory):
+            continue
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.parquet'):
+                continue
+            # months that start after the range can be skipped by their name
+            if end_month is not None and name[:-len('.parquet')] > end_month:
+                continue
+            _require_pyarrow()
+            filters = []
+            if start is not None:
+                filters.append(('last_seen', '>=', start))
+            if end is not None:
+                filters.append(('timestamp', '<=', end))
+            table = pq.read_table(os.path.join(directory, name), memory_map=True, filters=filters or None)
+            if table.num_rows:
+                frames.append(table.to_pandas())
+    if not frames:
+        return pd.DataFrame(columns=ARCHIVE_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def to_local_datetime(epochs):
+    # same as sqlite's datetime(x, 'unixepoch', 'localtime'): naive local time. the utc offset is looked up once per
+    # quarter hour, offsets only change at those boundaries
+    epochs = pd.Series(epochs, dtype='int64')
+    quarters = epochs // 900
+    offsets = quarters.map({quarter: time.localtime(quarter * 900).tm_gmtoff for quarter in quarters.unique()})
+    return pd.to_datetime(epochs + offsets, unit='s')
+
+
+def delete_element_archive(archive_dir, element_id):
+    shutil.rmtree(element_dir(archive_dir, element_id), ignore_errors=True)
+
+
+def main():
+    from db_handler import DB_PATH, DbHandler
+
+    parser = argparse.ArgumentParser(description="Move old price history into the columnar archive")
+    parser.add_argument('--db', default=DB_PATH)
+    parser.add_argument('--older-than-days', type=float, default=DEFAULT_RETENTION_DAYS,
+                        help="archive runs last seen before this age")
+    parser.add_argument('--archive-dir', help=f"default: {ARCHIVE_DIR_NAME} next to the database")
+    parser.add_argument('--no-vacuum', action='store_true', help="don't reclaim the space in the database")
+    args = parser.parse_args()
+
+    db_handler = DbHandler(args.db, archive_dir=args.archive_dir)
+    db_handler.init_db()
+    start = time.perf_counter()
+    try:
+        result = db_handler.archive_price_history(args.older_than_days, vacuum=not args.no_vacuum)
+    except RuntimeError as e:
+        parser.error(str(e))
+    finally:
+        db_handler.close_db()
+    print(f"Archived {result['rows']} prices of {result['elements']} elements into {result['files']} files, "
+          f"database {result['size_before'] / 2 ** 20:.1f} MB -> {result['size_after'] / 2 ** 20:.1f} MB, "
+          f"in {time.perf_counter() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,89 @@
+import argparse
+import math
 import re
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
 
 import pandas as pd
 import plotly.express as px
 import streamlit as st
 
-from crawly import Crawly, execute_task, change_update_interval
-from db_handler import DbHandler
-
-# https://stackoverflow.com/questions/3809401/what-is-a-good-regular-expression-to-match-a-url
-URL_PATTERN = r"https?:\/\/(www\.)?[-a-zA-Z0-9@:%._\+~#=]{1,256}\.[a-zA-Z0-9()]{1,6}\b([-a-zA-Z0-9()@:%_\+.~#?&//=]*)"
-REGEX_DEFAULT_PATTERN = r"[-+]?\d{1,3}(?:[.,]\d{3})*(?:[.,]\d+)"
-DEFAULT_UPDATE_INTERVAL = 60
+from alerts import SINKS, start_alert_dispatcher
+from bulk_io import DEFAULT_UPDATE_INTERVAL, REGEX_DEFAULT_PATTERN, URL_PATTERN
+from chart_data import prepare_chart_data
+from crawl_control import DEFAULT_CONTROL_PORT, DEFAULT_CONTROL_URL, CrawlerClient, start_control_server
+from crawl_metrics import DEFAULT_METRICS_PORT, start_metrics_server
+from crawl_options import (BROWSER_PROFILES, DEFAULT_BROWSER_PROFILE, ENGINE_THREADED, ENGINES, FETCH_MODE_AUTO,
+                           FETCH_MODES)
+from db_handler import (ALERT_BELOW, ALERT_DROP, ALERT_KINDS, CRAWL_STATUSES, ELEMENT_PAGE_SIZE, ELEMENT_SORTS,
+                        DbHandler)
+from page_snapshots import VALIDATION_FAILED, VALIDATION_PENDING, VALIDATION_SAVE, VALIDATION_SNAPSHOT, test_element
+from query_cache import CachedReads, QueryCache
+
+# raw prices are only shown for short time ranges, longer ranges are read from the rollups,
+# so the number of points per element stays bounded regardless of the history length
+RESOLUTION_THRESHOLDS = [
+    (timedelta(days=3), None),
+    (timedelta(days=90), 'hour'),
+    (timedelta(days=3 * 365), 'day'),
+]
+RESOLUTION_LABELS = {None: 'all', 'hour': 'hourly', 'day': 'daily', 'week': 'weekly'}
+ALERT_LABELS = {'below': 'Price below', 'drop': 'Price drop by %', 'all_time_low': 'New all-time low',
+                'back_in_stock': 'Back in stock'}
+CRAWL_STATUS_LABELS = {'ok': 'Price found', 'no_price': 'No price', 'no_price_yet': 'No price yet',
+                       'shop_failing': 'Shop failing'}
+ACTIVE_LABELS = {None: 'All', True: 'Active', False: 'Inactive'}
+SORT_LABELS = {'name': 'Name', 'host': 'Shop', 'last_crawl': 'Last crawl', 'last_price': 'Price', 'added': 'Added'}
+# the dashboard reruns in this interval while the crawler loads the page of the form
+VALIDATION_POLL_INTERVAL = 1  # seconds
 
 
 def reset_checkboxes():
     st.session_state['chk_widget_idx'] += 1
 
 
-def dataframe_with_selections(df):
-    df_with_selections = df.copy()
-    df_with_selections.insert(0, "Select", False)
-
-    # Get dataframe row-selections from user with st.data_editor none
+def element_list(reads):
+    # one page of the elements, searched, filtered and sorted by the database. returns the selected rows
+    search = st.text_input("Search", placeholder="Search name or URL", label_visibility='collapsed',
+                           key='list_search')
+    with st.expander("Filter and sort"):
+        host = st.selectbox("Shop", [None] + reads.retrieve_element_hosts(), format_func=lambda h: h or "All",
+                            key='list_host')
+        is_active = st.selectbox("Active", [None, True, False], format_func=ACTIVE_LABELS.get, key='list_active')
+        status = st.selectbox("Last crawl", [None] + CRAWL_STATUSES,
+                              format_func=lambda s: CRAWL_STATUS_LABELS[s] if s else "All", key='list_status')
+        sort = st.selectbox("Sort by", list(ELEMENT_SORTS), format_func=SORT_LABELS.get, key='list_sort')
+        descending = st.toggle("Descending", key='list_descending')
+
+    # back to the first page whenever the filters change
+    filters = (search.strip() or None, host, is_active, status, sort, descending)
+    if st.session_state.get('list_filters') != filters:
+        st.session_state['list_filters'] = filters
+        st.session_state['list_page'] = 1
+    page = st.session_state.get('list_page', 1)
+    df, total = reads.search_tracked_elements(*filters, offset=(page - 1) * ELEMENT_PAGE_SIZE)
+    pages = max(1, math.ceil(total / ELEMENT_PAGE_SIZE))
+    if page > pages:
+        # elements were deleted in the meantime
+        page = st.session_state['list_page'] = pages
+        df, total = reads.search_tracked_elements(*filters, offset=(page - 1) * ELEMENT_PAGE_SIZE)
+
+    if not df.empty:
+        df['status'] = df['status'].map(CRAWL_STATUS_LABELS)
+    df.insert(0, "Select", False)
+    # the key changes with the page, so the checkboxes of one page don't stick to the rows of another
     edited_df = st.data_editor(
-        df_with_selections,
+        df,
         hide_index=True,
-        column_config={"Select": st.column_config.CheckboxColumn(required=True), "name": "Name", "id": None,
-                       "url": None, "xpath": None, "update_interval": None, "is_active": None, "regex": None},
+        column_order=['Select', 'name', 'status', 'last_price'],
+        column_config={"Select": st.column_config.CheckboxColumn(required=True), "name": "Name",
+                       "status": "Last Crawl", "last_price": "Price"},
         disabled=df.columns,
         use_container_width=True,
-        key=f'selected_items{st.session_state["chk_widget_idx"]}'
+        key=f'selected_items{st.session_state["chk_widget_idx"]}_{page}_{hash(filters)}'
     )
+    st.number_input(f"Page (of {pages}, {total} elements)", min_value=1, max_value=pages, key='list_page')
 
     # Filter the dataframe using the temporary column, then drop the column
     selected_rows = edited_df[edited_df.Select]
@@ -41,34 +94,46 @@ def get_tagged_element_value(row, col, default=None):
     return row[col] if row is not None and not pd.isna(row[col]) else default
 
 
-def display_line_plot(df, title="", height=500):
+def choose_resolution(start, end):
+    for max_span, resolution in RESOLUTION_THRESHOLDS:
+        if end - start <= max_span:
+            return resolution
+    return 'week'
 
-    # only display price of point if it has changed
-    df = df.sort_values(by='timestamp')
-    text_values = []
-    for name in df['name'].unique():
-        subset_df = df[df['name'] == name]  # Get the subset of the DataFrame for the current name
-        last_price = None
-        trace_text = []
-        # Loop through each row in the subset DataFrame
-        for index, row in subset_df.iterrows():
-            # Check if the current price is different from the last observed price
-            if row['current_price'] != last_price:
-                trace_text.append(row['current_price']) # If the price has changed, add it to the text list
-                last_price = row['current_price']
-            else:
-                # If the price hasn't changed, add an empty string to the text list
-                trace_text.append("")
 
-        # Extend the overall text list with the text values for the current trace
-        text_values.extend(trace_text)
+def load_chart_data(db_handler, element_ids, date_range):
+    if len(date_range) == 2:
+        start = datetime.combine(date_range[0], datetime.min.time())
+        end = datetime.combine(date_range[1], datetime.max.time())
+    else:
+        # no range selected, the whole history is visible
+        start, end = db_handler.retrieve_history_range(element_ids)
+        if start is None:
+            return pd.DataFrame(), None
+
+    resolution = choose_resolution(start, end)
+    if resolution is None:
+        return db_handler.retrieve_price_history(element_ids, start, end, expand=True), resolution
+
+    df = db_handler.retrieve_price_rollup(element_ids, resolution, start, end)
+    if not df.empty:
+        # the chart shows the last price of every bucket
+        df = df.rename(columns={'last_price': 'current_price'})
+        df['price_changed'] = df.groupby('tracked_elements_id')['current_price'].diff().ne(0)
+    return df, resolution
 
-    df['text'] = text_values    # add changed price as new col to df
+
+def display_line_plot(df, title="", height=500):
+
+    # only display price of point if it has changed
+    df, summary = prepare_chart_data(df)
 
     fig_price_history = px.line(df, x='timestamp', y='current_price', color='name',
                                 labels={'timestamp': 'Timestamp', 'current_price': 'Current Price in €',
                                         'name': 'Tracked Element'},
                                 text="text",  # Use the 'text' column for the hover text
+                                line_shape='hv',  # a price holds until it changes
+                                hover_data=[col for col in ['min_price', 'max_price', 'avg_price'] if col in df.columns],
                                 height=height)
     fig_price_history.update_traces(textposition="top center")
 
@@ -78,6 +143,7 @@ def display_line_plot(df, title="", height=500):
 
     fig_price_history.update_layout(title_text=title)
     st.plotly_chart(fig_price_history, use_container_width=True)
+    return summary
 
 
 @st.cache_data
@@ -150,24 +216,26 @@ def _init_example_data():
         db_handler.insert_price_history(df)
 
 
-def one_time_track(item):
-    return execute_task(-1, item)
+# one cache for all sessions of the dashboard, invalidated by the data version the writers bump
+@st.cache_resource
+def get_query_cache():
+    return QueryCache()
 
 
-def is_not_unique(name, df_tracked_elements, selection):
-    if df_tracked_elements.empty:
-        return False  # If DataFrame is empty, name is considered unique
-    if not selection.empty:
-        # remove selection to check whether the name is unique aside from the selection when editing an item
-        filtered_df = df_tracked_elements[~df_tracked_elements['name'].isin(selection['name'])]
+def crawler_status(crawler):
+    status = crawler.status()
+    if status is None:
+        st.warning(f"The crawler isn't reachable at {crawler.url}, prices aren't updated. "
+                   f"Start it with `python crawly.py`.")
     else:
-        filtered_df = df_tracked_elements
-    return name in filtered_df['name'].values
+        st.caption(f"Crawler ({status['engine']} engine): {status['scheduled']} elements scheduled, "
+                   f"{status['overdue']} overdue, {status['hosts_failing']} shops failing")
 
 
-def gui(db_handler):
-    df_tracked_elements = db_handler.retrieve_tracked_elements()
+def gui(db_handler, crawler):
+    reads = CachedReads(db_handler, get_query_cache())
     st.title('Price Tracker')
+    crawler_status(crawler)
 
     # create a 3-column layout
     col11, col12 = st.columns([3, 1])
@@ -175,26 +243,43 @@ def gui(db_handler):
     with (st.container()):
         # table to select and display items
         with col12:
-            selection = dataframe_with_selections(df_tracked_elements)
-            col121, col122 = st.columns([1, 1])
+            selection = element_list(reads)
+            col121, col122, col123 = st.columns([1, 1, 1])
             with col121:
                 btn_delete = st.button("Delete", disabled=len(selection) != 1, use_container_width=True)
             with col122:
                 btn_add = st.button("Add", on_click=reset_checkboxes, use_container_width=True)
+            with col123:
+                btn_run = st.button("Crawl", disabled=selection.empty, use_container_width=True,
+                                    help="Crawl the selected elements now")
+            if btn_run:
+                scheduled = crawler.run_now(selection['id'].tolist())
+                if scheduled is None:
+                    st.error("The crawler isn't reachable")
+                else:
+                    st.toast(f"Crawling {len(scheduled)} of {len(selection)} elements (inactive ones are skipped)")
 
         # graph to show price history
         with col11:
-            if 'id' not in selection.columns or selection['id'].isnull().any():
+            date_range = st.date_input("Time range (leave empty for the whole history)", value=(),
+                                       key='chart_date_range')
+
+            if selection.empty or 'id' not in selection.columns or selection['id'].isnull().any():
                 df_price_history = []
             else:
-                df_price_history = db_handler.retrieve_price_history(selection['id'].tolist())
+                df_price_history, resolution = load_chart_data(reads, selection['id'].tolist(), date_range)
+                st.caption(f"Showing {RESOLUTION_LABELS[resolution]} prices")
 
             if len(selection) > 0 and len(df_price_history) > 0:
                 # merge price history with corresponding item
                 merged_df = pd.merge(df_price_history, selection[['id', 'name']], left_on='tracked_elements_id',
                                      right_on='id', how='left', suffixes=('_price_history', '_selection'))
 
-                display_line_plot(merged_df)
+                summary = display_line_plot(merged_df)
+                st.dataframe(summary, hide_index=True, use_container_width=True,
+                             column_config={"name": "Name", "min": "Min", "max": "Max", "last": "Last",
+                                            "last_change": st.column_config.DatetimeColumn("Last Change"),
+                                            "change_pct": st.column_config.NumberColumn("Change", format="%.2f %%")})
             else:
                 empty_df = pd.DataFrame(columns=['timestamp', 'current_price', 'name'])
                 if selection.empty:
@@ -206,6 +291,9 @@ def gui(db_handler):
         # the data is shown in the form
         edit_row = selection.iloc()[0].copy() if len(selection) == 1 else None
 
+        if edit_row is not None and 'id' in selection.columns and not pd.isnull(edit_row['id']):
+            alerts_section(db_handler, int(edit_row['id']))
+
         # if the user doesn't select exactly one row, we assume they want to view items in the graph, not edit them,
         # so we disable the form
         is_disabled = len(selection) > 1
@@ -244,11 +332,62 @@ def gui(db_handler):
                                                   disabled=is_disabled,
                                                   key='form_update_interval')
 
+            with col212:
+                fetch_mode_value = FETCH_MODE_AUTO if st.session_state['reset_form'] else get_tagged_element_value(edit_row, 'fetch_mode', FETCH_MODE_AUTO)
+                fetch_mode = st.selectbox("Fetch Mode", FETCH_MODES,
+                                          index=FETCH_MODES.index(fetch_mode_value),
+                                          disabled=is_disabled,
+                                          help="'http' reads the price from the initial HTML without a browser, 'browser' renders the page in Firefox. "
+                                               "'auto' tries 'http' first and falls back to the browser.",
+                                          key='form_fetch_mode')
+
+            with col213:
+                browser_profile_value = DEFAULT_BROWSER_PROFILE if st.session_state['reset_form'] else get_tagged_element_value(edit_row, 'browser_profile', DEFAULT_BROWSER_PROFILE)
+                browser_profile = st.selectbox("Browser Profile", BROWSER_PROFILES,
+                                               index=BROWSER_PROFILES.index(browser_profile_value),
+                                               disabled=is_disabled,
+                                               help="'lean' doesn't load images, fonts, media and trackers and doesn't wait for the page to finish loading. "
+                                                    "Use 'full' for shops that don't show the price like that.",
+                                               key='form_browser_profile')
+
+            col221, col222, col223 = st.columns([1, 1, 1])
+
+            with col221:
+                adaptive_value = False if st.session_state['reset_form'] else bool(get_tagged_element_value(edit_row, 'adaptive', False))
+                adaptive = st.toggle("Adaptive Interval", value=adaptive_value, disabled=is_disabled,
+                                     help="Crawls elements with flat prices less often and elements that change often more often, "
+                                          "within the min. and max. interval.",
+                                     key='form_adaptive')
+
+            with col222:
+                min_interval_value = None if st.session_state['reset_form'] else get_tagged_element_value(edit_row, 'min_interval')
+                min_interval_value = None if min_interval_value is None else int(min_interval_value)
+                min_interval = st.number_input("Min. Interval (in minutes)", value=min_interval_value,
+                                               min_value=1, max_value=(60 * 24 * 7),
+                                               placeholder="1/4 of the update interval",
+                                               disabled=is_disabled, key='form_min_interval')
+
+            with col223:
+                max_interval_value = None if st.session_state['reset_form'] else get_tagged_element_value(edit_row, 'max_interval')
+                max_interval_value = None if max_interval_value is None else int(max_interval_value)
+                max_interval = st.number_input("Max. Interval (in minutes)", value=max_interval_value,
+                                               min_value=1, max_value=(60 * 24 * 7 * 4),
+                                               placeholder="16x the update interval",
+                                               disabled=is_disabled, key='form_max_interval')
+
             is_active_value = True if st.session_state['reset_form'] else get_tagged_element_value(edit_row, 'is_active', default=True)
             is_active = st.toggle("Active", value=is_active_value,
                                   disabled=is_disabled)
 
-            btn_save = st.form_submit_button("Save", disabled=is_disabled)
+            col231, col232, col233 = st.columns([1, 1, 1])
+            with col231:
+                btn_test = st.form_submit_button("Test", disabled=is_disabled, use_container_width=True,
+                                                 help="Test selector and regex against the last loaded page")
+            with col232:
+                btn_fetch = st.form_submit_button("Fetch", disabled=is_disabled, use_container_width=True,
+                                                  help="Load the page again (in the background) and test against it")
+            with col233:
+                btn_save = st.form_submit_button("Save", disabled=is_disabled, use_container_width=True)
 
 
         if btn_delete:
@@ -257,59 +396,247 @@ def gui(db_handler):
                 print(f"Delete item: {selection['name']}")
                 ids = selection['id'].tolist()
                 db_handler.delete_tracked_element_by_id(ids)
+                # if the crawler isn't reachable, it drops the element when it refreshes its schedule
+                for id_ in ids:
+                    crawler.unschedule(id_)
                 st.rerun()  # necessary to update the selection list
 
-        if btn_save:
-            with st.spinner('Loading...'):
-                if url is None or not re.findall(URL_PATTERN, url):
-                    st.error("Please enter a valid URL")
-                elif is_not_unique(name, df_tracked_elements, selection):  # name needs to be unique for displaying the items in the graph properly
-                    st.error("Please enter a unique name")
+        if btn_test or btn_fetch or btn_save:
+            if url is None or not re.findall(URL_PATTERN, url):
+                st.error("Please enter a valid URL")
+            elif btn_save and db_handler.is_name_taken(name, get_tagged_element_value(edit_row, 'id')):  # name needs to be unique for displaying the items in the graph properly
+                st.error("Please enter a unique name")
+            elif btn_save and min_interval is not None and max_interval is not None and min_interval > max_interval:
+                st.error("The min. interval can't be greater than the max. interval")
+            else:
+                form_data = {
+                    'id': int(get_tagged_element_value(edit_row, "id", -1)),
+                    'name': name,
+                    'url': url,
+                    'xpath': xpath,
+                    'regex': regex.strip() if regex and regex.strip() else REGEX_DEFAULT_PATTERN,  # use placeholder value if nothing else was specified
+                    'update_interval': update_interval,
+                    'is_active': is_active,
+                    'fetch_mode': fetch_mode,
+                    'adaptive': adaptive,
+                    'min_interval': min_interval,
+                    'max_interval': max_interval,
+                    'browser_profile': browser_profile
+                }
+
+                # tested against the stored snapshots of the page first, the page is only loaded (by the crawler, in
+                # the background) if there is none or the user asks for it
+                results = [] if btn_fetch else test_element(db_handler, url, form_data['xpath'], form_data['regex'],
+                                                            fetch_mode)
+                found = next((result for result in results if result['price'] is not None), None)
+                if btn_fetch or not results or (btn_save and found is None):
+                    submit_validation(crawler, form_data, VALIDATION_SAVE if btn_save else VALIDATION_SNAPSHOT)
+                elif btn_test:
+                    st.session_state['test_results'] = results
                 else:
-                    form_data = {
-                        'id': get_tagged_element_value(edit_row, "id", -1),
-                        'name': name,
-                        'url': url,
-                        'xpath': xpath,
-                        'regex': regex.strip() if regex and regex.strip() else REGEX_DEFAULT_PATTERN,  # use placeholder value if nothing else was specified
-                        'update_interval': update_interval,
-                        'is_active': is_active
-                    }
-
-                    # if this works, the item is already inserted in the db here
-                    # if not, it returns -1
-                    extracted_price = one_time_track(form_data)
-
-                    if extracted_price == -1:
-                        st.error("Failed extracting a price. Please change your parameters")
+                    message = f"Saved element {name}, price {found['price']} on the page loaded " \
+                              f"{format_time(found['fetched'])}"
+                    saved = save_element(db_handler, crawler, form_data)
+                    if saved is None:
+                        st.error(f"{name} couldn't be saved, e.g. because the name was taken in the meantime")
                     else:
-                        df = pd.DataFrame([form_data])
-
-                        if len(selection) == 1:     # update selected item
-                            id_ = int(selection['id'].values[0])
-                            db_handler.update_tracked_element(id_, df)
-                            change_update_interval(db_handler.retrieve_tracked_element_by_id(id_))
-                            st.write(f'Updated element {name}')
-                        else:  # form is disabled if there is more than 1 selection, so this means no selections -> insert new item
-                            # item has already been inserted by crawly at this point
-                            st.write(f"Inserted element {df['name']}")
+                        if saved:
+                            st.session_state['form_message'] = ('success', message)
+                        else:
+                            st.session_state['form_message'] = ('warning', f"{message}. The crawler isn't reachable "
+                                                                           f"at {crawler.url}, the element is "
+                                                                           f"crawled once it is started")
+                        if form_data['id'] == -1:
                             st.session_state['reset_form'] = True
                         st.rerun()  # necessary to update the selection list
 
+        form_feedback()
+
+    shop_health_section(db_handler)
+
     with st.container():
         st.write('Authors: Michael Duschek, Carina Hauber, Lukas Seifriedsberger, 2024')
 
+    poll_validation(db_handler)
+
+
+def format_time(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
 
-# starts the web crawler (in an own daemon thread)
+def save_element(db_handler, crawler, form_data):
+    # the form was tested against a snapshot, so the element is saved right away and crawled with the crawler's next
+    # dispatch. returns None if it couldn't be saved (e.g. the name was taken in the meantime), False if the crawler
+    # isn't reachable
+    df = pd.DataFrame([form_data])
+    if form_data['id'] != -1:
+        element_id = form_data['id']
+        if not db_handler.update_tracked_element(element_id, df):
+            return None
+    else:
+        element_id = db_handler.insert_tracked_element(df)
+        if element_id is None:
+            return None
+    if crawler.schedule(element_id) is None:
+        return False
+    crawler.run_now([element_id])
+    return True
+
+
+def submit_validation(crawler, form_data, action):
+    # the crawler loads the page in the background, poll_validation shows the result when it is done
+    validation_id = crawler.validate(form_data, action)
+    if validation_id is None:
+        st.error(f"The crawler isn't reachable at {crawler.url}, the page can't be loaded")
+    else:
+        st.session_state['validation'] = validation_id
+
+
+def form_feedback():
+    # message and test results of the last action of the form, shown once
+    message = st.session_state.pop('form_message', None)
+    if message is not None:
+        getattr(st, message[0])(message[1])
+    results = st.session_state.pop('test_results', None)
+    if results:
+        df = pd.DataFrame(results)
+        df['fetched'] = df['fetched'].map(datetime.fromtimestamp)
+        df['text'] = df['text'].map(lambda text: None if text is None else ' '.join(text.split())[:200])
+        st.dataframe(df[['fetch_mode', 'fetched', 'selector_type', 'text', 'price', 'error', 'ms']], hide_index=True,
+                     use_container_width=True,
+                     column_config={"fetch_mode": "Page", "fetched": st.column_config.DatetimeColumn("Loaded"),
+                                    "selector_type": "Selector", "text": "Element Text", "price": "Price",
+                                    "error": "Error", "ms": st.column_config.NumberColumn("ms", format="%.1f")})
+
+
+def poll_validation(db_handler):
+    # reruns the script until the background validation of the form is done
+    validation_id = st.session_state.get('validation')
+    if validation_id is None:
+        return
+    validation = db_handler.retrieve_validation(validation_id)
+    if validation is not None and validation['status'] == VALIDATION_PENDING:
+        st.toast(f"Loading {validation['element']['url']} ({int(time.time()) - validation['requested']} s)")
+        time.sleep(VALIDATION_POLL_INTERVAL)
+        st.rerun()
+
+    del st.session_state['validation']
+    if validation is None:
+        return
+    element = validation['element']
+    if validation['status'] == VALIDATION_FAILED:
+        st.session_state['form_message'] = ('error', f"Loading the page failed: {validation['error']}")
+    elif validation['action'] == VALIDATION_SAVE and validation['price'] is not None:
+        st.session_state['form_message'] = ('success', f"Saved element {element['name']}, price {validation['price']}")
+        if element['id'] == -1:
+            st.session_state['reset_form'] = True
+    else:
+        if validation['action'] == VALIDATION_SAVE:
+            st.session_state['form_message'] = ('error', "Failed extracting a price. Please change your parameters")
+        # why the price wasn't found (or what was found) is shown by testing against the page just loaded
+        st.session_state['test_results'] = test_element(db_handler, element['url'], element['xpath'],
+                                                        element['regex'], element['fetch_mode'])
+    st.rerun()
+
+
+def alerts_section(db_handler, element_id):
+    # rules of the selected element. read without the query cache, delivery updates don't bump the data version
+    with st.expander("Alerts"):
+        rules = db_handler.retrieve_alert_rules(element_id)
+        if not rules.empty:
+            st.dataframe(rules[['id', 'kind', 'threshold', 'sink', 'target']], hide_index=True,
+                         use_container_width=True)
+            col31, col32 = st.columns([3, 1])
+            with col31:
+                rule_ids = st.multiselect("Rules", rules['id'].tolist(), label_visibility='collapsed',
+                                          placeholder="Rules to delete", key='alert_delete_ids')
+            with col32:
+                if st.button("Delete Rules", disabled=not rule_ids, use_container_width=True):
+                    db_handler.delete_alert_rules(rule_ids)
+                    st.rerun()
+
+        with st.form("alert_form", clear_on_submit=True):
+            col41, col42, col43, col44 = st.columns([1, 1, 1, 2])
+            with col41:
+                kind = st.selectbox("Alert", ALERT_KINDS, format_func=ALERT_LABELS.get)
+            with col42:
+                threshold = st.number_input("Threshold", value=None, min_value=0.0,
+                                            help="Price for 'Price below', percent for 'Price drop by %'")
+            with col43:
+                sink = st.selectbox("Send via", SINKS)
+            with col44:
+                target = st.text_input("Target", help="File path, webhook URL or email addresses")
+            btn_add_alert = st.form_submit_button("Add Alert")
+
+        if btn_add_alert:
+            if kind in (ALERT_BELOW, ALERT_DROP) and threshold is None:
+                st.error("Please enter a threshold")
+            elif sink != 'file' and not target:
+                st.error("Please enter a target")
+            else:
+                db_handler.insert_alert_rule(element_id, kind, threshold, sink, target or None)
+                st.rerun()
+
+        events = db_handler.retrieve_alert_events(element_id)
+        if not events.empty:
+            st.caption("Recent alerts")
+            st.dataframe(events, hide_index=True, use_container_width=True)
+
+
+def shop_health_section(db_handler):
+    # failures and circuit state per shop, written by the crawler without bumping the data version
+    with st.expander("Shop Health"):
+        hosts = pd.DataFrame(db_handler.retrieve_host_health())
+        if hosts.empty:
+            st.caption("No shops crawled yet")
+            return
+        for column in ('last_success', 'last_failure', 'open_until'):
+            hosts[column] = pd.to_datetime(hosts[column], unit='s', utc=True).dt.tz_convert(
+                datetime.now().astimezone().tzinfo).dt.tz_localize(None)
+        st.dataframe(hosts[['host', 'state', 'successes', 'timeouts', 'blocked', 'errors', 'selector_misses',
+                            'regex_misses', 'last_success', 'last_failure', 'last_failure_kind', 'open_until',
+                            'last_error']],
+                     hide_index=True, use_container_width=True,
+                     column_config={"host": "Shop", "state": "Circuit", "selector_misses": "Selector Misses",
+                                    "regex_misses": "Regex Misses",
+                                    "last_success": st.column_config.DatetimeColumn("Last Success"),
+                                    "last_failure": st.column_config.DatetimeColumn("Last Failure"),
+                                    "last_failure_kind": "Failure", "open_until": st.column_config.DatetimeColumn(
+                                        "Paused Until"), "last_error": "Error"})
+
+
+# starts the web crawler inside the dashboard process (in an own daemon thread), only with --embedded-crawler.
+# crawly is imported here, so the dashboard alone doesn't load selenium
 # st.cache_data prevents this to be executed on every page reload
 @st.cache_data
-def start_crawly(_db_handler):
-    print("STARTING CRAWLY")
-    scheduler = Crawly(_db_handler)
+def start_crawly(_db_handler, engine=ENGINE_THREADED, metrics_port=DEFAULT_METRICS_PORT,
+                 control_port=DEFAULT_CONTROL_PORT):
+    from crawly import create_engine
+
+    print("STARTING CRAWLY", engine)
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    scheduler = create_engine(_db_handler, engine)
     scheduler.run()
+    start_alert_dispatcher()
+    start_control_server(scheduler, control_port)
+
+
+@st.cache_resource
+def get_crawler(url):
+    return CrawlerClient(url)
 
 
 if __name__ == '__main__':
+    # arguments are passed after a double dash: streamlit run price_tracker.py -- --crawler-url http://host:9109
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--crawler-url', default=DEFAULT_CONTROL_URL, help="control api of the crawler (crawly.py)")
+    parser.add_argument('--embedded-crawler', action='store_true',
+                        help="run the crawler inside the dashboard process, stops with the dashboard")
+    parser.add_argument('--engine', choices=ENGINES, default=ENGINE_THREADED, help="with --embedded-crawler")
+    parser.add_argument('--metrics-port', type=int, default=DEFAULT_METRICS_PORT, help="with --embedded-crawler")
+    args, _ = parser.parse_known_args()
+
     st.set_page_config(layout="wide")
 
     if 'chk_widget_idx' not in st.session_state:
@@ -322,8 +649,10 @@ if __name__ == '__main__':
     if db_handler.conn is None:
         db_handler.init_db()
 
-    start_crawly(db_handler)
-    gui(db_handler)
+    if args.embedded_crawler:
+        control_port = urlsplit(args.crawler_url).port or DEFAULT_CONTROL_PORT
+        start_crawly(db_handler, args.engine, args.metrics_port, control_port)
+    gui(db_handler, get_crawler(args.crawler_url))
 
     if st.session_state['reset_form']:
         st.session_state['reset_form'] = False
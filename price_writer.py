@@ -0,0 +1,159 @@
+import queue
+import sqlite3
+import threading
+import time
+
+from crawl_metrics import STAGE_DB_WRITE, metrics
+from db_handler import DB_PATH, DbHandler
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_FLUSH_INTERVAL = 0.5  # seconds
+RETRY_BASE_DELAY = 0.5  # seconds a failed batch waits for its retry, doubled with every failure
+RETRY_MAX_DELAY = 30
+MAX_ATTEMPTS = 3  # of a batch that fails with another error than a locked / busy database
+
+
+def is_transient(error):
+    # a locked or busy database (another writer, a long read), the batch is retried until it is written
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def insert_batch(db_handler, rows):
+    # None if the rows were written, otherwise the sqlite3.Error
+    try:
+        db_handler.write_price_rows(rows)
+        return None
+    except sqlite3.Error as e:
+        print(f"Error inserting data: {e}")
+        return e
+
+
+def retry_delay(attempt):
+    return min(RETRY_BASE_DELAY * 2 ** attempt, RETRY_MAX_DELAY)
+
+
+class PriceWriter:
+    """
+    Single writer for price_history.
+
+    Crawl results are put on a queue and one thread writes them with `executemany` in a single transaction,
+    whenever `batch_size` rows are collected or `flush_interval` seconds passed since the first row of the batch.
+    A batch that fails because the database is locked (e.g. by another process) is retried with backoff until it is
+    written, the rows queued in the meantime wait behind it, so no price is lost or written out of order. Other errors
+    are retried MAX_ATTEMPTS times, then the batch is split to find the rows that can't be written, which are logged
+    and dropped.
+    """
+
+    def __init__(self, db_path=DB_PATH, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stats = {'rows': 0, 'flushes': 0, 'failed_flushes': 0, 'dropped_rows': 0, 'last_batch_size': 0,
+                       'max_batch_size': 0, 'last_flush_ms': 0.0, 'max_flush_ms': 0.0, 'total_flush_ms': 0.0}
+
+        self._thread = threading.Thread(target=self._run, name='price-writer', daemon=True)
+        self._thread.start()
+
+    def put(self, element_id, price, timestamp):
+        self._queue.put((int(element_id), float(price), timestamp))
+
+    def flush(self, timeout=None):
+        # blocks until everything that was put before is written. False if that didn't happen within the timeout
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        flushes = stats['flushes'] + stats['failed_flushes']
+        stats['avg_batch_size'] = stats['rows'] / stats['flushes'] if stats['flushes'] else 0.0
+        stats['avg_flush_ms'] = stats.pop('total_flush_ms') / flushes if flushes else 0.0
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+    def _run(self):
+        # the connection is created on the writer thread, sqlite connections must stay on their thread
+        db_handler = DbHandler(self.db_path)
+        db_handler.connect()
+
+        while True:
+            batch = []
+            waiters = []
+            self._collect(self._queue.get(), batch, waiters)
+
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and not waiters:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    self._collect(self._queue.get(timeout=timeout), batch, waiters)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write(db_handler, batch)
+            for waiter in waiters:
+                waiter.set()
+
+    @staticmethod
+    def _collect(item, batch, waiters):
+        if isinstance(item, threading.Event):
+            waiters.append(item)
+        else:
+            batch.append(item)
+
+    def _write(self, db_handler, batch, attempts=MAX_ATTEMPTS):
+        attempt = 0
+        while True:
+            error = self._insert(db_handler, batch)
+            if error is None:
+                return
+            attempt += 1
+            if not is_transient(error) and attempt >= attempts:
+                break
+            delay = retry_delay(attempt - 1)
+            print(f"Writing {len(batch)} prices failed, retry {attempt} in {delay:.1f} s "
+                  f"({self._queue.qsize()} queued behind them)")
+            time.sleep(delay)
+
+        if len(batch) > 1:
+            # the halves are tried once, until the rows that can't be written are found
+            middle = len(batch) // 2
+            self._write(db_handler, batch[:middle], 1)
+            self._write(db_handler, batch[middle:], 1)
+        else:
+            print(f"Dropping price {batch[0]}: {error}")
+            metrics.inc('crawl_prices_dropped_total', "Prices that couldn't be written to price_history")
+            with self._lock:
+                self._stats['dropped_rows'] += 1
+
+    def _insert(self, db_handler, batch):
+        # None if the batch was written, otherwise the error
+        start = time.perf_counter()
+        error = insert_batch(db_handler, batch)
+        success = error is None
+        flush_ms = (time.perf_counter() - start) * 1000
+        metrics.record_stage(STAGE_DB_WRITE, flush_ms / 1000, 'ok' if success else 'error')
+        metrics.inc('crawl_prices_written_total', "Prices written to price_history", len(batch) if success else 0)
+
+        with self._lock:
+            if success:
+                self._stats['rows'] += len(batch)
+                self._stats['flushes'] += 1
+            else:
+                self._stats['failed_flushes'] += 1
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['max_batch_size'] = max(self._stats['max_batch_size'], len(batch))
+            self._stats['last_flush_ms'] = flush_ms
+            self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], flush_ms)
+            self._stats['total_flush_ms'] += flush_ms
+
+        if success:
+            print(f"{len(batch)} prices inserted into DB in {flush_ms:.1f} ms")
+        return error
@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from db_handler import ELEMENT_PAGE_SIZE
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def _size_of(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=False).sum())
+    if isinstance(value, tuple):
+        return sum(_size_of(item) for item in value)
+    return 0
+
+
+class QueryCache:
+    """
+    LRU cache for query results, bounded by the number of entries and the (approximate) memory of cached DataFrames.
+
+    All entries belong to one data version of the database. As soon as a lookup sees a different version, the whole
+    cache is dropped, so a write is never hidden by a cached read.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get_or_load(self, key, version, loader):
+        with self._lock:
+            if version != self._version:
+                if self._entries:
+                    self._stats['invalidations'] += 1
+                self._entries.clear()
+                self._bytes = 0
+                self._version = version
+
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return self._entries[key][0]
+            self._stats['misses'] += 1
+
+        value = loader()
+
+        with self._lock:
+            # the data might have changed while loading, the result is only cached for the version it was read at
+            if version == self._version and key not in self._entries:
+                size = _size_of(value)
+                self._entries[key] = (value, size)
+                self._bytes += size
+                self._evict()
+        return value
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self._bytes
+        return stats
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, size) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._stats['evictions'] += 1
+
+
+class CachedReads:
+    """
+    Read methods of DbHandler that are answered from a shared QueryCache while the data version is unchanged.
+    Returned DataFrames are copies, so callers can modify them.
+    """
+
+    def __init__(self, db_handler, cache):
+        self.db_handler = db_handler
+        self.cache = cache
+
+    def retrieve_tracked_elements(self):
+        return self._get(('tracked_elements',), self.db_handler.retrieve_tracked_elements)
+
+    def search_tracked_elements(self, search=None, host=None, is_active=None, status=None, sort='name',
+                                descending=False, limit=ELEMENT_PAGE_SIZE, offset=0):
+        key = ('search_tracked_elements', search, host, is_active, status, sort, descending, limit, offset)
+        df, total = self._get(key, lambda: self.db_handler.search_tracked_elements(
+            search, host, is_active, status, sort, descending, limit, offset))
+        return df.copy(), total
+
+    def retrieve_element_hosts(self):
+        return self._get(('element_hosts',), self.db_handler.retrieve_element_hosts)
+
+    def retrieve_price_history(self, element_ids, start=None, end=None, expand=False):
+        key = ('price_history', self._ids(element_ids), str(start), str(end), expand)
+        return self._get(key, lambda: self.db_handler.retrieve_price_history(element_ids, start, end, expand))
+
+    def retrieve_price_rollup(self, element_ids, resolution, start=None, end=None):
+        key = ('price_rollup', self._ids(element_ids), resolution, str(start), str(end))
+        return self._get(key, lambda: self.db_handler.retrieve_price_rollup(element_ids, resolution, start, end))
+
+    def retrieve_history_range(self, element_ids):
+        return self._get(('history_range', self._ids(element_ids)),
+                         lambda: self.db_handler.retrieve_history_range(element_ids))
+
+    def _get(self, key, loader):
+        value = self.cache.get_or_load(key, self.db_handler.get_data_version(), loader)
+        return value.copy() if isinstance(value, pd.DataFrame) else value
+
+    @staticmethod
+    def _ids(element_ids):
+        return tuple(sorted(int(element_id) for element_id in element_ids))
@@ -0,0 +1,102 @@
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+# the modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STATIC_PAGE = b'<html><body><div class="product"><span class="price">1.234,56 \xe2\x82\xac</span></div></body></html>'
+JS_PAGE = b'<html><body><div id="product"></div><script>/* renders the price */</script></body></html>'
+ETAG = '"v1"'
+LAST_MODIFIED = 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+
+class ShopHandler(BaseHTTPRequestHandler):
+    """
+    /static   price in the initial HTML, with ETag and Last-Modified, conditional requests are answered with 304
+    /plain    like /static, without validators
+    /js       the price is rendered by javascript, it isn't in the initial HTML
+    /empty    200 without a body
+    /error    500
+    /blocked  403
+    """
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path == '/static':
+            if self.headers.get('If-None-Match') == ETAG or self.headers.get('If-Modified-Since') == LAST_MODIFIED:
+                self.respond(304, b'')
+            else:
+                self.respond(200, STATIC_PAGE, {'ETag': ETAG, 'Last-Modified': LAST_MODIFIED})
+        elif self.path == '/plain':
+            self.respond(200, STATIC_PAGE)
+        elif self.path == '/js':
+            self.respond(200, JS_PAGE)
+        elif self.path == '/empty':
+            self.respond(200, b'')
+        elif self.path == '/blocked':
+            self.respond(403, b'<html><body>captcha</body></html>')
+        else:
+            self.respond(500, b'')
+
+    def respond(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def shop():
+    # local shop on a free port, `requests` holds the (path, headers) of every request it received
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ShopHandler)
+    server.daemon_threads = True
+    server.requests = []
+    server.url = f'http://127.0.0.1:{server.server_address[1]}'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def browser(monkeypatch):
+    # replaces the browser tier, so no Firefox is launched: `texts` maps the url to the texts the rendered page
+    # returns for the selectors, `calls` holds the (url, selectors, profile) of every page load
+    import fetcher
+
+    class FakeBrowser:
+        def __init__(self):
+            self.texts = {}
+            self.calls = []
+            self.error = None
+
+        def fetch_browser_texts(self, pool, url, selectors, profile=None, page=None):
+            self.calls.append((url, list(selectors), profile))
+            if self.error is not None:
+                raise self.error
+            return [self.texts.get(url, {}).get(selector) for selector in selectors]
+
+    fake = FakeBrowser()
+    monkeypatch.setattr(fetcher, 'fetch_browser_texts', fake.fetch_browser_texts)
+    return fake
+
+
+@pytest.fixture
+def db_handler(tmp_path):
+    from db_handler import DbHandler
+
+    _db_handler = DbHandler(str(tmp_path / 'pricetracker.db'))
+    _db_handler.init_db()
+    yield _db_handler
+    _db_handler.close_db()
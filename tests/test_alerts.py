@@ -0,0 +1,73 @@
+import time
+
+import pandas as pd
+import pytest
+
+from alerts import SINK_FILE, SINK_WEBHOOK, AlertDispatcher, retry_delay
+from db_handler import ALERT_BELOW
+
+
+class RecordingSink:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.sent = []
+
+    def send(self, alert):
+        if self.fail:
+            raise ConnectionError('sink is down')
+        self.sent.append(alert['id'])
+
+
+@pytest.fixture
+def element_id(db_handler):
+    return db_handler.insert_tracked_element(pd.DataFrame([{
+        'name': 'price', 'url': 'http://shop.test/1', 'xpath': '//span', 'regex': r'\d+', 'update_interval': 60,
+        'is_active': 1}]))
+
+
+def trigger(db_handler, element_id, sink, count=1, first=0):
+    # every drop from above to below the threshold fires the rule (with another price, so it isn't deduplicated)
+    db_handler.insert_alert_rule(element_id, ALERT_BELOW, 100, sink, None)
+    now = int(time.time())
+    for i in range(first, first + count):
+        db_handler.insert_price_rows([(element_id, 150 + i, now + 2 * i), (element_id, 50 + i, now + 2 * i + 1)])
+
+
+def test_failed_delivery_is_retried_with_backoff(db_handler, element_id):
+    sink = RecordingSink(fail=True)
+    dispatcher = AlertDispatcher(db_handler.db_path, sinks={SINK_WEBHOOK: sink})
+    trigger(db_handler, element_id, SINK_WEBHOOK)
+    dispatcher.dispatch(db_handler)
+
+    # not due before the backoff is over
+    assert db_handler.retrieve_pending_alerts() == []
+    pending = db_handler.retrieve_pending_alerts(now=int(time.time()) + retry_delay(1))
+    assert [alert['attempts'] for alert in pending] == [1]
+
+    sink.fail = False
+    assert dispatcher.dispatch(db_handler) == 0
+    db_handler.conn.execute('UPDATE alert_events SET next_attempt = 0')
+    assert dispatcher.dispatch(db_handler) == 1
+
+
+def test_backoff_covers_long_outages():
+    assert retry_delay(1) == 30
+    assert sum(retry_delay(attempt) for attempt in range(1, 10)) > 3 * 3600 - 600
+
+
+def test_rate_limited_sink_does_not_hold_up_other_sinks(db_handler, element_id):
+    webhook, file = RecordingSink(), RecordingSink()
+    dispatcher = AlertDispatcher(db_handler.db_path, sinks={SINK_WEBHOOK: webhook, SINK_FILE: file},
+                                 rate_limits={SINK_WEBHOOK: 1}, dedup_window=0)
+    trigger(db_handler, element_id, SINK_WEBHOOK, count=3)
+    dispatcher.dispatch(db_handler)
+    assert len(webhook.sent) == 1
+
+    # the events over the limit wait for the sink, newer events of other sinks are delivered right away
+    trigger(db_handler, element_id, SINK_FILE, first=3)
+    assert dispatcher.dispatch(db_handler) == 1
+    assert len(file.sent) == 1
+    assert len(webhook.sent) == 1
+    waiting = db_handler.conn.execute("SELECT next_attempt, attempts FROM alert_events "
+                                      "WHERE status = 'pending'").fetchall()
+    assert all(next_attempt > time.time() and attempts == 0 for next_attempt, attempts in waiting)
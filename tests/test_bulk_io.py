@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from bulk_io import DEFAULT_UPDATE_INTERVAL, REGEX_DEFAULT_PATTERN, export_tracked_elements, import_tracked_elements
+
+CSV = '''name,url,xpath,regex,update_interval,is_active,fetch_mode,adaptive,min_interval,max_interval
+Laptop,https://shop.test/laptop,//span,,,,,,,
+,https://shop.test/nameless,//span,,,,,,,
+Chair,not a url,//span,,,,,,,
+Desk,https://shop.test/desk,//span,(,,,,,,
+Lamp,https://shop.test/lamp,//span,,0,,,,,
+Sofa,https://shop.test/sofa,//span,,30,no,http,yes,60,10
+Shelf,https://shop.test/shelf,//span,,30,maybe,,,,
+Laptop,https://shop.test/laptop-2,//span,,,,,,,
+Monitor,https://shop.test/monitor,//div,\\d+,15,0,browser,1,5,120
+Phone,https://shop.test/phone,//span,,,,,,,
+Existing,https://shop.test/existing,//span,,,,,,,
+'''
+
+
+@pytest.fixture
+def elements_csv(tmp_path, db_handler):
+    db_handler.insert_tracked_elements([{'name': 'Existing', 'url': 'https://shop.test/old', 'xpath': '//span',
+                                         'regex': r'\d+', 'update_interval': 60, 'is_active': True}])
+    path = tmp_path / 'elements.csv'
+    path.write_text(CSV, encoding='utf-8')
+    return str(path)
+
+
+def test_import_reports_invalid_rows_with_their_line(db_handler, elements_csv):
+    result = import_tracked_elements(db_handler, elements_csv, batch_size=2)
+    assert result['inserted'] == len(result['ids']) == 3
+    assert [line for line, _ in result['errors']] == [3, 4, 5, 6, 7, 8, 9, 12]
+    errors = dict(result['errors'])
+    assert errors[3] == "name is missing"
+    assert errors[6] == "update_interval must be a whole number between 1 and 10080"
+    assert errors[7] == "min_interval can't be greater than max_interval"
+    assert errors[9] == "name 'Laptop' already exists"
+    assert errors[12] == "name 'Existing' already exists"
+
+    df = db_handler.retrieve_tracked_elements().set_index('name')
+    assert sorted(df.index) == ['Existing', 'Laptop', 'Monitor', 'Phone']
+    laptop, monitor = df.loc['Laptop'], df.loc['Monitor']
+    assert (laptop['regex'], laptop['update_interval'], laptop['is_active'], laptop['fetch_mode']) == (
+        REGEX_DEFAULT_PATTERN, DEFAULT_UPDATE_INTERVAL, 1, 'auto')
+    assert (monitor['regex'], monitor['update_interval'], monitor['is_active'], monitor['fetch_mode'],
+            monitor['adaptive'], monitor['min_interval'], monitor['max_interval']) == (
+        r'\d+', 15, 0, 'browser', 1, 5, 120)
+
+
+def test_dry_run_only_validates(db_handler, elements_csv):
+    result = import_tracked_elements(db_handler, elements_csv, dry_run=True)
+    assert (result['inserted'], result['ids'], len(result['errors'])) == (3, [], 8)
+    assert len(db_handler.retrieve_tracked_elements()) == 1
+
+
+def test_import_json_lines_and_export(tmp_path, db_handler):
+    path = tmp_path / 'elements.jsonl'
+    path.write_text('\n'.join([
+        json.dumps({'name': 'Laptop', 'url': 'https://shop.test/laptop', 'xpath': '//span', 'update_interval': 30}),
+        '',
+        json.dumps(['not', 'an', 'object']),
+        json.dumps({'name': 'Chair', 'url': 'https://shop.test/chair', 'xpath': '//span', 'update_interval': 2.5}),
+        json.dumps({'name': 'Desk', 'url': 'https://shop.test/desk', 'xpath': '//span', 'browser_profile': 'x'}),
+    ]), encoding='utf-8')
+    result = import_tracked_elements(db_handler, str(path))
+    assert result['inserted'] == 1
+    assert result['errors'] == [(3, "not an object"),
+                                (4, "update_interval must be a whole number between 1 and 10080"),
+                                (5, "browser_profile must be one of lean, full")]
+
+    # the export can be imported into another database
+    exported = tmp_path / 'exported.json'
+    assert export_tracked_elements(db_handler, str(exported)) == 1
+    records = json.loads(exported.read_text(encoding='utf-8'))
+    assert [(record['name'], record['update_interval']) for record in records] == [('Laptop', 30)]
+
+
+def test_import_json_must_be_an_array(tmp_path, db_handler):
+    path = tmp_path / 'elements.json'
+    path.write_text(json.dumps({'name': 'Laptop'}), encoding='utf-8')
+    with pytest.raises(ValueError):
+        import_tracked_elements(db_handler, str(path))
+    with pytest.raises(ValueError):
+        import_tracked_elements(db_handler, str(tmp_path / 'elements.xml'))
+    assert db_handler.retrieve_tracked_elements().empty
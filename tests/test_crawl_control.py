@@ -0,0 +1,25 @@
+import requests
+
+from crawl_control import CrawlerClient, start_control_server
+
+
+class FailingEngine:
+    def status(self):
+        raise RuntimeError('engine is broken')
+
+    def run_now(self, element_ids):
+        return element_ids
+
+
+def test_engine_error_is_answered_once_with_500():
+    server = start_control_server(FailingEngine(), port=0)
+    url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    try:
+        response = requests.get(url + '/status', timeout=5)
+        assert response.status_code == 500
+        assert response.json() == {'error': 'internal error'}
+        # the connection isn't left with a second response, the next request is answered normally
+        assert CrawlerClient(url).run_now([1, 2]) == [1, 2]
+    finally:
+        server.shutdown()
+        server.server_close()
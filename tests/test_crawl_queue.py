@@ -0,0 +1,63 @@
+import time
+
+WORKER = 'worker-1'
+
+
+def claim(db_handler, worker=WORKER, lease_seconds=60, max_attempts=3):
+    return db_handler.claim_crawl_job(worker, lease_seconds, max_attempts)
+
+
+def test_job_released_until_a_time_is_not_claimed_before(db_handler):
+    db_handler.enqueue_crawl_jobs('shop.test/1', 'http://shop.test/1', [1, 2])
+    url, element_ids, _ = claim(db_handler)
+    assert (url, sorted(element_ids)) == ('http://shop.test/1', [1, 2])
+
+    # the host of the page is failing for another minute
+    db_handler.release_crawl_jobs(WORKER, element_ids, time.time() + 60)
+    assert claim(db_handler) is None
+    with db_handler.conn:
+        db_handler.conn.execute('UPDATE crawl_jobs SET lease_until = ?', (int(time.time()) - 1,))
+    assert sorted(claim(db_handler)[1]) == [1, 2]
+    # the skipped claim didn't count as an attempt
+    assert db_handler.conn.execute('SELECT MAX(attempts) FROM crawl_jobs').fetchone()[0] == 1
+
+
+def expire_leases(db_handler):
+    with db_handler.conn:
+        db_handler.conn.execute('UPDATE crawl_jobs SET lease_until = ? WHERE worker IS NOT NULL',
+                                (int(time.time()) - 1,))
+
+
+def test_expired_lease_is_claimed_by_another_worker(db_handler):
+    db_handler.enqueue_crawl_jobs('shop.test/1', 'http://shop.test/1', [1, 2])
+    # queued elements aren't queued twice
+    db_handler.enqueue_crawl_jobs('shop.test/1', 'http://shop.test/1', [2])
+    assert sorted(claim(db_handler)[1]) == [1, 2]
+    assert claim(db_handler, 'worker-2') is None
+
+    # the heartbeat keeps the lease, without it the page goes to the next worker
+    assert db_handler.heartbeat_crawl_worker(WORKER, 60)
+    assert claim(db_handler, 'worker-2') is None
+    expire_leases(db_handler)
+    assert db_handler.retrieve_crawl_queue_stats()['expired'] == 2
+    assert sorted(claim(db_handler, 'worker-2')[1]) == [1, 2]
+
+    # the first worker lost the lease, its late completion doesn't remove the jobs
+    db_handler.complete_crawl_jobs(WORKER, [1, 2])
+    assert db_handler.retrieve_crawl_queue_stats()['leased'] == 2
+    db_handler.complete_crawl_jobs('worker-2', [1, 2])
+    assert db_handler.retrieve_crawl_queue_stats()['jobs'] == 0
+
+
+def test_jobs_are_dropped_after_max_attempts(db_handler):
+    db_handler.enqueue_crawl_jobs('shop.test/1', 'http://shop.test/1', [1])
+    db_handler.enqueue_crawl_jobs('shop.test/2', 'http://shop.test/2', [2])
+    assert claim(db_handler, max_attempts=2)[1] == [1]
+    # a release without a time counts as an attempt
+    db_handler.release_crawl_jobs(WORKER, [1])
+    assert claim(db_handler, max_attempts=2)[1] == [1]
+    expire_leases(db_handler)
+
+    # the page was claimed twice without completing, the next page is claimed instead
+    assert claim(db_handler, max_attempts=2)[1] == [2]
+    assert [job for job, in db_handler.conn.execute('SELECT tracked_elements_id FROM crawl_jobs')] == [2]
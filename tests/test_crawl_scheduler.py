@@ -0,0 +1,117 @@
+import time
+
+import pandas as pd
+import pytest
+
+from crawl_scheduler import CrawlScheduler, crawl_interval
+
+
+def task(element_id, interval=60):
+    return {'id': element_id, 'url': f'http://shop.test/{element_id}', 'update_interval': interval, 'is_active': 1}
+
+
+def test_postpone_moves_the_next_run_later_and_retry_only_earlier():
+    scheduler = CrawlScheduler()
+    now = time.time()
+    scheduler.add(task(1), now + 600)
+    scheduler.retry([1], now + 1200)
+    assert 599 < scheduler.seconds_until_next(now) <= 600
+    # e.g. the circuit of the host is open longer than the next regular run
+    scheduler.postpone([1], now + 1200)
+    assert 1199 < scheduler.seconds_until_next(now) <= 1200
+    scheduler.retry([1], now + 30)
+    assert 29 < scheduler.seconds_until_next(now) <= 30
+
+
+def test_due_elements_are_popped_in_order_and_rescheduled():
+    scheduler = CrawlScheduler(jitter=0)
+    now = 1_700_000_000
+    for element_id, due in [(1, now + 30), (2, now + 10), (3, now + 20), (4, now + 500)]:
+        scheduler.add(task(element_id), due)
+    # rescheduled and removed elements leave stale heap entries, they are skipped
+    scheduler.add(task(3), now + 5)
+    scheduler.remove(1)
+
+    assert scheduler.pop_due(now + 60) == [(3, 'http://shop.test/3'), (2, 'http://shop.test/2')]
+    assert scheduler.pop_due(now + 60) == []
+    assert scheduler.seconds_until_next(now + 60) == 440
+    # the next run is one interval after the pop, elements due at the same time keep their order
+    assert scheduler.pop_due(now + 60 + 3600) == [(4, 'http://shop.test/4'), (3, 'http://shop.test/3'),
+                                                  (2, 'http://shop.test/2')]
+
+
+def test_schedule_survives_a_restart(db_handler):
+    element_ids = [db_handler.insert_tracked_element(pd.DataFrame([{
+        'name': f'price {i}', 'url': f'http://shop.test/{i}', 'xpath': '//span', 'regex': r'\d+',
+        'update_interval': 60, 'is_active': 1}])) for i in range(3)]
+    now = time.time()
+    scheduler = CrawlScheduler()
+    scheduler.load(db_handler.retrieve_tracked_elements().to_dict('records'), now)
+    # never scheduled elements are spread over their first interval
+    assert all(now <= due <= now + 3600 for due, _ in scheduler.take_dirty())
+
+    scheduler.postpone(element_ids, now + 900)
+    assert db_handler.update_next_due(scheduler.take_dirty())
+    restarted = CrawlScheduler()
+    restarted.load(db_handler.retrieve_tracked_elements().to_dict('records'), now + 60)
+    assert 839 < restarted.seconds_until_next(now + 60) <= 840
+    assert restarted.pop_due(now + 899) == []
+    assert sorted(element_id for element_id, _ in restarted.pop_due(now + 900)) == element_ids
+
+
+def test_overdue_elements_catch_up_at_a_bounded_rate():
+    now = 1_700_000_000
+    tasks = [{**task(element_id), 'next_due': now - 3600 * element_id} for element_id in range(1, 5)]
+    tasks.append({**task(5), 'next_due': now + 600})
+    scheduler = CrawlScheduler(catch_up_per_minute=2)
+    scheduler.load(tasks, now)
+    assert scheduler.overdue(now) == 1
+
+    # the longest overdue first, one every 30 seconds
+    assert [scheduler.pop_due(now + seconds) for seconds in (0, 30, 60, 90)] == [
+        [(4, 'http://shop.test/4')], [(3, 'http://shop.test/3')], [(2, 'http://shop.test/2')],
+        [(1, 'http://shop.test/1')]]
+    assert scheduler.seconds_until_next(now + 90) == 510
+
+
+def adaptive(change_gap, since_change, interval=60, now=1_700_000_000, **bounds):
+    return {**task(1, interval), 'adaptive': 1, 'observations': 20, 'first_timestamp': now - 30 * 24 * 3600,
+            'last_change': now - since_change, 'change_gap': change_gap, **bounds}, now
+
+
+def test_adaptive_interval_follows_the_expected_change_within_bounds():
+    # four crawls per expected change
+    assert crawl_interval(*adaptive(4 * 7200, 600)) == 7200
+    # the time since the last change counts once it is longer than the usual gap
+    assert crawl_interval(*adaptive(600, 4 * 7200)) == 7200
+    # default bounds: a quarter of update_interval up to 16 times of it
+    assert crawl_interval(*adaptive(60, 0)) == 900
+    assert crawl_interval(*adaptive(None, 365 * 24 * 3600)) == 16 * 3600
+    # bounds of the element in minutes, never below a minute and the minimum wins over a smaller maximum
+    assert crawl_interval(*adaptive(60, 0, min_interval=30)) == 1800
+    assert crawl_interval(*adaptive(4 * 86400, 0, max_interval=120)) == 7200
+    assert crawl_interval(*adaptive(0, 0, min_interval=0)) == 60
+    assert crawl_interval(*adaptive(4 * 86400, 0, min_interval=300, max_interval=120)) == 300 * 60
+    # NaN from pandas is a missing value
+    assert crawl_interval(*adaptive(float('nan'), 4 * 7200, min_interval=float('nan'))) == 7200
+
+
+def test_fixed_interval_without_adaptive_or_enough_observations():
+    element, now = adaptive(60, 0)
+    assert crawl_interval({**element, 'adaptive': 0}, now) == 3600
+    assert crawl_interval({**element, 'observations': 4}, now) == 3600
+    assert crawl_interval({**element, 'observations': float('nan')}, now) == 3600
+    assert crawl_interval(task(1, 15)) == 900
+
+
+def test_small_adaptive_changes_dont_reschedule():
+    # sync runs on the current time
+    element, now = adaptive(4 * 7200, 600, now=time.time())
+    scheduler = CrawlScheduler()
+    scheduler.add(element, now + 7000)
+    scheduler.take_dirty()
+    scheduler.sync([{**element, 'change_gap': 4 * 7600}])
+    assert scheduler.take_dirty() == []
+    # a shorter interval takes effect right away
+    scheduler.sync([{**element, 'change_gap': 4 * 3600}])
+    assert [due for due, _ in scheduler.take_dirty()] == [pytest.approx(now + 3600, abs=2)]
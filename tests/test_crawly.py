@@ -0,0 +1,92 @@
+import time
+
+import pandas as pd
+import pytest
+
+import crawly
+from crawl_executor import host_of
+from crawl_scheduler import CrawlScheduler
+from extraction import extract_price
+from host_health import FAILURE_BLOCKED, STATE_OPEN, HostHealth
+from price_writer import PriceWriter
+
+PRICE_REGEX = r'[-+]?\d{1,3}(?:[.,]\d{3})*(?:[.,]\d+)'
+
+
+@pytest.fixture
+def crawl(db_handler, monkeypatch):
+    # crawls the elements like a scheduled run, returns the prices and how often the regex ran
+    monkeypatch.setattr(crawly, 'price_writer', PriceWriter(db_handler.db_path))
+    monkeypatch.setattr(crawly.host_health, 'rate_per_minute', 0)
+    regex_runs = []
+
+    def counting_extract_price(text, pattern):
+        regex_runs.append(text)
+        return extract_price(text, pattern)
+
+    monkeypatch.setattr(crawly, 'extract_price', counting_extract_price)
+
+    def run(element_ids):
+        regex_runs.clear()
+        elements = [db_handler.retrieve_tracked_element_by_id(element_id) for element_id in element_ids]
+        prices = crawly.crawl_page(db_handler, elements)
+        crawly.price_writer.flush()
+        return prices, len(regex_runs)
+
+    return run
+
+
+def add_element(db_handler, name, url, selector='//span[@class="price"]'):
+    return db_handler.insert_tracked_element(pd.DataFrame([{
+        'name': name, 'url': url, 'xpath': selector, 'regex': PRICE_REGEX, 'update_interval': 60, 'is_active': 1,
+        'fetch_mode': 'http'}]))
+
+
+def test_regex_runs_once_per_changed_content(shop, db_handler, crawl):
+    element_ids = [add_element(db_handler, 'price', shop.url + '/plain'),
+                   add_element(db_handler, 'product', shop.url + '/plain', 'div.product')]
+    prices, regex_runs = crawl(element_ids)
+    assert prices == [1234.56, 1234.56]
+    assert regex_runs == 2
+
+    # same content, the stored price is confirmed without the regex
+    prices, regex_runs = crawl(element_ids)
+    assert prices == [1234.56, 1234.56]
+    assert regex_runs == 0
+
+
+def test_not_modified_page_confirms_the_price(shop, db_handler, crawl):
+    element_ids = [add_element(db_handler, 'price', shop.url + '/static')]
+    assert crawl(element_ids) == ([1234.56], 1)
+    assert crawl(element_ids) == ([1234.56], 0)
+    assert shop.requests[-1][1]['If-None-Match'] == '"v1"'
+
+
+def test_page_without_any_element_counts_as_blocked(shop, db_handler, crawl, monkeypatch):
+    # e.g. a captcha that is served with 200
+    monkeypatch.setattr(crawly, 'host_health', HostHealth(rate_per_minute=0, failure_threshold=2))
+    element_ids = [add_element(db_handler, 'price', shop.url + '/js')]
+    assert crawl(element_ids) == ([-1], 0)
+    assert crawl(element_ids) == ([-1], 0)
+
+    host = host_of(shop.url)
+    assert crawly.host_health.state(host) == STATE_OPEN
+    state, = crawly.host_health.take_dirty()
+    assert (state['blocked'], state['last_failure_kind']) == (2, FAILURE_BLOCKED)
+
+
+def test_page_over_the_host_rate_is_rescheduled(shop, db_handler, crawl, monkeypatch):
+    monkeypatch.setattr(crawly, 'host_health', HostHealth(rate_per_minute=1, burst=1))
+    scheduler = CrawlScheduler()
+    monkeypatch.setattr(crawly, 'crawl_scheduler', scheduler)
+    element_id = add_element(db_handler, 'price', shop.url + '/plain')
+    scheduler.add(db_handler.retrieve_tracked_element_by_id(element_id), time.time() + 3600)
+
+    assert crawl([element_id]) == ([1234.56], 1)
+    for _ in range(2):
+        # no request and no waiting thread, the page comes up again when the host has a token (none is taken)
+        start = time.monotonic()
+        assert crawl([element_id]) == ([-1], 0)
+        assert time.monotonic() - start < 1
+        assert 55 < scheduler.seconds_until_next() <= 60
+    assert len(shop.requests) == 1
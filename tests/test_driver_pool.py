@@ -0,0 +1,46 @@
+from crawl_options import BROWSER_PROFILE_FULL, BROWSER_PROFILE_LEAN
+from driver_pool import DriverPool
+
+
+class FakeDriver:
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.window_handles = ['main']
+        self.switch_to = self
+        self.quit_called = False
+
+    def window(self, handle):
+        pass
+
+    def execute_script(self, script):
+        pass
+
+    def delete_all_cookies(self):
+        pass
+
+    def get(self, url):
+        pass
+
+    def quit(self):
+        self.quit_called = True
+
+
+def test_idle_browser_of_another_profile_is_recycled():
+    pool = DriverPool(size=1, driver_factory=FakeDriver)
+    with pool.driver(BROWSER_PROFILE_LEAN) as lean:
+        pass
+    with pool.driver(BROWSER_PROFILE_FULL) as full:
+        assert full.profile == BROWSER_PROFILE_FULL
+    assert lean.quit_called
+    stats = pool.stats()
+    assert (stats['launches'], stats['recycles'], stats['alive'], stats['idle']) == (2, 1, 1, 1)
+
+
+def test_recycle_is_only_counted_for_a_quit_browser():
+    pool = DriverPool(size=1, driver_factory=FakeDriver)
+    # the lean browser is checked out by another task, there is no idle one to replace
+    pool._checkout(BROWSER_PROFILE_LEAN)
+    pool._checkout(BROWSER_PROFILE_FULL)
+    stats = pool.stats()
+    assert (stats['launches'], stats['recycles'], stats['quits']) == (2, 0, 0)
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+import db_handler as db_handler_module
+from db_handler import DbHandler
+
+
+def add_elements(db_handler, names):
+    return [db_handler.insert_tracked_element(pd.DataFrame([{
+        'name': name, 'url': f'http://shop{i}.example/item', 'xpath': '//span', 'regex': r'\d+',
+        'update_interval': 60, 'is_active': 1}])) for i, name in enumerate(names)]
+
+
+def test_duplicate_names_are_renamed_to_unique_names(tmp_path, monkeypatch):
+    db_handler = DbHandler(str(tmp_path / 'pricetracker.db'))
+    search_migration = db_handler_module.MIGRATIONS.index(db_handler_module._element_search)
+    monkeypatch.setattr(db_handler_module, 'MIGRATIONS', db_handler_module.MIGRATIONS[:search_migration])
+    db_handler.init_db()
+    # the appended id of the third element is the name of the second one
+    db_handler.conn.executemany('''INSERT INTO tracked_elements (name, url, xpath, regex, update_interval, is_active) 
+                                   VALUES (?, 'http://shop.example/item', '//span', '\\d+', 60, 1)''',
+                                [(name,) for name in ['Laptop', 'Laptop (3)', 'Laptop', 'Laptop']])
+    db_handler.conn.commit()
+
+    monkeypatch.undo()
+    db_handler.migrate()
+    names = db_handler.conn.execute('SELECT name FROM tracked_elements ORDER BY id').fetchall()
+    assert [name for name, in names] == ['Laptop', 'Laptop (3)', 'Laptop (3, 2)', 'Laptop (4)']
+    db_handler.close_db()
+
+
+def test_search_without_trigram_tokenizer(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_handler_module, 'FTS_TRIGRAM', False)
+    db_handler = DbHandler(str(tmp_path / 'pricetracker.db'))
+    db_handler.init_db()
+    add_elements(db_handler, ['Gaming Laptop', 'Office Chair', 'Laptop Bag'])
+    assert not db_handler.conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'tracked_elements_fts'").fetchall()
+
+    df, total = db_handler.search_tracked_elements('lapt')
+    assert (sorted(df['name']), total) == (['Gaming Laptop', 'Laptop Bag'], 2)
+    df, total = db_handler.search_tracked_elements('shop1 ch')
+    assert (list(df['name']), total) == (['Office Chair'], 1)
+    db_handler.close_db()
+
+
+@pytest.mark.skipif(not db_handler_module.FTS_TRIGRAM, reason="SQLite without the trigram tokenizer")
+def test_search_with_trigram_index(db_handler):
+    add_elements(db_handler, ['Gaming Laptop', 'Office Chair', 'Laptop Bag'])
+    df, total = db_handler.search_tracked_elements('LAPTOP g')
+    assert (sorted(df['name']), total) == (['Gaming Laptop', 'Laptop Bag'], 2)
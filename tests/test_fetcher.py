@@ -0,0 +1,174 @@
+from crawl_options import FETCH_MODE_AUTO, FETCH_MODE_BROWSER, FETCH_MODE_HTTP
+from extraction import extract_price
+from fetcher import fetch_element_text, fetch_elements_text, fetch_http_page, page_validators
+from host_health import FAILURE_BLOCKED, FAILURE_ERROR
+
+PRICE_SELECTOR = '//span[@class="price"]'
+PRICE_REGEX = r'[-+]?\d{1,3}(?:[.,]\d{3})*(?:[.,]\d+)'
+
+
+def has_price(text, fetch_mode=None):
+    return extract_price(text, PRICE_REGEX) is not None
+
+
+def element(selector=PRICE_SELECTOR, fetch_mode=FETCH_MODE_AUTO, detected_mode=None, accept=has_price):
+    return selector, fetch_mode, detected_mode, accept, None
+
+
+def test_http_tier_reads_the_initial_html(shop, browser):
+    text, mode = fetch_element_text(None, shop.url + '/static', PRICE_SELECTOR, FETCH_MODE_HTTP)
+    assert text == '1.234,56 €'
+    assert mode == FETCH_MODE_HTTP
+    assert browser.calls == []
+
+
+def test_http_tier_falls_back_to_css_selectors(shop, browser):
+    text, mode = fetch_element_text(None, shop.url + '/static', 'div.product span.price', FETCH_MODE_HTTP)
+    assert text == '1.234,56 €'
+    assert mode == FETCH_MODE_HTTP
+
+
+def test_page_is_requested_once_for_all_elements(shop, browser):
+    results, page = fetch_elements_text(None, shop.url + '/static', [element(), element('div.product')])
+    assert [mode for _, mode in results] == [FETCH_MODE_HTTP, FETCH_MODE_HTTP]
+    assert len(shop.requests) == 1
+    assert page['error'] is None
+
+
+def test_auto_mode_falls_back_to_the_browser(shop, browser):
+    url = shop.url + '/js'
+    browser.texts[url] = {PRICE_SELECTOR: '19,99 €'}
+    text, mode = fetch_element_text(None, url, PRICE_SELECTOR, FETCH_MODE_AUTO)
+    assert (text, mode) == ('19,99 €', FETCH_MODE_BROWSER)
+    assert len(browser.calls) == 1
+
+
+def test_auto_mode_falls_back_if_the_text_is_rejected(shop, browser):
+    url = shop.url + '/static'
+    browser.texts[url] = {PRICE_SELECTOR: '19,99 €'}
+    results, _ = fetch_elements_text(None, url, [element(accept=lambda text, mode=None: False)])
+    # the browser text is rejected as well, the last text is returned without a mode
+    assert results == [('19,99 €', None)]
+    assert len(browser.calls) == 1
+
+
+def test_detected_browser_mode_skips_the_http_request(shop, browser):
+    url = shop.url + '/js'
+    browser.texts[url] = {PRICE_SELECTOR: '19,99 €'}
+    results, _ = fetch_elements_text(None, url, [element(detected_mode=FETCH_MODE_BROWSER)])
+    assert results == [('19,99 €', FETCH_MODE_BROWSER)]
+    assert shop.requests == []
+
+
+def test_http_mode_never_launches_the_browser(shop, browser):
+    results, _ = fetch_elements_text(None, shop.url + '/js', [element(fetch_mode=FETCH_MODE_HTTP)])
+    assert results == [(None, None)]
+    assert browser.calls == []
+
+
+def test_empty_body_falls_back_to_the_browser(shop, browser):
+    url = shop.url + '/empty'
+    browser.texts[url] = {PRICE_SELECTOR: '19,99 €'}
+    results, page = fetch_elements_text(None, url, [element()])
+    assert results == [('19,99 €', FETCH_MODE_BROWSER)]
+    assert page['error'] is None
+
+
+def test_http_errors_are_classified(shop, browser):
+    results, page = fetch_elements_text(None, shop.url + '/error', [element(fetch_mode=FETCH_MODE_HTTP)])
+    assert results == [(None, None)]
+    assert page['error'][0] == FAILURE_ERROR
+
+    _, page = fetch_elements_text(None, shop.url + '/blocked', [element(fetch_mode=FETCH_MODE_HTTP)])
+    assert page['error'][0] == FAILURE_BLOCKED
+
+
+def test_http_error_falls_back_to_the_browser(shop, browser):
+    url = shop.url + '/error'
+    browser.texts[url] = {PRICE_SELECTOR: '19,99 €'}
+    results, _ = fetch_elements_text(None, url, [element()])
+    assert results == [('19,99 €', FETCH_MODE_BROWSER)]
+
+
+def test_response_validators(shop):
+    document, validators = fetch_http_page(shop.url + '/static')
+    assert document is not None
+    assert validators == ('"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT')
+
+
+def test_conditional_request_not_modified(shop, browser):
+    url = shop.url + '/static'
+    validators = ('"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT')
+    results, page = fetch_elements_text(None, url, [element(), element('div.product')], validators)
+    assert page['not_modified']
+    assert page['validators'] == validators
+    # the previous prices are still valid, nothing is parsed and the browser isn't needed
+    assert results == [(None, FETCH_MODE_HTTP), (None, FETCH_MODE_HTTP)]
+    assert browser.calls == []
+    assert shop.requests[0][1]['If-None-Match'] == '"v1"'
+    assert shop.requests[0][1]['If-Modified-Since'] == 'Mon, 01 Jan 2024 00:00:00 GMT'
+
+
+def test_conditional_request_modified(shop, browser):
+    results, page = fetch_elements_text(None, shop.url + '/static', [element()], ('"v0"', None))
+    assert not page['not_modified']
+    assert results == [('1.234,56 €', FETCH_MODE_HTTP)]
+    assert page['validators'] == ('"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT')
+    assert 'If-Modified-Since' not in shop.requests[0][1]
+
+
+def test_unconditional_request_without_validators(shop, browser):
+    fetch_elements_text(None, shop.url + '/static', [element()])
+    assert 'If-None-Match' not in shop.requests[0][1]
+
+
+def test_page_validators():
+    state = {'etag': '"v1"', 'last_modified': None}
+    assert page_validators([state, dict(state)]) == ('"v1"', None)
+    # one of the elements wasn't confirmed by the same response
+    assert page_validators([state, {'etag': '"v2"', 'last_modified': None}]) is None
+    assert page_validators([state, None]) is None
+    assert page_validators([{'etag': None, 'last_modified': None}]) is None
+
+
+def test_browser_failure_keeps_the_http_results(shop, browser):
+    from selenium.common import WebDriverException
+
+    browser.error = WebDriverException('browser crashed')
+    results, page = fetch_elements_text(None, shop.url + '/static', [element(), element('//span[@class="js"]')])
+    assert results == [('1.234,56 €', FETCH_MODE_HTTP), (None, None)]
+    assert page['error'] == (FAILURE_ERROR, 'browser crashed')
+
+
+def test_async_engine_runs_the_same_fetch_loop(shop, browser, monkeypatch):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    import aiohttp
+
+    import async_crawly
+    import page_snapshots
+    from crawly import fetch_args
+
+    monkeypatch.setattr(async_crawly, 'fetch_browser_texts', browser.fetch_browser_texts)
+    monkeypatch.setattr(page_snapshots, 'snapshot_scheduled_crawls', False)
+    engine = async_crawly.AsyncCrawly.__new__(async_crawly.AsyncCrawly)
+    engine._browser_executor = ThreadPoolExecutor(1)
+    browser.texts[shop.url + '/empty'] = {PRICE_SELECTOR: '19,99 €'}
+    validators = ('"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT')
+
+    def tracked_element(url):
+        return {'url': url, 'xpath': PRICE_SELECTOR, 'regex': PRICE_REGEX, 'fetch_mode': FETCH_MODE_AUTO}
+
+    async def fetch(path, page_validators=None):
+        async with aiohttp.ClientSession() as session:
+            elements = [fetch_args(tracked_element(shop.url + path))]
+            return await engine._fetch_elements_text(session, shop.url + path, elements, page_validators)
+
+    assert asyncio.run(fetch('/static'))[0] == [('1.234,56 €', FETCH_MODE_HTTP)]
+    results, page = asyncio.run(fetch('/static', validators))
+    assert page['not_modified'] and results == [(None, FETCH_MODE_HTTP)]
+    results, page = asyncio.run(fetch('/empty'))
+    assert results == [('19,99 €', FETCH_MODE_BROWSER)] and page['error'] is None
+    results, page = asyncio.run(fetch('/blocked'))
+    assert page['error'][0] == FAILURE_BLOCKED
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+import db_handler as db_handler_module
+from db_handler import MIGRATIONS, DbHandler, to_epoch
+
+
+def test_migrate_database_without_version(tmp_path):
+    # a database of a version without migrations, timestamps are local time strings
+    db_handler = DbHandler(str(tmp_path / 'pricetracker.db'))
+    db_handler.connect()
+    db_handler_module._create_tables(db_handler.conn.cursor())
+    db_handler.conn.execute('''INSERT INTO tracked_elements (id, name, url, xpath, update_interval, regex) 
+                               VALUES (1, 'price', 'http://shop.test/item', '//span', 60, '\\d+')''')
+    db_handler.conn.executemany('''INSERT INTO price_history (tracked_elements_id, current_price, timestamp) 
+                                   VALUES (1, ?, ?)''', [(10, '2024-03-01 12:00:00'), (12, '2024-03-01 13:30:00')])
+    db_handler.conn.commit()
+
+    db_handler.migrate()
+    assert db_handler.conn.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+    rows = db_handler.conn.execute('''SELECT current_price, timestamp, last_seen, typeof(timestamp) 
+                                      FROM price_history ORDER BY timestamp''').fetchall()
+    first, second = to_epoch('2024-03-01 12:00:00'), to_epoch('2024-03-01 13:30:00')
+    assert rows == [(10, first, first, 'integer'), (12, second, second, 'integer')]
+    assert db_handler.conn.execute('SELECT fetch_mode FROM tracked_elements').fetchone() == ('auto',)
+    assert db_handler.conn.execute('''SELECT COUNT(*), SUM(count) FROM price_rollup 
+                                      WHERE resolution = 'hour' ''').fetchone() == (2, 2)
+    assert db_handler.conn.execute('''SELECT first_timestamp, last_timestamp, last_price, observations 
+                                      FROM crawl_stats''').fetchone() == (first, second, 12, 2)
+
+    # running it again doesn't change anything
+    db_handler.migrate()
+    assert db_handler.conn.execute('SELECT COUNT(*) FROM price_history').fetchone()[0] == 2
+    db_handler.close_db()
+
+
+def test_migrate_from_intermediate_version(tmp_path, monkeypatch):
+    db_handler = DbHandler(str(tmp_path / 'pricetracker.db'))
+    price_runs = MIGRATIONS.index(db_handler_module._price_runs)
+    monkeypatch.setattr(db_handler_module, 'MIGRATIONS', MIGRATIONS[:price_runs + 1])
+    db_handler.init_db()
+    assert db_handler.conn.execute('PRAGMA user_version').fetchone()[0] == price_runs + 1
+    db_handler.conn.execute('''INSERT INTO tracked_elements (id, name, url, xpath, update_interval, regex) 
+                               VALUES (1, 'price', 'http://shop.test/item', '//span', 60, '\\d+')''')
+    # one run confirmed an hour later and a change
+    db_handler.conn.executemany('''INSERT INTO price_history (tracked_elements_id, current_price, timestamp, last_seen) 
+                                   VALUES (1, ?, ?, ?)''', [(10, 7200, 10800), (12, 14400, 14400)])
+    db_handler.conn.commit()
+
+    monkeypatch.undo()
+    db_handler.migrate()
+    assert db_handler.conn.execute('PRAGMA user_version').fetchone()[0] == len(MIGRATIONS)
+    assert db_handler.get_data_version() == 0
+    assert db_handler.conn.execute('''SELECT bucket, count, last_price FROM price_rollup 
+                                      WHERE resolution = 'hour' ORDER BY bucket''').fetchall() == [
+        (7200, 1, 10), (10800, 1, 10), (14400, 1, 12)]
+    assert db_handler.conn.execute('''SELECT last_timestamp, last_price, last_change, observations, changes 
+                                      FROM crawl_stats''').fetchone() == (14400, 12, 14400, 3, 1)
+    db_handler.close_db()
+
+
+def test_to_epoch():
+    local = datetime(2024, 3, 1, 12, 0)
+    epoch = int(local.timestamp())
+    assert to_epoch(epoch) == epoch
+    assert to_epoch(np.int64(epoch)) == epoch
+    assert type(to_epoch(np.int64(epoch))) is int
+    # naive values are local time
+    assert to_epoch(local) == epoch
+    assert to_epoch('2024-03-01 12:00:00') == epoch
+    assert to_epoch(pd.Timestamp('2024-03-01 12:00:00')) == epoch
+    aware = datetime(2024, 3, 1, 12, 0, tzinfo=timezone(timedelta(hours=2)))
+    assert to_epoch(aware) == to_epoch(pd.Timestamp(aware)) == int(aware.timestamp())
@@ -0,0 +1,74 @@
+import time
+
+import pandas as pd
+import pytest
+
+from db_handler import HISTORY_MODE_CHANGES
+
+pytest.importorskip('pyarrow')
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+@pytest.fixture
+def element_ids(db_handler):
+    return [db_handler.insert_tracked_element(pd.DataFrame([{
+        'name': f'price {i}', 'url': f'http://shop.test/{i}', 'xpath': '//span', 'regex': r'\d+',
+        'update_interval': 60, 'is_active': 1}])) for i in range(3)]
+
+
+def exported(db_handler, element_ids=None, start=None, chunk_size=2):
+    chunks = list(db_handler.iter_price_history(element_ids, start, chunk_size=chunk_size))
+    assert all(len(chunk) <= chunk_size for chunk in chunks)
+    df = pd.concat(chunks, ignore_index=True)
+    return list(zip(df['tracked_elements_id'], df['current_price'], df['timestamp']))
+
+
+def test_export_includes_archived_runs(db_handler, element_ids):
+    now = int(time.time())
+    first, second, third = element_ids
+    db_handler.insert_price_rows([(first, 10, now - 30 * DAY), (first, 11, now - 20 * DAY), (first, 12, now),
+                                  (second, 20, now - 30 * DAY),
+                                  (third, 30, now - 30 * DAY), (third, 31, now)])
+    before = exported(db_handler)
+
+    result = db_handler.archive_price_history(older_than_days=10, vacuum=False)
+    assert result['rows'] == 4
+    assert db_handler.conn.execute('SELECT COUNT(*) FROM price_history').fetchone()[0] == 2
+    assert exported(db_handler) == before
+    assert exported(db_handler, [third, second]) == [row for row in before if row[0] != first]
+    # the range ends after the archived boundary, the archive isn't read
+    assert exported(db_handler, start=now - DAY) == [(first, 12, now), (third, 31, now)]
+
+
+def rollup_totals(db_handler, element_id):
+    # observations and their sum per resolution
+    return {resolution: (count, total) for resolution, count, total in db_handler.conn.execute(
+        '''SELECT resolution, SUM(count), SUM(sum_price) FROM price_rollup WHERE tracked_elements_id = ? 
+           GROUP BY resolution''', (element_id,))}
+
+
+def test_backfill_keeps_archived_statistics(db_handler, element_ids):
+    now = int(time.time())
+    element_id = element_ids[0]
+    db_handler.set_history_mode(HISTORY_MODE_CHANGES)
+    # one run of three crawls, rollups count every crawl
+    db_handler.insert_price_rows([(element_id, 5, now - 30 * DAY), (element_id, 50, now - 20 * DAY),
+                                  (element_id, 12, now - 3 * HOUR), (element_id, 12, now - 2 * HOUR),
+                                  (element_id, 12, now - HOUR), (element_id, 13, now)])
+    db_handler.archive_price_history(older_than_days=10, vacuum=False)
+    before = rollup_totals(db_handler, element_id)
+
+    result = db_handler.backfill_prices(element_id, [(now, 14), (now - 5 * HOUR, 11)], window=60)
+    assert (result['corrected'], result['filled']) == (1, 1)
+    stats = db_handler.conn.execute('''SELECT last_price, min_price, max_price FROM crawl_stats 
+                                       WHERE tracked_elements_id = ?''', (element_id,)).fetchone()
+    assert stats == (14, 5, 50)
+
+    # the filled in crawl is added, the corrected one keeps its count, nothing else changes
+    assert rollup_totals(db_handler, element_id) == {
+        resolution: (count + 1, pytest.approx(total + 11 + 1)) for resolution, (count, total) in before.items()}
+    # the archived weeks are untouched
+    archived = db_handler.retrieve_price_rollup([element_id], 'week', end=now - 10 * DAY)
+    assert sorted(archived['min_price']) == [5, 50]
@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from db_handler import HISTORY_MODE_CHANGES, HISTORY_MODE_FULL
+
+HOUR = 3600
+START = 1_700_000_000
+
+
+@pytest.fixture
+def element_id(db_handler):
+    return db_handler.insert_tracked_element(pd.DataFrame([{
+        'name': 'price', 'url': 'http://shop.test/item', 'xpath': '//span', 'regex': r'\d+',
+        'update_interval': 60, 'is_active': 1}]))
+
+
+def runs(db_handler, element_id):
+    return db_handler.conn.execute('''SELECT current_price, timestamp, last_seen FROM price_history 
+                                      WHERE tracked_elements_id = ? ORDER BY timestamp''', (element_id,)).fetchall()
+
+
+def test_changes_mode_stores_runs(db_handler, element_id):
+    db_handler.set_history_mode(HISTORY_MODE_CHANGES)
+    prices = [10, 10, 10, 12, 10]
+    db_handler.insert_price_rows([(element_id, price, START + i * HOUR) for i, price in enumerate(prices)])
+    assert runs(db_handler, element_id) == [(10, START, START + 2 * HOUR), (12, START + 3 * HOUR, START + 3 * HOUR),
+                                            (10, START + 4 * HOUR, START + 4 * HOUR)]
+
+
+def test_changes_mode_extends_the_run_of_an_earlier_batch(db_handler, element_id):
+    db_handler.set_history_mode(HISTORY_MODE_CHANGES)
+    db_handler.insert_price_rows([(element_id, 10, START)])
+    db_handler.insert_price_rows([(element_id, 10, START + HOUR)])
+    db_handler.insert_price_rows([(element_id, 10, START + 2 * HOUR)])
+    assert runs(db_handler, element_id) == [(10, START, START + 2 * HOUR)]
+
+    # a late price of the run doesn't move last_seen back
+    db_handler.insert_price_rows([(element_id, 10, START + HOUR)])
+    assert runs(db_handler, element_id) == [(10, START, START + 2 * HOUR)]
+
+
+def test_full_mode_stores_every_price(db_handler, element_id):
+    db_handler.set_history_mode(HISTORY_MODE_FULL)
+    db_handler.insert_price_rows([(element_id, 10, START + i * HOUR) for i in range(3)])
+    assert runs(db_handler, element_id) == [(10, START + i * HOUR, START + i * HOUR) for i in range(3)]
+
+
+def test_compact_full_history_into_runs(db_handler, element_id):
+    prices = [10, 10, 12, 12, 10]
+    db_handler.insert_price_rows([(element_id, price, START + i * HOUR) for i, price in enumerate(prices)])
+    db_handler.set_history_mode(HISTORY_MODE_CHANGES, compact=True)
+    assert runs(db_handler, element_id) == [(10, START, START + HOUR), (12, START + 2 * HOUR, START + 3 * HOUR),
+                                            (10, START + 4 * HOUR, START + 4 * HOUR)]
+
+    # the first run is expanded into its first and last crawl
+    df = db_handler.retrieve_price_history([element_id], expand=True)
+    assert list(df['current_price']) == [10, 10, 12, 12, 10]
+    assert list(df['price_changed']) == [True, False, True, False, True]
@@ -0,0 +1,69 @@
+import random
+
+import pandas as pd
+import pytest
+
+import db_handler as db_handler_module
+from db_handler import HISTORY_MODE_CHANGES
+
+HOUR = 3600
+DAY = 24 * HOUR
+START = 1_700_000_000
+
+
+@pytest.fixture
+def element_ids(db_handler):
+    return [db_handler.insert_tracked_element(pd.DataFrame([{
+        'name': f'price {i}', 'url': f'http://shop.test/{i}', 'xpath': '//span', 'regex': r'\d+',
+        'update_interval': 60, 'is_active': 1}])) for i in range(2)]
+
+
+def rollups(db_handler, columns='min_price, max_price, last_price, last_timestamp, sum_price, count'):
+    return db_handler.conn.execute(f'''SELECT tracked_elements_id, resolution, bucket, {columns} FROM price_rollup 
+                                       ORDER BY tracked_elements_id, resolution, bucket''').fetchall()
+
+
+def rebuilt(db_handler, columns=None):
+    with db_handler.conn:
+        db_handler_module._rebuild_rollups(db_handler.conn.cursor())
+    return rollups(db_handler) if columns is None else rollups(db_handler, columns)
+
+
+def crawls(element_ids, count=200):
+    # several crawls per hour over more than two weeks, not in order
+    rng = random.Random(7)
+    rows = [(rng.choice(element_ids), rng.choice([9.5, 10, 11, 12.25]), START + rng.randrange(20 * DAY))
+            for _ in range(count)]
+    return rows[:count // 2], rows[count // 2:]
+
+
+def test_incremental_rollups_match_rebuild(db_handler, element_ids):
+    first, second = crawls(element_ids)
+    db_handler.insert_price_rows(first)
+    db_handler.insert_price_rows(second)
+    incremental = rollups(db_handler)
+    assert {resolution for _, resolution, *_ in incremental} == {'hour', 'day', 'week'}
+    assert sum(row[-1] for row in incremental if row[1] == 'week') == 200
+    assert incremental == rebuilt(db_handler)
+
+
+def test_incremental_rollups_of_runs(db_handler, element_ids):
+    # runs only store their first and last crawl, the rollups count every crawl. prices and times are the same
+    # as long as no run spans two buckets (the crawls in between aren't stored)
+    db_handler.set_history_mode(HISTORY_MODE_CHANGES)
+    element_id = element_ids[0]
+    db_handler.insert_price_rows([(element_id, price, START - START % HOUR + i * 300)
+                                  for i, price in enumerate([10, 10, 10, 12, 12, 10, 10, 10, 10, 11])])
+    assert [row[-1] for row in rollups(db_handler, 'count')] == [10, 10, 10]
+    columns = 'min_price, max_price, last_price, last_timestamp'
+    assert rollups(db_handler, columns) == rebuilt(db_handler, columns)
+
+
+def test_late_crawl_keeps_the_last_price(db_handler, element_ids):
+    element_id = element_ids[0]
+    bucket = START - START % HOUR
+    db_handler.insert_price_rows([(element_id, 10, bucket + 600), (element_id, 12, bucket + 1200)])
+    db_handler.insert_price_rows([(element_id, 8, bucket + 300)])
+    assert db_handler.conn.execute('''SELECT min_price, max_price, last_price, last_timestamp, sum_price, count 
+                                      FROM price_rollup WHERE resolution = 'hour' ''').fetchall() == [
+        (8, 12, 12, bucket + 1200, 30, 3)]
@@ -0,0 +1,37 @@
+import sqlite3
+import time
+
+import pandas as pd
+
+import price_writer
+from price_writer import PriceWriter
+
+
+def test_batch_that_keeps_failing_does_not_block_the_writer(db_handler, monkeypatch):
+    monkeypatch.setattr(price_writer, 'RETRY_BASE_DELAY', 0.01)
+    element_id = db_handler.insert_tracked_element(pd.DataFrame([{
+        'name': 'price', 'url': 'http://shop.test/1', 'xpath': '//span', 'regex': r'\d+', 'update_interval': 60,
+        'is_active': 1}]))
+    # a row that can never be written
+    db_handler.conn.execute('''CREATE TRIGGER reject_price BEFORE INSERT ON price_history 
+                               WHEN new.current_price < 0 BEGIN SELECT RAISE(ABORT, 'bad row'); END''')
+    writer = PriceWriter(db_handler.db_path, flush_interval=0.05)
+    now = int(time.time())
+    for i, price in enumerate([10, -1, 11, 12]):
+        writer.put(element_id, price, now + i)
+    assert writer.flush(10)
+
+    prices = db_handler.conn.execute('SELECT current_price FROM price_history ORDER BY timestamp').fetchall()
+    assert [price for price, in prices] == [10, 11, 12]
+    assert writer.stats()['dropped_rows'] == 1
+
+    # later prices are written as usual
+    writer.put(element_id, 13, now + 10)
+    assert writer.flush(10)
+    assert db_handler.conn.execute('SELECT COUNT(*) FROM price_history').fetchone()[0] == 4
+
+
+def test_only_a_locked_database_is_transient():
+    assert price_writer.is_transient(sqlite3.OperationalError('database is locked'))
+    assert not price_writer.is_transient(sqlite3.OperationalError('no such table: price_history'))
+    assert not price_writer.is_transient(sqlite3.IntegrityError('UNIQUE constraint failed'))
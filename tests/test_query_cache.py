@@ -0,0 +1,30 @@
+import time
+
+import pandas as pd
+
+from db_handler import CRAWL_STATUS_FAILING, CRAWL_STATUS_NO_PRICE, CRAWL_STATUS_OK
+from query_cache import CachedReads, QueryCache
+
+
+def statuses(reads):
+    return {status: reads.search_tracked_elements(status=status)[1]
+            for status in (CRAWL_STATUS_OK, CRAWL_STATUS_NO_PRICE, CRAWL_STATUS_FAILING)}
+
+
+def test_status_filter_sees_missing_prices_and_host_health(db_handler):
+    element_id = db_handler.insert_tracked_element(pd.DataFrame([{
+        'name': 'price', 'url': 'http://shop.test/item', 'xpath': '//span', 'regex': r'\d+',
+        'update_interval': 60, 'is_active': 1}]))
+    db_handler.insert_price_rows([(element_id, 10, int(time.time()))])
+    reads = CachedReads(db_handler, QueryCache())
+    assert statuses(reads) == {CRAWL_STATUS_OK: 1, CRAWL_STATUS_NO_PRICE: 0, CRAWL_STATUS_FAILING: 0}
+
+    assert db_handler.record_missing_prices([element_id])
+    assert statuses(reads) == {CRAWL_STATUS_OK: 0, CRAWL_STATUS_NO_PRICE: 1, CRAWL_STATUS_FAILING: 0}
+
+    assert db_handler.update_host_health([{
+        'host': 'shop.test', 'state': 'open', 'consecutive_failures': 5, 'open_until': int(time.time()) + 60,
+        'cooldown': 60, 'successes': 0, 'timeouts': 5, 'blocked': 0, 'errors': 0, 'selector_misses': 0,
+        'regex_misses': 0, 'last_success': None, 'last_failure': int(time.time()), 'last_failure_kind': 'timeout',
+        'last_error': None}])
+    assert statuses(reads) == {CRAWL_STATUS_OK: 0, CRAWL_STATUS_NO_PRICE: 0, CRAWL_STATUS_FAILING: 1}